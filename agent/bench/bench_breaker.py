@@ -0,0 +1,114 @@
+"""
+Benchmark: answers during an upstream outage, with and without the model circuit breaker
+Sends CLM requests at a fixed rate against the stand-in model through three phases (healthy, failing after a
+slow wait, recovered), once with the breaker off and once on, and reports per phase how long answers took and how many
+were full, degraded (static catalog answers) or errors.
+
+Run from the agent/ directory:
+    python -m bench.bench_breaker [--requests 150] [--rate 10] [--outage-first-token-ms 3000]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "unused-by-this-benchmark")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Short enough that the recovered phase sees the half-open probe close the circuit
+os.environ.setdefault("BREAKER_OPEN_SECONDS", "2")
+
+import httpx
+
+from src.agent import CLM_ERROR_MESSAGE, agent, model_breaker
+from src.breaker import BREAKER_OPEN_SECONDS, BreakerModel, BreakerStats
+from src.degraded import DEGRADED_PREFIX
+from src.metrics import TimedModel
+
+from .bench_load import QUESTIONS, Server, percentiles, sse_payloads
+from .standin import StandInConfig, StandInModel
+
+
+async def ask(client: httpx.AsyncClient, index: int) -> tuple[float, str]:
+    """One single-turn CLM request; its latency and whether the answer was full, degraded or an error."""
+    # A fresh session and question each time, so nothing is served from the answer cache
+    question = f"{QUESTIONS[index % len(QUESTIONS)]} ({index})"
+    started = time.perf_counter()
+    response = await client.post(
+        "/chat/completions",
+        params={"custom_session_id": f"breaker-{index}", "output": "markdown"},
+        json={"messages": [{"role": "user", "content": question}], "stream": True},
+    )
+    latency = (time.perf_counter() - started) * 1000
+    reply = "".join(
+        (payload["choices"][0]["delta"].get("content") or "") for payload in sse_payloads(response.content)
+        if payload.get("choices")
+    )
+    if response.status_code != 200 or reply.startswith(CLM_ERROR_MESSAGE):
+        return latency, "error"
+    return latency, "degraded" if reply.startswith(DEGRADED_PREFIX) else "full"
+
+
+async def phase(client: httpx.AsyncClient, first: int, requests: int, rate: float) -> dict:
+    # Open loop: arrivals do not wait for earlier answers, as with independent callers
+    tasks = []
+    for i in range(requests):
+        tasks.append(asyncio.create_task(ask(client, first + i)))
+        await asyncio.sleep(1 / rate)
+    results = await asyncio.gather(*tasks)
+    report = {"latency_ms": percentiles([latency for latency, _ in results])}
+    for kind in ("full", "degraded", "error"):
+        kinds = [latency for latency, outcome in results if outcome == kind]
+        report[kind] = {"count": len(kinds), "latency_ms": percentiles(kinds)}
+    return report
+
+
+async def run(args: argparse.Namespace, breaker: bool, first: int) -> dict:
+    standin = StandInModel(StandInConfig(
+        first_token_ms=args.first_token_ms, latency_sigma=0.3, tool_call_rate=0.0,
+        answer_tokens=20, tokens_per_second=200, seed=args.seed,
+    ))
+    # Off, the breaker only counts calls; runs go off then on, so the circuit starts closed either way
+    model_breaker.enabled = breaker
+    model_breaker.stats = BreakerStats()
+    # Set on the agent rather than via override(): the server runs in another thread's context
+    agent.model = TimedModel(BreakerModel(standin.model(), model_breaker))
+
+    report = {}
+    with Server() as base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+            report["healthy"] = await phase(client, first, args.requests, args.rate)
+
+            standin.config.error_rate = 1.0
+            standin.config.first_token_ms = args.outage_first_token_ms
+            before = standin.requests
+            report["outage"] = await phase(client, first + args.requests, args.requests, args.rate)
+            report["outage"]["model_requests"] = standin.requests - before
+
+            standin.config.error_rate = 0.0
+            standin.config.first_token_ms = args.first_token_ms
+            # Let the circuit go half-open, so the next request is the probe
+            await asyncio.sleep(BREAKER_OPEN_SECONDS)
+            report["recovered"] = await phase(client, first + 2 * args.requests, args.requests, args.rate)
+    report["breaker"] = model_breaker.snapshot()
+    return report
+
+
+async def main(args: argparse.Namespace) -> dict:
+    return {
+        "config": vars(args),
+        # Different questions in each run, so the second is not answered from the first's cache
+        "without_breaker": await run(args, breaker=False, first=0),
+        "with_breaker": await run(args, breaker=True, first=3 * args.requests),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=150, help="requests per phase")
+    parser.add_argument("--rate", type=float, default=10.0, help="requests started per second")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--outage-first-token-ms", type=float, default=3000.0,
+                        help="how long a failing request waits before its error")
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,95 @@
+"""
+Benchmark: tail latency with and without hedged model requests
+Streams agent runs against the stand-in model with a slow tail (bench/standin.py), once direct and once
+through HedgedModel, and reports time to first chunk, hedges issued/won and the extra model requests.
+
+Run from the agent/ directory:
+    python -m bench.bench_hedging [--requests 400] [--concurrency 8] [--tail-rate 0.05] [--tail-ms 2000]
+                                  [--max-rate 0.1] [--backup-first-token-ms 150]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("GOOGLE_API_KEY", "unused-by-this-benchmark")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import PartDeltaEvent, PartStartEvent
+
+from src.hedging import HedgedModel
+
+from .bench_load import percentiles
+from .standin import StandInConfig, StandInModel
+
+
+async def run(model, requests: int, concurrency: int) -> dict:
+    """Stream `requests` agent runs, `concurrency` at a time; time to first chunk and to the end of each."""
+    agent = Agent(model)
+    ttfc, total = [], []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(index: int) -> None:
+        async with gate:
+            started = time.perf_counter()
+            first = None
+            async for event in agent.run_stream_events(f"question {index}"):
+                if first is None and isinstance(event, (PartStartEvent, PartDeltaEvent)):
+                    first = time.perf_counter() - started
+            ttfc.append(first * 1000)
+            total.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return {
+        "seconds": round(time.perf_counter() - started, 2),
+        "ttfc_ms": percentiles(ttfc),
+        "latency_ms": percentiles(total),
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    def standin(first_token_ms: float) -> StandInModel:
+        return StandInModel(StandInConfig(
+            first_token_ms=first_token_ms, latency_sigma=0.3, tail_rate=args.tail_rate, tail_ms=args.tail_ms,
+            tool_call_rate=0.0, answer_tokens=20, tokens_per_second=200, seed=args.seed,
+        ))
+
+    direct = standin(args.first_token_ms)
+    baseline = await run(direct.model(), args.requests, args.concurrency)
+
+    primary = standin(args.first_token_ms)
+    backup = standin(args.backup_first_token_ms) if args.backup_first_token_ms else None
+    hedged = HedgedModel(primary.model(), backup=backup.model() if backup else None, max_rate=args.max_rate)
+    with_hedging = await run(hedged, args.requests, args.concurrency)
+    model_requests = primary.requests + (backup.requests if backup else 0)
+
+    return {
+        "config": vars(args),
+        "direct": baseline,
+        "hedged": {
+            **with_hedging,
+            **hedged.snapshot(),
+            # Extra upstream load paid for the tail
+            "extra_model_requests": round(model_requests / direct.requests - 1, 4),
+        },
+        "ttfc_ratio": {
+            p: round(with_hedging["ttfc_ms"][p] / baseline["ttfc_ms"][p], 3) for p in ("p50", "p95", "p99", "max")
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--tail-rate", type=float, default=0.05, help="share of requests in the slow tail")
+    parser.add_argument("--tail-ms", type=float, default=2000.0, help="extra delay of a slow request")
+    parser.add_argument("--max-rate", type=float, default=0.1, help="hedge budget, as a share of requests")
+    parser.add_argument("--backup-first-token-ms", type=float, default=0.0,
+                        help="a faster fallback tier for the backup (0: hedge to the same model)")
+    parser.add_argument("--seed", type=int, default=0)
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,73 @@
+"""
+Check: import-time budget for src.agent (what uvicorn pays before the server binds)
+Runs `python -X importtime -c "import src.agent"` in fresh interpreters, reports the slowest
+imports and exits non-zero if the budget is blown or a deferred module is imported eagerly.
+
+Run from the agent/ directory:
+    python -m bench.bench_import_time [--budget-ms 1500] [--runs 5]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Loaded during startup warm-up instead of at import (see warm_up in src/agent.py)
+DEFERRED_MODULES = ("google.genai", "pydantic_ai.models.google", "ag_ui.core", "pydantic_ai.ui.ag_ui")
+
+
+def import_times(module: str) -> dict[str, tuple[int, int]]:
+    """module -> (self µs, cumulative µs) for one fresh import of `module`."""
+    env = {**os.environ, "GOOGLE_API_KEY": os.environ.get("GOOGLE_API_KEY", "unused-by-this-check")}
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main(module: str, budget_ms: float, runs: int, top: int) -> int:
+    samples = [import_times(module) for _ in range(runs)]
+    totals = [times[module][1] / 1000 for times in samples]
+    median = statistics.median(totals)
+
+    # Top-level packages by cumulative time, from the median run
+    times = samples[totals.index(sorted(totals)[len(totals) // 2])]
+    packages: dict[str, int] = {}
+    for name, (_, cumulative) in times.items():
+        root = name.split(".")[0]
+        if name == root or root == "src":
+            packages[name] = max(packages.get(name, 0), cumulative)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+    eager = [name for name in DEFERRED_MODULES if any(name in run for run in samples)]
+    ok = median <= budget_ms and not eager
+    print(json.dumps({
+        "module": module,
+        "runs": runs,
+        "median_ms": round(median, 1),
+        "min_ms": round(min(totals), 1),
+        "budget_ms": budget_ms,
+        "slowest_imports_ms": {name: round(us / 1000, 1) for name, us in slowest},
+        "deferred_but_imported": eager,
+        "ok": ok,
+    }, indent=2))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", default="src.agent")
+    # -X importtime itself adds overhead; the budget is measured under it
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1500")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8)
+    args = parser.parse_args()
+    sys.exit(main(args.module, args.budget_ms, args.runs, args.top))
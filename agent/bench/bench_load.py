@@ -0,0 +1,288 @@
+"""
+Load test: throughput, tail latency, time-to-first-chunk and memory per session
+Serves the real app with uvicorn on localhost and drives /chat/completions (SSE) and /agui with
+concurrent multi-turn sessions. Gemini is replaced by the deterministic stand-in in bench/standin.py,
+so no quota is spent. Results are written as JSON for comparing commits.
+
+Run from the agent/ directory:
+    python -m bench.bench_load [--clients 16] [--sessions 64] [--turns 3] [--path both]
+                               [--first-token-ms 400] [--tokens-per-second 80] [--tool-call-rate 0.5]
+                               [--out load-results.json] [--compare previous.json]
+"""
+from dataclasses import asdict, dataclass
+from typing import Optional
+import argparse
+import asyncio
+import gc
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+os.environ.setdefault("GOOGLE_API_KEY", "unused-by-this-benchmark")
+# Per-request INFO lines would dominate the profile
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+import uvicorn
+
+from src.agent import agent, app, model_breaker
+from src.breaker import BreakerModel
+from src.hedging import HedgedModel
+from src.metrics import TimedModel
+
+from .standin import StandInConfig, StandInModel
+
+QUESTIONS = [
+    "What services do you offer?",
+    "How does escalation to a human work?",
+    "Tell me about your voice call systems",
+    "What is your tech stack?",
+    "How do we get started?",
+    "What does human in the loop mean?",
+]
+
+
+@dataclass
+class Sample:
+    latency_ms: float
+    ttfc_ms: Optional[float]
+    ok: bool
+
+
+# =====
+# Server
+# =====
+class Server:
+    """The app on an ephemeral localhost port, served from its own thread and event loop."""
+
+    def __init__(self):
+        # Lifespan off: warm-up would import google-genai and try to reach Gemini
+        config = uvicorn.Config(app, host="127.0.0.1", port=0, lifespan="off", log_level="warning", access_log=False)
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self) -> str:
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        host, port = self.server.servers[0].sockets[0].getsockname()[:2]
+        return f"http://{host}:{port}"
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def rss_kb() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# =====
+# Clients
+# =====
+def sse_payloads(buffer: bytes) -> list[dict]:
+    return [
+        json.loads(line[6:]) for line in buffer.decode().splitlines()
+        if line.startswith("data: ") and line[6:].strip() not in ("", "[DONE]")
+    ]
+
+
+async def timed_stream(client: httpx.AsyncClient, url: str, **kwargs) -> tuple[Sample, bytes]:
+    started = time.perf_counter()
+    ttfc, body = None, b""
+    try:
+        async with client.stream("POST", url, **kwargs) as response:
+            async for chunk in response.aiter_raw():
+                if ttfc is None and chunk:
+                    ttfc = (time.perf_counter() - started) * 1000
+                body += chunk
+            ok = response.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    return Sample((time.perf_counter() - started) * 1000, ttfc, ok), body
+
+
+async def clm_session(client: httpx.AsyncClient, index: int, turns: int) -> list[Sample]:
+    """A Hume voice conversation: the full transcript is resent every turn."""
+    # Distinct users per path, so AG-UI sessions cannot hit answers cached for CLM ones
+    messages = [{"role": "system", "content": f"User Name: Load Tester {index}\nUser ID: c{index:07x}"}]
+    samples = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": QUESTIONS[(index + turn) % len(QUESTIONS)]})
+        sample, body = await timed_stream(
+            client, "/chat/completions",
+            params={"custom_session_id": f"load-{index}"},
+            json={"messages": messages, "stream": True},
+        )
+        samples.append(sample)
+        reply = "".join(
+            (payload["choices"][0]["delta"].get("content") or "") for payload in sse_payloads(body) if payload.get("choices")
+        )
+        messages.append({"role": "assistant", "content": reply})
+    return samples
+
+
+async def agui_session(client: httpx.AsyncClient, index: int, turns: int) -> list[Sample]:
+    """A CopilotKit thread: AG-UI runs carrying the thread's messages."""
+    thread_id = f"load-{index}"
+    state = {"user": {"id": f"a{index:07x}", "name": f"Load Tester {index}", "firstName": "Load"}, "current_page": "homepage"}
+    messages = []
+    samples = []
+    for turn in range(turns):
+        messages.append({"id": uuid.uuid4().hex, "role": "user", "content": QUESTIONS[(index + turn) % len(QUESTIONS)]})
+        sample, body = await timed_stream(client, "/agui/", json={
+            "threadId": thread_id, "runId": uuid.uuid4().hex, "state": state, "messages": messages,
+            "tools": [], "context": [], "forwardedProps": {},
+        })
+        samples.append(sample)
+        reply = "".join(event.get("delta", "") for event in sse_payloads(body) if event.get("type") == "TEXT_MESSAGE_CONTENT")
+        messages.append({"id": uuid.uuid4().hex, "role": "assistant", "content": reply})
+    return samples
+
+
+# =====
+# Report
+# =====
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))], 1)
+
+    return {"p50": rank(50), "p95": rank(95), "p99": rank(99), "max": round(ordered[-1], 1),
+            "mean": round(sum(ordered) / len(ordered), 1)}
+
+
+async def run_path(base_url: str, path: str, clients: int, sessions: int, turns: int) -> dict:
+    session = clm_session if path == "clm" else agui_session
+    pending: asyncio.Queue[int] = asyncio.Queue()
+    for index in range(sessions):
+        pending.put_nowait(index)
+    samples: list[Sample] = []
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        while not pending.empty():
+            samples.extend(await session(client, pending.get_nowait(), turns))
+
+    gc.collect()
+    rss_before = rss_kb()
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    gc.collect()
+
+    ok = [s for s in samples if s.ok]
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "seconds": round(elapsed, 2),
+        "rps": round(len(ok) / elapsed, 2),
+        "latency_ms": percentiles([s.latency_ms for s in ok]),
+        "ttfc_ms": percentiles([s.ttfc_ms for s in ok if s.ttfc_ms is not None]),
+        # Client and server share the process; the delta is mostly retained session state
+        "rss_kb_per_session": round((rss_kb() - rss_before) / sessions, 1),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: dict, previous: dict) -> dict:
+    """Ratios current/previous for throughput and tail latency per path."""
+    deltas = {}
+    for path, now in current["paths"].items():
+        before = previous.get("paths", {}).get(path)
+        if not before:
+            continue
+        deltas[path] = {
+            "rps": round(now["rps"] / before["rps"], 3) if before["rps"] else None,
+            **{
+                f"{metric}_{p}": round(now[metric][p] / before[metric][p], 3) if before[metric].get(p) else None
+                for metric in ("latency_ms", "ttfc_ms") for p in ("p50", "p95", "p99")
+                if now[metric] and before[metric]
+            },
+        }
+    return {"against": previous.get("commit"), "ratios": deltas}
+
+
+async def main(args: argparse.Namespace) -> dict:
+    standin = StandInModel(StandInConfig(
+        first_token_ms=args.first_token_ms,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        tool_call_rate=args.tool_call_rate,
+        seed=args.seed,
+    ))
+    # The stack agent.py builds (timing, circuit breaker, hedging), with the stand-in in place of Gemini.
+    # Set on the agent rather than via override(): the server runs in another thread's context
+    hedged_model = HedgedModel(standin.model())
+    agent.model = TimedModel(BreakerModel(hedged_model, model_breaker))
+
+    paths = ["clm", "agui"] if args.path == "both" else [args.path]
+    with Server() as base_url:
+        results = {path: await run_path(base_url, path, args.clients, args.sessions, args.turns) for path in paths}
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            server_stats = (await client.get("/stats")).json()
+
+    return {
+        "commit": git_commit(),
+        "timestamp": int(time.time()),
+        "config": {
+            "clients": args.clients, "sessions": args.sessions, "turns": args.turns,
+            "standin": asdict(standin.config),
+        },
+        "paths": results,
+        "model_requests": standin.requests,
+        "server": {
+            "cache_hit_ratios": {name: stats["hit_ratio"] for name, stats in server_stats["caches"].items()},
+            "prefetch_hit_rate": server_stats["prefetch"]["hit_rate"],
+            "admission_shed": server_stats["admission"]["shed"],
+            # The bench's own hedged model; /stats reports the production one
+            "hedging": hedged_model.snapshot(),
+            "breaker": server_stats["breaker"],
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--sessions", type=int, default=64, help="sessions per path")
+    parser.add_argument("--turns", type=int, default=3, help="user turns per session")
+    parser.add_argument("--path", choices=["clm", "agui", "both"], default="both")
+    parser.add_argument("--first-token-ms", type=float, default=400.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    parser.add_argument("--tool-call-rate", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default="load-results.json")
+    parser.add_argument("--compare", help="an earlier results file to compare against")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.compare:
+        with open(args.compare) as f:
+            report["comparison"] = compare(report, json.load(f))
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Wrote {args.out}", file=sys.stderr)
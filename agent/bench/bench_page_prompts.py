@@ -0,0 +1,67 @@
+"""
+Report: per-page prompt size (system prompt + instructions + tool schemas)
+Runs the real agent against a capturing stand-in model, so no request is sent to Gemini.
+
+Run from the agent/ directory:
+    python -m bench.bench_page_prompts [--logged-in]
+"""
+import argparse
+import asyncio
+import json
+import os
+
+os.environ.setdefault("GOOGLE_API_KEY", "unused-by-this-report")
+
+from pydantic_ai.messages import ModelMessage, ModelRequest, ModelResponse, SystemPromptPart, TextPart
+from pydantic_ai.models.function import AgentInfo, FunctionModel
+
+from src.agent import AgentDeps, AppState, UserProfile, agent
+from src.compaction import CHARS_PER_TOKEN
+from src.prompts import PAGE_PROFILES
+
+
+async def capture(page: str, logged_in: bool) -> dict:
+    """Run one turn on `page` and measure what the model would receive."""
+    seen: dict = {}
+
+    def model_fn(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        system = sum(
+            len(part.content) for message in messages if isinstance(message, ModelRequest)
+            for part in message.parts if isinstance(part, SystemPromptPart)
+        )
+        tools = [
+            {"name": t.name, "description": t.description, "parameters": t.parameters_json_schema}
+            for t in info.function_tools
+        ]
+        seen.update(
+            system_chars=system,
+            instruction_chars=len(info.instructions or ""),
+            tool_schema_chars=len(json.dumps(tools)),
+            tools=sorted(t.name for t in info.function_tools),
+        )
+        return ModelResponse(parts=[TextPart("ok")])
+
+    user = UserProfile(id="u1", name="Ada Lovelace", firstName="Ada", email="ada@example.com") if logged_in else None
+    deps = AgentDeps(AppState(user=user, current_page=page))
+    with agent.override(model=FunctionModel(model_fn)):
+        # A greeting routes to no tool, so the prefetcher adds nothing to the prompt
+        await agent.run("hello", deps=deps)
+
+    total = seen["system_chars"] + seen["instruction_chars"] + seen["tool_schema_chars"]
+    return {**seen, "total_chars": total, "est_tokens": total // CHARS_PER_TOKEN}
+
+
+async def main(logged_in: bool) -> None:
+    report = {page: await capture(page, logged_in) for page in PAGE_PROFILES}
+    full = report["homepage"]["est_tokens"]
+    for row in report.values():
+        row["tokens_saved_vs_full"] = full - row["est_tokens"]
+        row["saved_pct"] = round(100 * row["tokens_saved_vs_full"] / full, 1) if full else 0.0
+    print(json.dumps({"logged_in": logged_in, "chars_per_token": CHARS_PER_TOKEN, "pages": report}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logged-in", action="store_true", help="measure with a logged-in user in the state")
+    args = parser.parse_args()
+    asyncio.run(main(args.logged_in))
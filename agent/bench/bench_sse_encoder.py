@@ -0,0 +1,112 @@
+"""
+Micro-benchmark: CLM SSE chunk encoding
+Compares the pre-rendered, coalescing encoder against the original per-word generator.
+
+Run from the agent/ directory:
+    python -m bench.bench_sse_encoder [--words 150] [--rounds 200]
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from src.streaming import encode_sse_stream
+
+
+# =====
+# Reference: the original generator (per-word dict + json.dumps + fixed sleep)
+# =====
+async def legacy_stream_sse_response(content: str, msg_id: str, sleep: float = 0.01):
+    words = content.split(' ')
+    for i, word in enumerate(words):
+        chunk = {
+            "id": msg_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "hitl-quest-agent",
+            "choices": [{
+                "index": 0,
+                "delta": {"content": word + (' ' if i < len(words) - 1 else '')},
+                "finish_reason": None
+            }]
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+        if sleep:
+            await asyncio.sleep(sleep)
+
+    final = {
+        "id": msg_id,
+        "object": "chat.completion.chunk",
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+    }
+    yield f"data: {json.dumps(final)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def decode_content(payload: bytes) -> str:
+    """Reassemble the content deltas from an SSE payload."""
+    parts = []
+    for line in payload.split(b"\n"):
+        if line.startswith(b"data: {"):
+            parts.append(json.loads(line[6:])["choices"][0]["delta"].get("content", ""))
+    return "".join(parts)
+
+
+async def word_deltas(content: str):
+    """Yield the answer as model-sized deltas (one word each)."""
+    words = content.split(' ')
+    for i, word in enumerate(words):
+        yield word + (' ' if i < len(words) - 1 else '')
+
+
+async def measure(name: str, make_stream, rounds: int) -> dict:
+    total_bytes = 0
+    total_chunks = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        async for chunk in make_stream():
+            data = chunk if isinstance(chunk, bytes) else chunk.encode()
+            total_bytes += len(data)
+            total_chunks += 1
+    elapsed = time.perf_counter() - start
+    return {
+        "name": name,
+        "seconds_per_response_ms": round(elapsed / rounds * 1000, 3),
+        "bytes_per_sec": round(total_bytes / elapsed),
+        "chunks_per_sec": round(total_chunks / elapsed),
+        "chunks_per_response": total_chunks // rounds,
+        "bytes_per_response": total_bytes // rounds,
+    }
+
+
+async def main(words: int, rounds: int) -> None:
+    content = " ".join(f"Human-in-the-loop{i % 7} \"quoted\" ünïcode" if i % 11 == 0 else f"word{i}"
+                       for i in range(words))
+    msg_id = "chatcmpl-bench0001"
+
+    # Sanity check: every encoder delivers the same text
+    legacy = b"".join([c.encode() async for c in legacy_stream_sse_response(content, msg_id, sleep=0)])
+    for max_bytes in (0, 48):
+        encoded = b"".join([c async for c in encode_sse_stream(word_deltas(content), msg_id, max_bytes=max_bytes)])
+        assert decode_content(encoded) == decode_content(legacy) == content
+
+    # The shipped generator sleeps 10 ms per word, so only a few rounds are needed to see it
+    results = [
+        await measure("legacy (with 10ms sleep)",
+                      lambda: legacy_stream_sse_response(content, msg_id), max(1, rounds // 100)),
+        await measure("legacy (encoding only, no sleep)",
+                      lambda: legacy_stream_sse_response(content, msg_id, sleep=0), rounds),
+        await measure("pre-rendered, per delta",
+                      lambda: encode_sse_stream(word_deltas(content), msg_id, max_bytes=0), rounds),
+        await measure("pre-rendered, 48-byte coalescing",
+                      lambda: encode_sse_stream(word_deltas(content), msg_id, max_bytes=48), rounds),
+    ]
+    print(json.dumps({"words": words, "rounds": rounds, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--words", type=int, default=150)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.words, args.rounds))
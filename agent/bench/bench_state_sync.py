@@ -0,0 +1,142 @@
+"""
+Benchmark: AG-UI state bytes on the wire per session, JSON Patch deltas vs full snapshots
+Runs AG-UI sessions against the app with a scripted model that looks up one service per turn (which records
+it in the state's interested_services), once per sync mode. A client applies the state events as CopilotKit
+would and sends its state back with the next run; its final state is checked against the server's.
+
+Run from the agent/ directory:
+    python -m bench.bench_state_sync [--sessions 20] [--turns 5]
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import uuid
+
+os.environ.setdefault("GOOGLE_API_KEY", "unused-by-this-benchmark")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import httpx
+from typing import AsyncIterator
+
+from pydantic_ai.messages import ModelMessage
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, DeltaToolCalls, FunctionModel
+
+from src import state_sync
+from src.agent import agent, tool_prefetcher
+from src.catalog import catalog
+from src.metrics import TimedModel
+
+from .bench_load import Server, percentiles, sse_payloads
+from .standin import _has_tool_results, _last_prompt
+
+
+async def scripted(messages: list[ModelMessage], info: AgentInfo) -> AsyncIterator[str | DeltaToolCalls]:
+    """Look up the service the prompt names, then answer."""
+    if not _has_tool_results(messages):
+        args = json.dumps({"service_name": _last_prompt(messages)})
+        yield {0: DeltaToolCall(name="get_service_details", json_args=args, tool_call_id=uuid.uuid4().hex)}
+        return
+    yield "Here are the details."
+
+
+def _resolve(document, path: str) -> tuple:
+    keys = [key.replace("~1", "/").replace("~0", "~") for key in path.split("/")[1:]]
+    for key in keys[:-1]:
+        document = document[int(key) if isinstance(document, list) else key]
+    return document, keys[-1]
+
+
+def apply_patch(document, ops: list[dict]):
+    """The client side of RFC 6902, for the operations the server emits (add, remove, replace)."""
+    document = copy.deepcopy(document)
+    for op in ops:
+        if op["path"] == "":
+            document = copy.deepcopy(op["value"])
+            continue
+        parent, key = _resolve(document, op["path"])
+        if isinstance(parent, list):
+            if op["op"] == "add" and key == "-":
+                parent.append(op["value"])
+            elif op["op"] == "remove":
+                del parent[int(key)]
+            else:
+                parent[int(key)] = op["value"]
+        elif op["op"] == "remove":
+            del parent[key]
+        else:
+            parent[key] = op["value"]
+    return document
+
+
+async def session(client: httpx.AsyncClient, index: int, turns: int, services: list[str]) -> dict:
+    """One CopilotKit thread; returns its state bytes, total bytes and whether the client state converged."""
+    # What the frontend sends: undefined fields are left out of the JSON
+    state = {
+        "user": {"id": f"s{index:07x}", "name": f"State Tester {index}", "firstName": "State", "email": f"t{index}@example.com"},
+        "interested_services": [],
+        "current_page": "homepage",
+    }
+    state_bytes = total_bytes = 0
+    for turn in range(turns):
+        service = services[(index + turn) % len(services)]
+        response = await client.post("/agui/", json={
+            "threadId": f"state-{index}", "runId": uuid.uuid4().hex, "state": state,
+            "messages": [{"id": uuid.uuid4().hex, "role": "user", "content": f"Tell me about {service} ({index}.{turn})"}],
+            "tools": [], "context": [], "forwardedProps": {},
+        })
+        total_bytes += len(response.content)
+        for line in response.content.decode().splitlines():
+            if line.startswith("data: ") and '"STATE_' in line:
+                state_bytes += len(line) + 2
+        for event in sse_payloads(response.content):
+            if event["type"] == "STATE_SNAPSHOT":
+                state = event["snapshot"]
+            elif event["type"] == "STATE_DELTA":
+                state = apply_patch(state, event["delta"])
+    expected = [services[(index + turn) % len(services)] for turn in range(turns)]
+    return {
+        "state_bytes": state_bytes,
+        "total_bytes": total_bytes,
+        "converged": list(dict.fromkeys(expected)) == state["interested_services"],
+    }
+
+
+async def run(base_url: str, mode: str, sessions: int, turns: int, first: int) -> dict:
+    state_sync.STATE_SYNC_MODE = mode
+    state_sync.state_sync_stats.__init__()
+    services = list(catalog.current.service_details)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60) as client:
+        results = await asyncio.gather(*(session(client, first + i, turns, services) for i in range(sessions)))
+    return {
+        "state_bytes_per_session": percentiles([r["state_bytes"] for r in results]),
+        "total_bytes_per_session": percentiles([r["total_bytes"] for r in results]),
+        "converged": sum(r["converged"] for r in results),
+        "server": state_sync.state_sync_stats.snapshot(),
+    }
+
+
+async def main(args: argparse.Namespace) -> dict:
+    # Set on the agent rather than via override(): the server runs in another thread's context
+    agent.model = TimedModel(FunctionModel(stream_function=scripted, model_name="scripted"))
+    # Prefetched lookups are guesses and record no interest; the scripted model makes its own
+    tool_prefetcher.enabled = False
+    with Server() as base_url:
+        snapshot = await run(base_url, "snapshot", args.sessions, args.turns, first=0)
+        delta = await run(base_url, "delta", args.sessions, args.turns, first=args.sessions)
+    return {
+        "config": vars(args),
+        "snapshot": snapshot,
+        "delta": delta,
+        "state_bytes_ratio": round(
+            delta["state_bytes_per_session"]["mean"] / snapshot["state_bytes_per_session"]["mean"], 3
+        ),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=5, help="runs per session, one service lookup each")
+    print(json.dumps(asyncio.run(main(parser.parse_args())), indent=2))
@@ -0,0 +1,125 @@
+"""
+Micro-benchmark: user-field extraction from Hume / CopilotKit system prompts
+Compares the original eight-search parser against the single-pass scanner and its memoized wrapper.
+
+Run from the agent/ directory:
+    python -m bench.bench_user_parser [--rounds 2000]
+"""
+import argparse
+import json
+import time
+
+from src.user_context import extract_user_from_instructions, parse_user_fields, prompt_parse_cache
+
+
+# =====
+# Reference: the original parser (function-local import, up to eight re.search calls)
+# =====
+def legacy_extract_user_from_instructions(instructions: str) -> dict:
+    result = {"user_id": None, "name": None, "email": None}
+    if not instructions:
+        return result
+
+    import re
+
+    id_match = re.search(r'User ID:\s*([a-f0-9-]+)', instructions, re.IGNORECASE)
+    if id_match:
+        result["user_id"] = id_match.group(1)
+
+    name_patterns = [
+        r'User Name:\s*([^\n]+)',
+        r'-\s*Name:\s*([^\n]+)',
+        r'Name:\s*([^\n]+)',
+        r'first name \(([^)]+)\)',
+    ]
+    for pattern in name_patterns:
+        name_match = re.search(pattern, instructions, re.IGNORECASE)
+        if name_match:
+            result["name"] = name_match.group(1).strip()
+            break
+
+    email_patterns = [
+        r'User Email:\s*([^\n]+)',
+        r'-\s*Email:\s*([^\n]+)',
+        r'Email:\s*([^\s\n]+)',
+    ]
+    for pattern in email_patterns:
+        email_match = re.search(pattern, instructions, re.IGNORECASE)
+        if email_match:
+            result["email"] = email_match.group(1).strip()
+            break
+
+    return result
+
+
+HERO_VOICE_HEAD = """## CRITICAL IDENTITY
+You are the VOICE ASSISTANT for HITL.quest - a Human-in-the-Loop AI agency.
+You help potential clients understand our services and the value of combining AI automation with human oversight.
+
+## USER INFORMATION
+- Name: Dan
+- Email: dan@example.com
+- User ID: 3f2b9c1e-8d4a-4e7b-9a61-0c5d2e8f7a13
+
+IMPORTANT: Address the user by their first name (Dan) in your responses.
+
+## CURRENT PAGE CONTEXT
+User is exploring Voice Call Systems. Focus on Hume AI, emotional intelligence, and seamless call transfer.
+"""
+
+FILLER = """
+## KEY VALUE PROPOSITIONS
+- 95%+ customer satisfaction (vs 60-70% for full automation)
+- 80% of volume handled by AI
+- Note: escalation keeps full context; Rule: keep responses SHORT for voice (2-3 sentences max)
+- Seamless escalation - customers never repeat themselves
+"""
+
+COPILOTKIT_HEAD = """You are a helpful assistant.
+User ID: 3f2b9c1e-8d4a-4e7b-9a61-0c5d2e8f7a13
+User Name: Dan Smith
+User Email: dan@example.com
+"""
+
+GUEST_HEAD = """## CRITICAL IDENTITY
+You are the VOICE ASSISTANT for HITL.quest. The user is a guest; do not ask for personal details.
+"""
+
+
+def build_prompt(head: str, size: int) -> str:
+    text = head
+    while len(text) < size:
+        text += FILLER
+    return text[:size]
+
+
+def measure(fn, prompts: list[str], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for prompt in prompts:
+            fn(prompt)
+    return (time.perf_counter() - start) / (rounds * len(prompts)) * 1e6
+
+
+def main(rounds: int) -> None:
+    results = []
+    for head_name, head in (("hero_voice", HERO_VOICE_HEAD), ("copilotkit", COPILOTKIT_HEAD), ("guest", GUEST_HEAD)):
+        for size in (2048, 4096, 6144, 8192, 10240):
+            prompt = build_prompt(head, size)
+            assert parse_user_fields(prompt) == legacy_extract_user_from_instructions(prompt), (head_name, size)
+            prompt_parse_cache.clear()
+            results.append({
+                "prompt": head_name,
+                "bytes": size,
+                "legacy_us": round(measure(legacy_extract_user_from_instructions, [prompt], rounds), 2),
+                "single_pass_us": round(measure(parse_user_fields, [prompt], rounds), 2),
+                "memoized_us": round(measure(extract_user_from_instructions, [prompt], rounds), 2),
+            })
+    print(json.dumps({"rounds": rounds, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.rounds)
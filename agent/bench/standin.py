@@ -0,0 +1,136 @@
+"""
+Deterministic stand-in for Gemini, for benchmarks and load tests
+A pydantic-ai FunctionModel with a configurable latency distribution, token rate and tool-call behaviour.
+"""
+from dataclasses import dataclass
+from typing import AsyncIterator
+import asyncio
+import json
+import random
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from pydantic_ai.models.function import AgentInfo, DeltaToolCall, DeltaToolCalls, FunctionModel
+
+ANSWER_WORDS = (
+    "Human-in-the-loop AI lets automation handle the routine volume while people review the uncertain "
+    "cases, so customers get fast answers and the edge cases still get human judgment. We build chat, "
+    "voice, document and moderation systems that escalate with full context and learn from every decision."
+).split()
+
+
+@dataclass
+class StandInConfig:
+    # Time to first token: log-normal around the median
+    first_token_ms: float = 400.0
+    latency_sigma: float = 0.5
+    # Slow tail: this share of requests waits tail_ms more before the first token
+    tail_rate: float = 0.0
+    tail_ms: float = 3000.0
+    tokens_per_second: float = 80.0
+    answer_tokens: int = 60
+    # Chance the model calls a tool when the request carries no tool results yet
+    tool_call_rate: float = 0.5
+    # Failure modes, for exercising retries, fallbacks and breakers: a failed request raises after its delay
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+class StandInError(RuntimeError):
+    """Raised by the stand-in to simulate a failed model request."""
+
+
+def _last_prompt(messages: list[ModelMessage]) -> str:
+    for message in reversed(messages):
+        if isinstance(message, ModelRequest):
+            for part in message.parts:
+                if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                    return part.content
+    return ""
+
+
+def _has_tool_results(messages: list[ModelMessage]) -> bool:
+    last = messages[-1] if messages else None
+    return isinstance(last, ModelRequest) and any(isinstance(part, ToolReturnPart) for part in last.parts)
+
+
+def _tool_args(info: AgentInfo, name: str) -> dict:
+    tool = next(tool for tool in info.function_tools if tool.name == name)
+    schema = tool.parameters_json_schema
+    return {param: "voice" for param in schema.get("required", [])}
+
+
+class StandInModel:
+    """
+    Builds the FunctionModel. Each model request draws from an RNG seeded by
+    the config seed, the user's last prompt, the request's position in the
+    run and how many times that same request has been made (so a retry or
+    hedge is an independent draw), so a rerun with the same workload makes
+    the same choices.
+    """
+
+    def __init__(self, config: StandInConfig = StandInConfig()):
+        self.config = config
+        self.requests = 0
+        self._attempts: dict[tuple, int] = {}
+
+    def _rng(self, messages: list[ModelMessage]) -> random.Random:
+        step = sum(1 for message in messages if isinstance(message, ModelResponse))
+        key = (_last_prompt(messages), step)
+        attempt = self._attempts[key] = self._attempts.get(key, 0) + 1
+        return random.Random(f"{self.config.seed}:{key[0]}:{step}:{attempt}")
+
+    def _plan(self, messages: list[ModelMessage], info: AgentInfo) -> tuple[float, bool, list[ToolCallPart], list[str]]:
+        """Delay before the first token, whether the request then fails, and either tool calls or the answer's words."""
+        self.requests += 1
+        config = self.config
+        rng = self._rng(messages)
+        delay = config.first_token_ms / 1000 * rng.lognormvariate(0, config.latency_sigma)
+        if rng.random() < config.tail_rate:
+            delay += config.tail_ms / 1000
+        failed = rng.random() < config.error_rate
+
+        tools = sorted(tool.name for tool in info.function_tools)
+        if tools and not _has_tool_results(messages) and rng.random() < config.tool_call_rate:
+            name = rng.choice(tools)
+            call = ToolCallPart(name, _tool_args(info, name), tool_call_id=f"standin-{rng.getrandbits(32):08x}")
+            return delay, failed, [call], []
+
+        start = rng.randrange(len(ANSWER_WORDS))
+        words = [ANSWER_WORDS[(start + i) % len(ANSWER_WORDS)] for i in range(config.answer_tokens)]
+        return delay, failed, [], words
+
+    async def request(self, messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        delay, failed, calls, words = self._plan(messages, info)
+        await asyncio.sleep(delay)
+        if failed:
+            raise StandInError("stand-in model request failed")
+        await asyncio.sleep(len(words) / self.config.tokens_per_second)
+        return ModelResponse(parts=calls or [TextPart(" ".join(words))])
+
+    async def stream(self, messages: list[ModelMessage], info: AgentInfo) -> AsyncIterator[str | DeltaToolCalls]:
+        delay, failed, calls, words = self._plan(messages, info)
+        await asyncio.sleep(delay)
+        if failed:
+            raise StandInError("stand-in model request failed")
+        if calls:
+            yield {
+                i: DeltaToolCall(name=call.tool_name, json_args=json.dumps(call.args), tool_call_id=call.tool_call_id)
+                for i, call in enumerate(calls)
+            }
+            return
+        # A few tokens per chunk, paced at the configured token rate
+        for i in range(0, len(words), 4):
+            chunk = words[i:i + 4]
+            await asyncio.sleep(len(chunk) / self.config.tokens_per_second)
+            yield " ".join(chunk) + " "
+
+    def model(self) -> FunctionModel:
+        return FunctionModel(self.request, stream_function=self.stream, model_name="standin")
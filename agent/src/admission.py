@@ -0,0 +1,296 @@
+"""
+Admission control for agent runs
+Bounds concurrent runs per worker, queues the rest fairly by priority and session, and sheds what cannot start in time
+"""
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Optional, TypeVar
+import asyncio
+import math
+import os
+import time
+
+from .cancellation import time_remaining
+from .log import get_logger
+from .metrics import admission_shed, admission_wait
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() != "false"
+# Agent runs in flight per worker; each holds one Gemini request at a time
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+# Queued runs per session beyond this are refused with 429 (one chatty session cannot fill the queue)
+ADMISSION_MAX_QUEUED_PER_SESSION = int(os.getenv("ADMISSION_MAX_QUEUED_PER_SESSION", "2"))
+# Priority classes, highest first, with how long (seconds) a run of that class may wait for a slot
+ADMISSION_CLASSES = os.getenv("ADMISSION_CLASSES", "voice:3,chat:10")
+# Expected run duration before any run has finished, for the wait estimate
+ADMISSION_INITIAL_RUN_SECONDS = float(os.getenv("ADMISSION_INITIAL_RUN_SECONDS", "2.0"))
+
+log = get_logger("Admission")
+
+T = TypeVar("T")
+
+
+def parse_classes(spec: str) -> dict[str, float]:
+    """`"voice:3,chat:10"` -> {"voice": 3.0, "chat": 10.0}, in priority order."""
+    classes = {}
+    for item in spec.split(","):
+        name, _, deadline = item.partition(":")
+        if name.strip():
+            classes[name.strip()] = float(deadline or 10)
+    return classes
+
+
+class Overloaded(Exception):
+    """A run was refused; the response should carry `status_code` and a Retry-After of `retry_after` seconds."""
+
+    def __init__(self, reason: str, status_code: int, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = max(1, math.ceil(retry_after))
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(self.retry_after)}
+
+
+@dataclass
+class AdmissionStats:
+    admitted: int = 0
+    queued: int = 0
+    # Refused up front (queue full, per-session limit, wait estimate past the deadline), evicted or after waiting
+    shed: dict = field(default_factory=dict)
+    peak_in_flight: int = 0
+    peak_queue: int = 0
+    wait_seconds: float = 0.0
+
+    def record_shed(self, priority: str, reason: str) -> None:
+        self.shed[reason] = self.shed.get(reason, 0) + 1
+        admission_shed.inc(priority, reason)
+
+    def snapshot(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "shed": dict(self.shed),
+            "peak_in_flight": self.peak_in_flight,
+            "peak_queue": self.peak_queue,
+            "avg_wait_ms": round(self.wait_seconds / self.queued * 1000, 1) if self.queued else 0.0,
+        }
+
+
+class Slot:
+    """A run's claim on the worker; `release()` is idempotent and hands the slot to the next waiter."""
+
+    __slots__ = ("controller", "started", "released")
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.controller._release(time.monotonic() - self.started)
+
+    def __del__(self) -> None:
+        # Backstop for a response dropped before its stream started, so no `finally` ran
+        if not self.released:
+            try:
+                self.release()
+            except RuntimeError:
+                # Event loop already closed (interpreter shutdown)
+                pass
+
+
+class AdmissionController:
+    """
+    At most `max_concurrent` agent runs per worker; later runs wait in a queue.
+
+    Waiters are grouped by priority class and, within a class, by session.
+    A freed slot goes to the highest class with waiters, and round-robin
+    across that class's sessions, so a session sending several requests
+    cannot starve the others. When the queue is full, a run of a higher
+    class takes the place of the newest waiter of the lowest class queued
+    below it (that waiter is refused with 503); only a run with nothing
+    below it is refused. Each class has a deadline: a run that is
+    estimated (queue ahead x average run time / slots) to wait longer is
+    refused immediately with 503, and one that does wait that long is
+    refused then, instead of reaching Gemini after the caller gave up.
+
+    Event-loop only: every method runs on the worker's loop, so no locks.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = ADMISSION_MAX_CONCURRENT,
+        max_queue: int = ADMISSION_MAX_QUEUE,
+        max_queued_per_session: int = ADMISSION_MAX_QUEUED_PER_SESSION,
+        classes: Optional[dict[str, float]] = None,
+        enabled: bool = ADMISSION_ENABLED,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queued_per_session = max_queued_per_session
+        self.classes = classes or parse_classes(ADMISSION_CLASSES)
+        self.enabled = enabled
+        self.in_flight = 0
+        # priority -> session -> waiters (futures resolved with a slot hand-off)
+        self._waiting: dict[str, OrderedDict[str, deque[asyncio.Future]]] = {name: OrderedDict() for name in self.classes}
+        self._queued = 0
+        # Arrival order of the waiters, to pick the newest one to evict
+        self._arrivals: dict[asyncio.Future, int] = {}
+        self._arrived = 0
+        # Exponentially weighted run duration, for the wait estimate
+        self.run_seconds = ADMISSION_INITIAL_RUN_SECONDS
+        self.stats = AdmissionStats()
+
+    # =====
+    # Queue
+    # =====
+    def _ahead_of(self, priority: str) -> int:
+        """Waiters that would be served before a new run of this class."""
+        ahead = 0
+        for name, sessions in self._waiting.items():
+            ahead += sum(len(waiters) for waiters in sessions.values())
+            if name == priority:
+                break
+        return ahead
+
+    def estimated_wait(self, priority: str) -> float:
+        if self.in_flight < self.max_concurrent and not self._ahead_of(priority):
+            return 0.0
+        return (self._ahead_of(priority) + 1) / self.max_concurrent * self.run_seconds
+
+    def _remove(self, priority: str, session: str, waiter: asyncio.Future) -> None:
+        waiters = self._waiting[priority].get(session)
+        if waiters and waiter in waiters:
+            waiters.remove(waiter)
+            self._queued -= 1
+            self._arrivals.pop(waiter, None)
+            if not waiters:
+                del self._waiting[priority][session]
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for sessions in self._waiting.values():
+            while sessions:
+                session, waiters = next(iter(sessions.items()))
+                waiter = waiters.popleft()
+                self._queued -= 1
+                self._arrivals.pop(waiter, None)
+                # Round-robin: the session goes to the back of its class
+                del sessions[session]
+                if waiters:
+                    sessions[session] = waiters
+                if not waiter.done():
+                    return waiter
+        return None
+
+    def _evict_below(self, priority: str) -> bool:
+        """Refuse the newest waiter of the lowest class below `priority` to make room; False if there is none."""
+        names = list(self.classes)
+        for name in reversed(names[names.index(priority) + 1:]):
+            sessions = self._waiting[name]
+            if not sessions:
+                continue
+            session, waiters = max(sessions.items(), key=lambda item: self._arrivals.get(item[1][-1], -1))
+            waiter = waiters[-1]
+            self._remove(name, session, waiter)
+            if not waiter.done():
+                waiter.set_exception(self._shed(name, "evicted", self.estimated_wait(name)))
+            return True
+        return False
+
+    def _release(self, held: float) -> None:
+        self.run_seconds = 0.8 * self.run_seconds + 0.2 * held
+        waiter = self._next_waiter()
+        if waiter is not None:
+            # The slot passes straight to the waiter; in_flight is unchanged
+            waiter.set_result(None)
+        else:
+            self.in_flight -= 1
+
+    # =====
+    # Admission
+    # =====
+    async def acquire(self, priority: str, session: Optional[str] = None) -> Slot:
+        """Wait for a slot, or raise Overloaded; unknown priorities get the lowest class."""
+        if priority not in self.classes:
+            priority = list(self.classes)[-1]
+        if not self.enabled or (self.in_flight < self.max_concurrent and not self._ahead_of(priority)):
+            return self._grant()
+
+        # The class's queueing deadline, or sooner if the request's own deadline is
+        deadline = self.classes[priority]
+        if (remaining := time_remaining()) is not None:
+            deadline = max(0.0, min(deadline, remaining))
+        session = session or ""
+        waiters = self._waiting[priority].get(session)
+        estimate = self.estimated_wait(priority)
+        if self._queued >= self.max_queue and not self._evict_below(priority):
+            raise self._shed(priority, "queue_full", estimate)
+        if waiters and len(waiters) >= self.max_queued_per_session:
+            raise self._shed(priority, "session_limit", estimate, status_code=429)
+        if estimate > deadline:
+            raise self._shed(priority, "deadline", estimate)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiting[priority].setdefault(session, deque()).append(waiter)
+        self._queued += 1
+        self._arrived += 1
+        self._arrivals[waiter] = self._arrived
+        self.stats.queued += 1
+        self.stats.peak_queue = max(self.stats.peak_queue, self._queued)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, deadline)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted as the wait ended: pass the slot on rather than leak it
+                self._release(time.monotonic() - started)
+            else:
+                self._remove(priority, session, waiter)
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            raise self._shed(priority, "timeout", self.estimated_wait(priority)) from None
+        waited = time.monotonic() - started
+        self.stats.wait_seconds += waited
+        admission_wait.observe(waited, priority)
+        return self._grant(counted=True)
+
+    def _grant(self, counted: bool = False) -> Slot:
+        if not counted:
+            self.in_flight += 1
+        self.stats.admitted += 1
+        self.stats.peak_in_flight = max(self.stats.peak_in_flight, self.in_flight)
+        return Slot(self)
+
+    def _shed(self, priority: str, reason: str, retry_after: float, status_code: int = 503) -> Overloaded:
+        self.stats.record_shed(priority, reason)
+        log.warning("Shed agent run", priority=priority, reason=reason, in_flight=self.in_flight, queued=self._queued)
+        return Overloaded(reason, status_code, retry_after or self.run_seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats.snapshot(),
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "queue_depth": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "run_seconds": round(self.run_seconds, 3),
+            "classes": self.classes,
+        }
+
+
+async def release_after(stream: AsyncIterator[T], slot: Slot) -> AsyncIterator[T]:
+    """Pass a streamed response through, holding the run's slot until it ends (or the client goes away)."""
+    try:
+        async for item in stream:
+            yield item
+    finally:
+        slot.release()
+
+
+# One per worker process
+admission = AdmissionController()
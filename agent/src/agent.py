@@ -2,239 +2,138 @@
 HITL.quest AI Agent
 CopilotKit + Pydantic AI integration for Human-in-the-Loop agency
 """
-from textwrap import dedent
-from typing import Optional, List
-from pydantic import BaseModel, Field
-from pydantic_ai import Agent, RunContext
-from pydantic_ai.ag_ui import StateDeps
-from pydantic_ai.models.google import GoogleModel
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, replace
+from functools import partial
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Literal, Optional, List, Sequence
+from pydantic import BaseModel, Field, ValidationError
+from pydantic_ai import Agent, AgentRunResultEvent, RunContext
+from pydantic_ai.messages import (
+    FunctionToolCallEvent,
+    ModelMessage,
+    ModelResponse,
+    PartDeltaEvent,
+    PartStartEvent,
+    TextPart,
+    TextPartDelta,
+    ToolCallPart,
+    UserPromptPart,
+)
+from pydantic_ai.ui import StateDeps
+from pydantic_ai.tools import ToolDefinition
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.responses import StreamingResponse
-import os
-import sys
-import json
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+import asyncio
 import uuid
 import time
-import asyncio
 
+# Before the local imports: their settings are read from the environment at import
 from dotenv import load_dotenv
 load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# =====
-# User Context Cache (for CopilotKit instructions parsing)
-# =====
-_cached_user_context: dict = {}
-
-def extract_user_from_instructions(instructions: str) -> dict:
-    """Extract user info from CopilotKit instructions text or Hume system prompt."""
-    result = {"user_id": None, "name": None, "email": None}
-
-    if not instructions:
-        return result
-
-    import re
-
-    # Try multiple formats for user ID
-    id_match = re.search(r'User ID:\s*([a-f0-9-]+)', instructions, re.IGNORECASE)
-    if id_match:
-        result["user_id"] = id_match.group(1)
-
-    # Try multiple formats for name (HeroVoice uses "- Name:" format)
-    name_patterns = [
-        r'User Name:\s*([^\n]+)',      # CopilotKit format
-        r'-\s*Name:\s*([^\n]+)',        # HeroVoice format
-        r'Name:\s*([^\n]+)',            # Simple format
-        r'first name \(([^)]+)\)',      # "first name (Dan)" format
-    ]
-    for pattern in name_patterns:
-        name_match = re.search(pattern, instructions, re.IGNORECASE)
-        if name_match:
-            result["name"] = name_match.group(1).strip()
-            break
+from .admission import Overloaded, admission, release_after
+from .breaker import BreakerModel, CircuitBreaker, CircuitOpen
+from .cancellation import (
+    CLIENT_CLOSED_REQUEST,
+    CancellableAgent,
+    ClientDisconnected,
+    DeadlineExceeded,
+    set_deadline,
+    until_disconnected,
+)
+from .catalog import CatalogSnapshot, catalog
+from .coalesce import SingleFlight, request_digest
+from .compaction import compact_history, compaction_stats
+from .degraded import degraded_answer
+from .gemini_client import gemini_pool
+from .hedging import HEDGE_MODEL, HedgedModel
+from .history import HistoryStore, Turn, session_key
+from .log import get_logger, log_stats
+from .metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    MetricsMiddleware,
+    TimedModel,
+    cache_families,
+    model_requests,
+    model_requests_per_run,
+    registry as metrics_registry,
+    stage_duration,
+    stats_families,
+    timed_tool,
+)
+from .prefetch import ToolPrefetcher, is_prefetched, plan_tool_calls
+from .prompts import (
+    AGENT_TOOLS,
+    GUEST_CONTEXT,
+    PAGE_PROMPTS,
+    SYSTEM_PROMPT,
+    page_prompt,
+    page_tools,
+    prompt_layout_stats,
+    user_context_prompt,
+)
+from .readiness import Readiness
+from .response_cache import CachedAnswer, ResponseCache, catalog_version
+from .session_store import (
+    SESSION_STORE_RETRY_SECONDS,
+    SessionStore,
+    close_session_backend,
+    keep_session_backend,
+    open_session_backend,
+)
+from .state_sync import state_sync_stats, sync_state
+from .streaming import (
+    CLM_MODEL_NAME,
+    CLM_OUTPUT_MODE,
+    encode_sse_stream,
+    to_voice_text,
+    voice_chunks,
+)
+from .user_context import (
+    USER_CONTEXT_MAX_SESSIONS,
+    USER_CONTEXT_TTL_SECONDS,
+    extract_user_from_instructions,
+    get_user_context,
+    prompt_parse_cache,
+    remember_user_context,
+    user_context_cache,
+)
 
-    # Try multiple formats for email
-    email_patterns = [
-        r'User Email:\s*([^\n]+)',     # CopilotKit format
-        r'-\s*Email:\s*([^\n]+)',       # HeroVoice format
-        r'Email:\s*([^\s\n]+)',         # Simple format
-    ]
-    for pattern in email_patterns:
-        email_match = re.search(pattern, instructions, re.IGNORECASE)
-        if email_match:
-            result["email"] = email_match.group(1).strip()
-            break
+if TYPE_CHECKING:
+    # Imported where used (and during warm-up): ag_ui.core adds ~0.2s to import
+    from ag_ui.core import BaseEvent, RunAgentInput
+    from pydantic_ai.ui.ag_ui import AGUIAdapter
 
-    # Cache if we found any user info
-    if result["user_id"] or result["name"]:
-        global _cached_user_context
-        _cached_user_context = result
-        print(f"[Agent] Cached user from instructions: {result}", file=sys.stderr)
+cache_log = get_logger("Cache")
+clm_log = get_logger("CLM")
 
-    return result
+# =====
+# User Context (cached per session, see user_context.py)
+# =====
+def resolve_user(deps: "AgentDeps") -> Optional["UserProfile"]:
+    """Get the user from frontend state, falling back to the session's cached context."""
+    state = deps.state
+    if state and state.user and (state.user.id or state.user.name or state.user.firstName):
+        return state.user
+    cached = get_user_context(deps.session_id)
+    if cached.get("name") or cached.get("user_id"):
+        return UserProfile(
+            id=cached.get("user_id"),
+            name=cached.get("name"),
+            firstName=cached.get("name").split()[0] if cached.get("name") else None,
+            email=cached.get("email")
+        )
+    return None
 
-def get_effective_user_name(state_user) -> Optional[str]:
-    """Get user name from state or cached instructions."""
+def get_effective_user_name(state_user, session_id: Optional[str] = None) -> Optional[str]:
+    """Get user name from state or the session's cached instructions."""
     if state_user and (state_user.firstName or state_user.name):
         return state_user.firstName or state_user.name
-    if _cached_user_context.get("name"):
-        return _cached_user_context["name"]
-    return None
-
-
-# =====
-# HITL Services Data
-# =====
-HITL_SERVICES = [
-    {
-        "name": "AI Customer Service",
-        "description": "Chat and email support that handles routine queries instantly, escalates complex issues to humans with full context.",
-        "benefits": [
-            "24/7 availability with instant response",
-            "Handle 10x more tickets without hiring",
-            "Seamless escalation to human agents",
-            "Full context preservation during handoff",
-            "AI learns from human decisions"
-        ],
-        "tech_stack": ["CopilotKit", "AG-UI", "Zep Memory"],
-        "use_cases": ["E-commerce support", "SaaS helpdesk", "Financial services", "Healthcare inquiries"]
-    },
-    {
-        "name": "Voice Call Systems",
-        "description": "AI voice agents with emotional intelligence that detect when to transfer to humans. Natural, empathetic conversations.",
-        "benefits": [
-            "Emotional awareness through Hume AI",
-            "Natural conversation flow",
-            "Sentiment-based escalation",
-            "Call transfer with full context",
-            "Reduces wait times dramatically"
-        ],
-        "tech_stack": ["Hume AI EVI", "Pydantic AI", "WebRTC"],
-        "use_cases": ["Call centers", "Appointment booking", "Technical support", "Customer callbacks"]
-    },
-    {
-        "name": "Document Processing",
-        "description": "AI extracts and validates data, flags uncertain items for human review. 10x faster with human-level accuracy.",
-        "benefits": [
-            "Automated data extraction",
-            "Confidence scoring for review routing",
-            "Human review for edge cases",
-            "Compliance audit trails",
-            "Structured, validated output"
-        ],
-        "tech_stack": ["Pydantic AI", "Structured Output", "Classification Models"],
-        "use_cases": ["Invoice processing", "Contract analysis", "Medical records", "Insurance claims"]
-    },
-    {
-        "name": "Content Moderation",
-        "description": "AI filters obvious violations, surfaces edge cases for human judgment. Scale moderation without sacrificing quality.",
-        "benefits": [
-            "99%+ clear cases handled by AI",
-            "Nuanced decisions by humans",
-            "Consistent policy enforcement",
-            "Reduced moderator burnout",
-            "Continuous learning from decisions"
-        ],
-        "tech_stack": ["Classification AI", "Human Review Queues", "Feedback Loops"],
-        "use_cases": ["Social platforms", "Marketplaces", "Comment sections", "User uploads"]
-    },
-    {
-        "name": "Decision Support",
-        "description": "AI analyzes data and suggests actions, humans approve or override. Augment expertise, don't replace it.",
-        "benefits": [
-            "Data-driven recommendations",
-            "Human final authority",
-            "Explainable AI suggestions",
-            "Continuous model improvement",
-            "Risk flagging and alerts"
-        ],
-        "tech_stack": ["Analytics AI", "Workflow Engines", "Approval Systems"],
-        "use_cases": ["Loan approvals", "Hiring decisions", "Medical diagnosis assist", "Trading signals"]
-    }
-]
-
-TECH_STACK = {
-    "copilotkit": {
-        "name": "CopilotKit",
-        "category": "AI UI Framework",
-        "description": "Open-source framework for building AI-powered chat interfaces and copilots. Provides React components for chat, sidebars, and AI interactions.",
-        "why_we_use": "Best-in-class developer experience for building conversational AI interfaces. Handles state, streaming, and tool calling seamlessly.",
-        "url": "https://copilotkit.ai"
-    },
-    "ag_ui": {
-        "name": "AG-UI Protocol",
-        "category": "Agent Protocol",
-        "description": "Agent protocol for connecting AI agents to frontend applications. Standardized communication between AI backends and UIs.",
-        "why_we_use": "Enables our Pydantic AI agents to communicate with CopilotKit frontends using a standardized protocol.",
-        "url": "https://ag-ui.com"
-    },
-    "pydantic_ai": {
-        "name": "Pydantic AI",
-        "category": "Agent Framework",
-        "description": "Python framework for building AI agents with structured, validated outputs using Pydantic models.",
-        "why_we_use": "Type-safe, structured AI outputs. Perfect for document processing and data extraction where accuracy matters.",
-        "url": "https://pydantic.dev"
-    },
-    "hume": {
-        "name": "Hume AI",
-        "category": "Emotional Voice AI",
-        "description": "Voice AI with emotional intelligence. EVI (Empathic Voice Interface) understands and responds to emotional cues.",
-        "why_we_use": "Essential for voice systems where emotional awareness determines when to escalate to humans. Natural, empathetic conversations.",
-        "url": "https://hume.ai"
-    },
-    "zep": {
-        "name": "Zep",
-        "category": "Memory Layer",
-        "description": "Long-term memory for AI assistants. Stores conversation history and user facts in a knowledge graph.",
-        "why_we_use": "Enables our agents to remember user context across sessions. Critical for personalized HITL experiences.",
-        "url": "https://getzep.com"
-    },
-    "nextjs": {
-        "name": "Next.js",
-        "category": "React Framework",
-        "description": "The React framework for production. Server-side rendering, API routes, and optimized performance.",
-        "why_we_use": "Industry-standard framework for production React applications. Excellent DX and performance.",
-        "url": "https://nextjs.org"
-    }
-}
-
-HITL_CONCEPTS = {
-    "what_is_hitl": {
-        "title": "What is Human-in-the-Loop?",
-        "explanation": "Human-in-the-Loop (HITL) is an AI design philosophy where humans and machines collaborate. The AI handles high-volume, routine tasks while humans step in for complex situations, edge cases, or when empathy and judgment are needed.",
-        "key_benefits": [
-            "95%+ customer satisfaction (vs 60-70% for full automation)",
-            "80% of volume handled by AI",
-            "10x faster than manual processing",
-            "Continuous improvement from human decisions",
-            "Trust and accountability through human oversight"
-        ]
-    },
-    "escalation": {
-        "title": "How Escalation Works",
-        "explanation": "Our systems use multiple signals to detect when human intervention is needed: confidence scores, sentiment analysis, complexity detection, and explicit user requests.",
-        "key_points": [
-            "AI assesses every interaction for complexity",
-            "Low confidence triggers automatic escalation",
-            "Negative sentiment detected via Hume AI",
-            "Full context passed to human agent",
-            "Customer never repeats themselves"
-        ]
-    },
-    "continuous_learning": {
-        "title": "Continuous Learning",
-        "explanation": "Every human decision teaches the AI. When humans override or adjust AI suggestions, those decisions become training data.",
-        "key_points": [
-            "Human corrections improve AI models",
-            "Feedback loops built into workflows",
-            "Models retrained on production data",
-            "Edge cases become future training examples",
-            "System gets smarter over time"
-        ]
-    }
-}
+    return get_user_context(session_id).get("name")
 
 
 # =====
@@ -257,321 +156,229 @@ class AppState(BaseModel):
     current_page: Optional[str] = None
 
 
+@dataclass
+class AgentDeps(StateDeps[AppState]):
+    """Agent deps: the frontend state plus the session the run belongs to."""
+    session_id: Optional[str] = None
+
+
+# Last state per session, so whichever worker takes the next turn (or a reloaded page) carries on from it
+app_state_store: SessionStore[dict] = SessionStore("app_state", USER_CONTEXT_MAX_SESSIONS, USER_CONTEXT_TTL_SECONDS)
+
+
+async def save_app_state(deps: AgentDeps) -> None:
+    if deps.session_id and deps.state is not None:
+        await app_state_store.save(deps.session_id, deps.state.model_dump(mode="json"))
+
+
 # =====
 # Agent Definition
 # =====
+def current_page(deps: AgentDeps) -> Optional[str]:
+    return deps.state.current_page if deps.state else None
+
+
+async def prepare_page_tools(ctx: RunContext[AgentDeps], tool_defs: list[ToolDefinition]) -> list[ToolDefinition]:
+    """Offer only the current page's tools; frontend (AG-UI) tools always pass through."""
+    allowed = page_tools(current_page(ctx.deps))
+    return [tool for tool in tool_defs if tool.name not in AGENT_TOOLS or tool.name in allowed]
+
+
+# Runs the likely tools before the first model request (tools registered below)
+tool_prefetcher = ToolPrefetcher(available=lambda ctx: page_tools(current_page(ctx.deps)))
+
+# Gemini on the worker's shared connection pool; google-genai is loaded by startup warm-up, not at import
+gemini_model = gemini_pool.model("gemini-2.0-flash")
+# Slow requests get a backup (see hedging.py): to HEDGE_MODEL if set, e.g. a faster/cheaper tier, else the same model
+hedged_model = HedgedModel(gemini_model, backup=gemini_pool.model(HEDGE_MODEL) if HEDGE_MODEL else None)
+# Failing or slow upstream opens the circuit; the endpoints then answer from the catalog (see degraded.py)
+model_breaker = CircuitBreaker("gemini")
+
 agent = Agent(
-    model=GoogleModel('gemini-2.0-flash'),
-    deps_type=StateDeps[AppState],
-    system_prompt=dedent("""
-        You are the AI assistant for HITL.quest - a Human-in-the-Loop AI agency.
-        You help potential clients understand our services and the value of combining AI automation with human oversight.
-
-        ## Your Personality
-        - Professional but approachable
-        - Knowledgeable about AI and HITL design
-        - Enthusiastic about human-AI collaboration
-        - Clear and jargon-free explanations
-
-        ## Your Mission
-        Help visitors understand:
-        1. What Human-in-the-Loop means
-        2. Our services (customer service AI, voice, documents, moderation)
-        3. Our tech stack (CopilotKit, Hume, Pydantic AI, etc.)
-        4. Why HITL is better than full automation OR full manual
-
-        ## Key Value Propositions
-        - 95%+ customer satisfaction (vs 60-70% for full automation)
-        - 80% of volume handled by AI
-        - 10x faster than manual processing
-        - AI learns from human decisions
-        - Enterprise security and compliance
-
-        ## Available Tools - USE THEM
-        | User asks about... | Use this tool |
-        |-------------------|---------------|
-        | Our services | get_services |
-        | A specific service | get_service_details |
-        | Tech stack / tools | get_tech_stack |
-        | What HITL means | explain_hitl |
-        | How escalation works | explain_escalation |
-        | Their profile | get_my_profile |
-        | Getting started | get_next_steps |
-
-        ## Conversation Guidelines
-        - Address logged-in users by name
-        - Use bullet points for clarity
-        - Keep responses concise (this is also used for voice)
-        - Ask clarifying questions about their needs
-        - Encourage them to reach out via /contact
-
-        ## Meta: You ARE a HITL Demo
-        Point out that this very conversation is an example of our work!
-        The CopilotKit chat and Hume voice integration on this site demonstrate our capabilities.
-
-        Remember: We build AI that knows when to ask for help. Be helpful and showcase our expertise!
-    """)
+    model=TimedModel(BreakerModel(hedged_model, model_breaker)),
+    deps_type=AgentDeps,
+    # SYSTEM_PROMPT leads the page prompt in page_instructions, so it is sent on
+    # every request (AG-UI runs never have an empty history to attach it to)
+    # Keep long voice/chat sessions inside the prompt token budget
+    history_processors=[tool_prefetcher, compact_history],
+    # Per-page tool subsets (see prompts.py)
+    prepare_tools=prepare_page_tools,
 )
 
+# What the endpoints run: stops a run (and its tool calls) when its client disconnects or deadline passes
+cancellable_agent = CancellableAgent(agent)
+
+
+# Static prefix first (system prompt + page sections, byte-identical for every
+# user on a page), per-user context last
+@agent.instructions
+def page_instructions(ctx: RunContext[AgentDeps]) -> str:
+    """System prompt, mission, value props, tool table and page context for the current page."""
+    return page_prompt(current_page(ctx.deps))
 
-# Page context descriptions
-PAGE_CONTEXTS = {
-    "customer-service": "User is exploring AI Customer Service solutions. Focus on chat/email automation, escalation, and 10x ticket handling.",
-    "voice": "User is exploring Voice Call Systems. Focus on Hume AI, emotional intelligence, and seamless call transfer.",
-    "document-processing": "User is exploring Document Processing. Focus on extraction, validation, human review for uncertain items.",
-    "content-moderation": "User is exploring Content Moderation. Focus on AI filtering, human judgment for edge cases, scaling.",
-    "contact": "User is on the Contact page. Help them articulate their needs and encourage form submission.",
-    "homepage": "User is on the homepage. Give overview of HITL and help them explore services."
-}
 
 # Dynamic instructions that inject user context from state
 @agent.instructions
-async def user_context_instructions(ctx: RunContext[StateDeps[AppState]]) -> str:
-    """Inject user context into the system prompt dynamically."""
+async def user_context_instructions(ctx: RunContext[AgentDeps]) -> str:
+    """Inject user context into the system prompt dynamically (rendered once per distinct user state)."""
     state = ctx.deps.state
-    user = state.user if state else None
-
-    # Get page context
-    current_page = state.current_page if state else None
-    page_context = PAGE_CONTEXTS.get(current_page or "", PAGE_CONTEXTS["homepage"])
+    user = resolve_user(ctx.deps)
 
-    # Build user context section
     if user and (user.name or user.firstName):
         first_name = user.firstName or (user.name.split()[0] if user.name else None)
-
-        return dedent(f"""
-            ## CURRENT PAGE CONTEXT
-            {page_context}
-
-            ## CURRENT USER CONTEXT
-            You are speaking with a logged-in user:
-            - Name: {user.name or 'Unknown'}
-            - First Name: {first_name or 'Unknown'}
-            - Email: {user.email or 'Not provided'}
-            - Interested Services: {', '.join(state.interested_services) if state.interested_services else 'Not specified'}
-            - Company Type: {state.company_type or 'Not specified'}
-            - Use Case: {state.use_case or 'Not specified'}
-
-            IMPORTANT INSTRUCTIONS:
-            - ALWAYS address the user by their first name ({first_name}) in your responses
-            - When they ask about their profile, tell them: "{user.name}"
-            - Reference their interests when relevant
-        """)
+        context = user_context_prompt(
+            user.name,
+            first_name,
+            user.email,
+            state.interested_services,
+            state.company_type,
+            state.use_case,
+        )
     else:
-        return dedent(f"""
-            ## CURRENT PAGE CONTEXT
-            {page_context}
+        context = GUEST_CONTEXT
 
-            ## GUEST USER
-            This user is not logged in. They can browse general information.
-            Encourage them to sign in for a personalized experience.
-        """)
+    prompt_layout_stats.record(len(page_prompt(current_page(ctx.deps))), len(context))
+    return context
 
 
 # =====
 # Tools
 # =====
-@agent.tool
-def get_services(ctx: RunContext[StateDeps[AppState]]) -> dict:
+def record_interest(deps: AgentDeps, service: str) -> None:
+    """Note a service the user asked about; on AG-UI the change is synced back to the browser (see state_sync.py)."""
+    if deps.state is not None and service not in deps.state.interested_services:
+        deps.state.interested_services.append(service)
+
+
+def looked_up_services(messages: list[ModelMessage]) -> tuple[str, ...]:
+    """Services the model itself asked get_service_details about in a run (prefetched guesses excluded)."""
+    snapshot = catalog.current
+    services = []
+    for message in messages:
+        if not isinstance(message, ModelResponse):
+            continue
+        for part in message.parts:
+            if not isinstance(part, ToolCallPart) or part.tool_name != "get_service_details":
+                continue
+            if is_prefetched(part.tool_call_id):
+                continue
+            try:
+                service_name = str(part.args_as_dict().get("service_name", ""))
+            except ValueError:
+                continue
+            if matches := snapshot.match_services(service_name):
+                services.append(matches[0].key)
+    return tuple(dict.fromkeys(services))
+
+
+def agent_tool(func):
+    """Register a tool on the agent, recording its call count and duration."""
+    return agent.tool(timed_tool(func))
+
+
+@agent_tool
+def get_services(ctx: RunContext[AgentDeps]) -> dict:
     """
     Get an overview of all HITL services we offer.
     Use when the user wants to know what we do.
     """
-    return {
-        "title": "Our Human-in-the-Loop Services",
-        "services": [
-            {
-                "name": s["name"],
-                "description": s["description"],
-                "tech_stack": s["tech_stack"]
-            }
-            for s in HITL_SERVICES
-        ],
-        "note": "Each service combines AI automation with intelligent human escalation for the best of both worlds."
-    }
+    return catalog.current.payloads["get_services"]
 
 
-@agent.tool
+@agent_tool
 def get_service_details(
-    ctx: RunContext[StateDeps[AppState]],
+    ctx: RunContext[AgentDeps],
     service_name: str
 ) -> dict:
     """
     Get detailed information about a specific service.
+    Returns the best match with its score, plus any other close matches.
 
     Args:
         service_name: The service to get details for (e.g., "customer service", "voice", "document", "moderation", "decision")
     """
-    service_lower = service_name.lower()
-
-    for service in HITL_SERVICES:
-        if any(keyword in service_lower for keyword in service["name"].lower().split()):
-            return {
-                "service": service["name"],
-                "description": service["description"],
-                "benefits": service["benefits"],
-                "tech_stack": service["tech_stack"],
-                "use_cases": service["use_cases"]
-            }
+    snapshot = catalog.current
+    matches = snapshot.match_services(service_name)
+    if matches:
+        best, others = matches[0], matches[1:]
+        # A prefetched call is the router's guess at the question, not something the user asked about
+        if not is_prefetched(ctx.tool_call_id):
+            record_interest(ctx.deps, best.key)
+        return {
+            **snapshot.service_details[best.key],
+            "match_score": best.score,
+            "other_matches": [{"service": m.key, "score": m.score} for m in others]
+        }
 
     return {
         "error": f"Service not found: {service_name}",
-        "available_services": [s["name"] for s in HITL_SERVICES],
-        "suggestion": "Try: 'customer service', 'voice', 'document processing', 'content moderation', or 'decision support'"
+        "available_services": list(snapshot.service_details),
+        "suggestion": snapshot.data["service_suggestion"]
     }
 
 
-@agent.tool
+@agent_tool
 def get_tech_stack(
-    ctx: RunContext[StateDeps[AppState]],
+    ctx: RunContext[AgentDeps],
     technology: Optional[str] = None
 ) -> dict:
     """
     Get information about our tech stack.
+    With a technology, returns the best match with its score, plus any other close matches.
 
     Args:
         technology: Optional specific technology to learn about (e.g., "copilotkit", "hume", "pydantic")
     """
+    snapshot = catalog.current
     if technology:
-        tech_lower = technology.lower().replace(" ", "_").replace("-", "_")
-
-        # Handle variations
-        if "copilot" in tech_lower:
-            tech_lower = "copilotkit"
-        elif "ag" in tech_lower or "agui" in tech_lower:
-            tech_lower = "ag_ui"
-        elif "pydantic" in tech_lower:
-            tech_lower = "pydantic_ai"
-        elif "hume" in tech_lower:
-            tech_lower = "hume"
-        elif "zep" in tech_lower:
-            tech_lower = "zep"
-        elif "next" in tech_lower:
-            tech_lower = "nextjs"
-
-        if tech_lower in TECH_STACK:
-            tech = TECH_STACK[tech_lower]
-            return {
-                "technology": tech["name"],
-                "category": tech["category"],
-                "description": tech["description"],
-                "why_we_use": tech["why_we_use"],
-                "url": tech["url"]
-            }
-        else:
+        matches = snapshot.match_tech(technology)
+        if matches:
+            best, others = matches[0], matches[1:]
             return {
-                "error": f"Technology not found: {technology}",
-                "available": list(TECH_STACK.keys())
+                **snapshot.tech_details[best.key],
+                "match_score": best.score,
+                "other_matches": [
+                    {"technology": snapshot.tech_details[m.key]["technology"], "score": m.score} for m in others
+                ]
             }
+        return {
+            "error": f"Technology not found: {technology}",
+            "available": list(snapshot.tech_details)
+        }
 
     # Return all tech stack
-    return {
-        "title": "Our Tech Stack",
-        "technologies": [
-            {
-                "name": t["name"],
-                "category": t["category"],
-                "why_we_use": t["why_we_use"]
-            }
-            for t in TECH_STACK.values()
-        ]
-    }
+    return snapshot.payloads["get_tech_stack"]
 
 
-@agent.tool
-def explain_hitl(ctx: RunContext[StateDeps[AppState]]) -> dict:
+@agent_tool
+def explain_hitl(ctx: RunContext[AgentDeps]) -> dict:
     """
     Explain what Human-in-the-Loop AI means.
     Use when the user asks about HITL concepts.
     """
-    concept = HITL_CONCEPTS["what_is_hitl"]
-    return {
-        "title": concept["title"],
-        "explanation": concept["explanation"],
-        "key_benefits": concept["key_benefits"],
-        "comparison": {
-            "full_automation": {
-                "satisfaction": "60-70%",
-                "handles": "Simple queries only",
-                "edge_cases": "Fails or frustrates"
-            },
-            "full_manual": {
-                "satisfaction": "High but slow",
-                "handles": "Everything",
-                "edge_cases": "Expensive at scale"
-            },
-            "hitl": {
-                "satisfaction": "95%+",
-                "handles": "80% by AI, 20% by humans",
-                "edge_cases": "Seamlessly escalated"
-            }
-        }
-    }
+    return catalog.current.payloads["explain_hitl"]
 
 
-@agent.tool
-def explain_escalation(ctx: RunContext[StateDeps[AppState]]) -> dict:
+@agent_tool
+def explain_escalation(ctx: RunContext[AgentDeps]) -> dict:
     """
     Explain how the escalation to humans works.
     Use when user asks about handoffs or escalation.
     """
-    concept = HITL_CONCEPTS["escalation"]
-    return {
-        "title": concept["title"],
-        "explanation": concept["explanation"],
-        "how_it_works": concept["key_points"],
-        "triggers": [
-            "Low AI confidence score",
-            "Negative sentiment detected",
-            "Complex multi-step request",
-            "User explicitly asks for human",
-            "High-stakes decision required"
-        ],
-        "what_human_sees": [
-            "Full conversation history",
-            "AI analysis and suggestions",
-            "Customer intent summary",
-            "Recommended actions"
-        ]
-    }
+    return catalog.current.payloads["explain_escalation"]
 
 
-@agent.tool
-def get_next_steps(ctx: RunContext[StateDeps[AppState]]) -> dict:
+@agent_tool
+def get_next_steps(ctx: RunContext[AgentDeps]) -> dict:
     """
     Get next steps for working with HITL.quest.
     Use when user wants to get started or asks about process.
     """
-    return {
-        "title": "Getting Started with HITL.quest",
-        "steps": [
-            {
-                "step": 1,
-                "title": "Discovery Call",
-                "description": "We learn about your current processes, pain points, and goals."
-            },
-            {
-                "step": 2,
-                "title": "Solution Design",
-                "description": "We design a custom HITL system for your specific needs."
-            },
-            {
-                "step": 3,
-                "title": "MVP Build",
-                "description": "We build a minimum viable product to validate the approach."
-            },
-            {
-                "step": 4,
-                "title": "Deploy & Iterate",
-                "description": "We deploy, monitor, and continuously improve based on real data."
-            }
-        ],
-        "cta": "Ready to start? Fill out the contact form at /contact and we'll be in touch!"
-    }
+    return catalog.current.payloads["get_next_steps"]
 
 
-@agent.tool
-def get_my_profile(ctx: RunContext[StateDeps[AppState]]) -> dict:
+@agent_tool
+def get_my_profile(ctx: RunContext[AgentDeps]) -> dict:
     """
     Get the current user's profile information.
     Use when user asks about their profile or account.
@@ -579,11 +386,12 @@ def get_my_profile(ctx: RunContext[StateDeps[AppState]]) -> dict:
     state = ctx.deps.state
     user = state.user if state else None
 
-    # Try to get info from state first, then from cached instructions
-    user_id = user.id if user and user.id else _cached_user_context.get("user_id")
-    name = get_effective_user_name(user)
+    # Try to get info from state first, then from the session's cached instructions
+    cached = get_user_context(ctx.deps.session_id)
+    user_id = user.id if user and user.id else cached.get("user_id")
+    name = get_effective_user_name(user, ctx.deps.session_id)
     first_name = user.firstName if user and user.firstName else (name.split()[0] if name else None)
-    email = user.email if user and user.email else _cached_user_context.get("email")
+    email = user.email if user and user.email else cached.get("email")
 
     if not user_id and not name:
         return {
@@ -607,14 +415,278 @@ def get_my_profile(ctx: RunContext[StateDeps[AppState]]) -> dict:
     }
 
 
+tool_prefetcher.register(
+    get_services,
+    get_service_details,
+    get_tech_stack,
+    explain_hitl,
+    explain_escalation,
+    get_my_profile,
+    get_next_steps,
+)
+
+
+# =====
+# Answer Cache
+# =====
+# Versioned by everything a cached answer is built from, so a catalog reload
+# or an edit to the prompts or page tool sets invalidates every entry
+def answer_cache_version(snapshot: CatalogSnapshot) -> str:
+    tools = {page: sorted(page_tools(page)) for page in PAGE_PROMPTS}
+    return catalog_version(snapshot.version, SYSTEM_PROMPT, PAGE_PROMPTS, tools)
+
+
+response_cache = ResponseCache(answer_cache_version(catalog.current))
+catalog.on_change(lambda snapshot: response_cache.invalidate(answer_cache_version(snapshot)))
+
+
+def answer_cache_key(query: str, deps: AgentDeps) -> tuple:
+    """Cache key for a first-turn question: normalized query, current page and who it was answered for."""
+    user = resolve_user(deps)
+    user_key = (user.id or user.email or user.name or user.firstName) if user else None
+    return response_cache.key(query, current_page(deps), user_key)
+
+
+def cache_answer(key: tuple, text: str, messages: list[ModelMessage]) -> None:
+    """Store a run's answer with the services it looked up, so a replay records the same interests."""
+    response_cache.put(key, text, messages, looked_up_services(messages))
+
+
+def replay_interests(deps: AgentDeps, answer: CachedAnswer) -> None:
+    for service in answer.services:
+        record_interest(deps, service)
+
+
+# =====
+# Metrics (see metrics.py; served on /metrics)
+# =====
+def record_run(messages: list[ModelMessage], endpoint: str, started: float) -> None:
+    """Agent run duration and how many model requests it took."""
+    stage_duration.observe(time.perf_counter() - started, "agent_run")
+    model_requests_per_run.observe(model_requests(messages), endpoint)
+
+
+def cache_stats() -> dict:
+    return {
+        "response": response_cache.stats(),
+        "history": history_store.stats(),
+        "user_context": user_context_cache.stats(),
+        "app_state": app_state_store.stats(),
+        "prompt_parse": prompt_parse_cache.stats(),
+    }
+
+
+# Read only when /metrics is scraped
+metrics_registry.collect(lambda: cache_families(cache_stats()))
+metrics_registry.collect(lambda: [
+    *stats_families("hitl_compaction", compaction_stats.snapshot(), "History compaction (see /stats)"),
+    *stats_families("hitl_prefetch", tool_prefetcher.stats.snapshot(), "Tool prefetch (see /stats)"),
+    *stats_families("hitl_prompt_layout", prompt_layout_stats.snapshot(), "Prompt layout (see /stats)"),
+    *stats_families("hitl_http_pool", gemini_pool.stats(), "Gemini connection pool (see /stats)"),
+    *stats_families("hitl_admission", admission.snapshot(), "Admission control (see /stats)"),
+    *stats_families("hitl_coalescing", clm_flights.snapshot(), "Duplicate CLM request coalescing (see /stats)"),
+    *stats_families("hitl_hedging", hedged_model.snapshot(), "Hedged model requests (see /stats)"),
+    *stats_families("hitl_breaker", model_breaker.snapshot(), "Model circuit breaker (see /stats)"),
+    *stats_families("hitl_state_sync", state_sync_stats.snapshot(), "AG-UI state sync (see /stats)"),
+    *stats_families("hitl_logging", log_stats.snapshot(), "Log queue (see /stats)"),
+    *stats_families("hitl_startup", {"ready": readiness.ready}, "Startup warm-up (see /ready)"),
+])
+
+
 # =====
 # FastAPI App Setup
 # =====
+def overloaded_response(error: Overloaded) -> JSONResponse:
+    """429/503 with Retry-After for a run refused by admission control (OpenAI-style error body)."""
+    return JSONResponse(
+        {"error": {"message": "The agent is busy, retry shortly", "type": "overloaded", "code": error.reason}},
+        status_code=error.status_code,
+        headers=error.headers,
+    )
+
+
+async def remember_agui_user(session_id: str, adapter: "AGUIAdapter") -> None:
+    """Cache the user from AG-UI frontend state or CopilotKit instructions for this thread."""
+    user = (adapter.state or {}).get("user") or {}
+    user_info = {
+        "user_id": user.get("id"),
+        "name": user.get("name") or user.get("firstName"),
+        "email": user.get("email"),
+    }
+    if not (user_info["user_id"] or user_info["name"]):
+        for msg in adapter.run_input.messages:
+            if msg.role in ("system", "developer") and isinstance(msg.content, str):
+                user_info = extract_user_from_instructions(msg.content)
+                break
+    await remember_user_context(session_id, user_info)
+
+
+def first_agui_question(adapter: "AGUIAdapter") -> Optional[str]:
+    """The user's question if this run opens the thread; follow-ups depend on history and are not cached."""
+    messages = adapter.messages
+    if any(isinstance(msg, ModelResponse) for msg in messages):
+        return None
+    prompts = [part.content for msg in messages for part in msg.parts if isinstance(part, UserPromptPart)]
+    if len(prompts) != 1 or not isinstance(prompts[0], str):
+        return None
+    return prompts[0]
+
+
+def last_agui_question(adapter: "AGUIAdapter") -> str:
+    """The user's latest text prompt in the thread, or "" if there is none."""
+    prompts = [
+        part.content for msg in adapter.messages for part in msg.parts
+        if isinstance(part, UserPromptPart) and isinstance(part.content, str)
+    ]
+    return prompts[-1] if prompts else ""
+
+
+async def stream_text_answer(
+    run_input: "RunAgentInput", text: str, on_complete: Optional[Callable[[], Awaitable[None]]] = None
+) -> AsyncIterator["BaseEvent"]:
+    """Send a ready answer (cached or degraded) as the AG-UI events of a single text message."""
+    from ag_ui.core import (
+        RunFinishedEvent,
+        RunStartedEvent,
+        TextMessageContentEvent,
+        TextMessageEndEvent,
+        TextMessageStartEvent,
+    )
+
+    timestamp = int(time.time() * 1000)
+    message_id = str(uuid.uuid4())
+    yield RunStartedEvent(thread_id=run_input.thread_id, run_id=run_input.run_id, timestamp=timestamp)
+    yield TextMessageStartEvent(message_id=message_id, timestamp=timestamp)
+    yield TextMessageContentEvent(message_id=message_id, delta=text, timestamp=timestamp)
+    yield TextMessageEndEvent(message_id=message_id, timestamp=timestamp)
+    if on_complete is not None:
+        await on_complete()
+    yield RunFinishedEvent(thread_id=run_input.thread_id, run_id=run_input.run_id, timestamp=timestamp)
+
+
+async def run_ag_ui(request: Request) -> Response:
+    """AG-UI endpoint for CopilotKit; user context is resolved per thread, state changes stream back as deltas."""
+    from pydantic_ai.ui.ag_ui import AGUIAdapter
+
+    set_deadline(request)
+    try:
+        adapter = await AGUIAdapter.from_request(request, agent=cancellable_agent)
+    except ValidationError as e:
+        return Response(content=e.json(), media_type="application/json", status_code=422)
+
+    session_id = f"agui:{adapter.run_input.thread_id}"
+    await remember_agui_user(session_id, adapter)
+    deps = AgentDeps(AppState(), session_id=session_id)
+    # A client without state (a new tab on the thread, a reloaded page) picks up the thread's last state
+    client_state = adapter.state
+    if client_state is None and (stored := await app_state_store.load(session_id)) is not None:
+        # A new adapter, as the state it read from the request is cached
+        adapter = replace(adapter, run_input=adapter.run_input.model_copy(update={"state": stored}))
+
+    # Opening questions are answered from the cache when possible
+    cache_key = None
+    if question := first_agui_question(adapter):
+        try:
+            frontend_deps = AgentDeps(AppState.model_validate(adapter.state or {}), session_id=session_id)
+            cache_key = answer_cache_key(question, frontend_deps)
+        except ValidationError:
+            cache_key = None
+    if cache_key and (answer := response_cache.get(cache_key)) is not None:
+        cache_log.info("Answer cache hit", endpoint="agui", query=question[:50])
+
+        # The state changes the answering run made, as if it ran again
+        async def on_replayed() -> None:
+            replay_interests(frontend_deps, answer)
+            await save_app_state(frontend_deps)
+
+        events = stream_text_answer(adapter.run_input, answer.text, on_replayed)
+        return adapter.streaming_response(sync_state(events, client_state, lambda: frontend_deps.state))
+    if model_breaker.rejecting:
+        answer = degraded_answer(last_agui_question(adapter), "agui")
+        return adapter.streaming_response(stream_text_answer(adapter.run_input, answer))
+
+    try:
+        slot = await until_disconnected(request, admission.acquire("chat", session_id))
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ClientDisconnected:
+        return Response(status_code=CLIENT_CLOSED_REQUEST)
+    started = time.perf_counter()
+
+    async def on_complete(result) -> None:
+        record_run(result.new_messages(), "agui", started)
+        await save_app_state(deps)
+        if cache_key:
+            cache_answer(cache_key, str(result.output), result.all_messages())
+
+    # State changes made by tools go to the browser as JSON Patch deltas against the state it sent
+    events = sync_state(adapter.run_stream(deps=deps, on_complete=on_complete), client_state, lambda: deps.state)
+    return adapter.streaming_response(release_after(events, slot))
+
+
 # Export agent as AG-UI app
-ag_ui_app = agent.to_ag_ui(deps=StateDeps(AppState()))
+ag_ui_app = Starlette(routes=[Route("/", run_ag_ui, methods=["POST"])])
+
+# =====
+# Startup
+# =====
+# /ready succeeds once every step has; opening connections only has to have been tried (see gemini_client.py)
+readiness = Readiness("catalog", "agui", "session_store", "model", "connections")
+
+
+def warm_catalog() -> None:
+    """Exercise the catalog snapshot, its similarity indexes and the prefetch planner once."""
+    snapshot = catalog.current
+    snapshot.match_services("customer service")
+    snapshot.match_tech("copilotkit")
+    plan_tool_calls("what services do you offer")
+
+
+def import_agui() -> None:
+    """Load the AG-UI protocol modules the /agui endpoint imports on first use."""
+    import ag_ui.core  # noqa: F401
+    import pydantic_ai.ui.ag_ui  # noqa: F401
+
+
+def load_models() -> None:
+    gemini_model.load()
+    hedged_model.backup.load()
+
+
+async def connect_session_store() -> None:
+    """Open the shared session store (if configured), retrying until it answers; then reopen it after any failure."""
+    # Not ready until it is reachable: this worker could not continue sessions
+    while not await readiness.run("session_store", lambda: asyncio.to_thread(open_session_backend)):
+        await asyncio.sleep(SESSION_STORE_RETRY_SECONDS)
+    await keep_session_backend()
+
+
+async def warm_up() -> None:
+    await readiness.run("catalog", warm_catalog)
+    await readiness.run("agui", lambda: asyncio.to_thread(import_agui))
+    # The google-genai import is slow and synchronous; keep the event loop free for /health
+    await readiness.run("model", lambda: asyncio.to_thread(load_models))
+    await readiness.run("connections", gemini_pool.warm_up)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Warm up in the background so the server binds at once; close the Gemini pool and session store on shutdown."""
+    warming = asyncio.create_task(warm_up())
+    session_store = asyncio.create_task(connect_session_store())
+    yield
+    warming.cancel()
+    session_store.cancel()
+    await gemini_pool.close()
+    close_session_backend()
+
 
 # Main FastAPI app
-main_app = FastAPI(title="HITL.quest Agent", description="AI assistant for Human-in-the-Loop agency")
+main_app = FastAPI(
+    title="HITL.quest Agent",
+    description="AI assistant for Human-in-the-Loop agency",
+    lifespan=lifespan,
+)
 
 # CORS middleware
 main_app.add_middleware(
@@ -625,6 +697,14 @@ main_app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so streamed bodies are timed through to their last chunk
+main_app.add_middleware(
+    MetricsMiddleware,
+    endpoints=(
+        "/agui", "/chat/completions", "/health", "/ready", "/stats", "/metrics", "/catalog/reload", "/catalog", "/",
+    ),
+)
+
 @main_app.get("/")
 def root():
     """Health check endpoint."""
@@ -634,15 +714,67 @@ def root():
         "endpoints": [
             "/agui (AG-UI for CopilotKit)",
             "/chat/completions (CLM for Hume Voice)",
-            "/health"
+            "/health",
+            "/ready",
+            "/stats",
+            "/metrics",
+            "/catalog"
         ]
     }
 
 @main_app.get("/health")
 def health():
-    """Health check for Railway."""
+    """Liveness: the process is up, though it may still be warming up (see /ready)."""
     return {"status": "healthy"}
 
+@main_app.get("/ready")
+def ready():
+    """Readiness for Railway's healthcheck: 503 until every warm-up step has finished."""
+    snapshot = readiness.snapshot()
+    return JSONResponse(
+        {"status": "ready" if snapshot["ready"] else "warming", **snapshot},
+        status_code=200 if snapshot["ready"] else 503,
+    )
+
+@main_app.get("/stats")
+def stats():
+    """Counters and cache statistics from each part of the agent, as JSON."""
+    return {
+        "caches": cache_stats(),
+        "compaction": compaction_stats.snapshot(),
+        "prefetch": tool_prefetcher.stats.snapshot(),
+        "prompt_layout": prompt_layout_stats.snapshot(),
+        "http_pool": gemini_pool.stats(),
+        "admission": admission.snapshot(),
+        "coalescing": clm_flights.snapshot(),
+        "hedging": hedged_model.snapshot(),
+        "breaker": model_breaker.snapshot(),
+        "state_sync": state_sync_stats.snapshot(),
+        "startup": readiness.snapshot(),
+        "logging": log_stats.snapshot(),
+        "catalog": {"version": catalog.version, "reloads": catalog.reloads},
+    }
+
+@main_app.get("/metrics")
+def metrics():
+    """Prometheus text: latency histograms, tool and model timings, cache and /stats counters."""
+    return PlainTextResponse(metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@main_app.get("/catalog")
+def get_catalog(request: Request):
+    """The catalog file behind the tools, with its version as ETag."""
+    snapshot = catalog.current
+    headers = {"ETag": snapshot.etag}
+    if request.headers.get("if-none-match") == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+@main_app.post("/catalog/reload")
+def reload_catalog():
+    """Re-read the catalog file now instead of waiting for the next poll."""
+    changed = catalog.reload()
+    return {"version": catalog.version, "changed": changed}
+
 
 # =====
 # CLM Endpoint for Hume Voice
@@ -658,106 +790,271 @@ class ChatCompletionRequest(BaseModel):
     stream: Optional[bool] = True
 
 
-async def stream_sse_response(content: str, msg_id: str):
-    """Stream OpenAI-compatible SSE chunks for Hume EVI."""
-    words = content.split(' ')
-    for i, word in enumerate(words):
-        chunk = {
-            "id": msg_id,
-            "object": "chat.completion.chunk",
-            "created": int(time.time()),
-            "model": "hitl-quest-agent",
-            "choices": [{
-                "index": 0,
-                "delta": {"content": word + (' ' if i < len(words) - 1 else '')},
-                "finish_reason": None
-            }]
-        }
-        yield f"data: {json.dumps(chunk)}\n\n"
-        await asyncio.sleep(0.01)
+# Agent message history per CLM session
+history_store = HistoryStore()
 
-    final = {
-        "id": msg_id,
-        "object": "chat.completion.chunk",
-        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
-    }
-    yield f"data: {json.dumps(final)}\n\n"
-    yield "data: [DONE]\n\n"
+# CLM turns in flight, by session and message digest
+clm_flights = SingleFlight("clm")
+
+
+CLM_ERROR_MESSAGE = "Sorry, I couldn't process that request. Try asking about our HITL services!"
+
+
+async def build_clm_deps(system_prompt: str = None, session: Optional[str] = None) -> AgentDeps:
+    """Build agent deps for a CLM turn, seeding the user from the Hume system prompt."""
+    # Extract user context from system prompt if provided, falling back to the session cache
+    user_info = extract_user_from_instructions(system_prompt) if system_prompt else {}
+    user_info = await remember_user_context(session, user_info)
+
+    # Build state on the session's last one, with the session's user if available
+    stored = await app_state_store.load(session) if session else None
+    state = AppState.model_validate(stored) if stored else AppState()
+    if user_info.get("name") or user_info.get("user_id"):
+        state.user = UserProfile(
+            id=user_info.get("user_id"),
+            name=user_info.get("name"),
+            firstName=user_info.get("name"),
+            email=user_info.get("email")
+        )
+        clm_log.debug("State user set", session=session, name=state.user.name)
 
+    return AgentDeps(state, session_id=session)
 
-async def run_agent_for_clm(user_message: str, system_prompt: str = None) -> str:
+
+@dataclass
+class ClmTurn:
+    """
+    A CLM turn after prompt parsing: its deps, answer cache key and the answer
+    to give without an agent run, if any (a cache hit, or a degraded answer
+    while the model circuit is open).
+    """
+    deps: AgentDeps
+    cache_key: Optional[tuple]
+    cached: Optional[str]
+
+
+async def prepare_clm_turn(
+    user_message: str,
+    system_prompt: str = None,
+    session: Optional[str] = None,
+    turns: Sequence[Turn] = (),
+) -> ClmTurn:
+    """Parse the user from the system prompt and look the question up in the answer cache (or degrade, circuit open)."""
+    with stage_duration.time("prompt_parse"):
+        deps = await build_clm_deps(system_prompt, session)
+    cache_key = answer_cache_key(user_message, deps) if len(turns) <= 1 else None
+    answer = response_cache.get(cache_key) if cache_key else None
+    cached = answer.text if answer else None
+    if answer is not None:
+        cache_log.info("Answer cache hit", endpoint="clm", query=user_message[:50])
+        replay_interests(deps, answer)
+        await save_app_state(deps)
+    elif model_breaker.rejecting:
+        cached = degraded_answer(user_message, "clm")
+    return ClmTurn(deps, cache_key, cached)
+
+
+async def resolve_clm_history(session: Optional[str], turns: Sequence[Turn]) -> Optional[list[ModelMessage]]:
+    """Look up the stored message history for a CLM session, appending any unseen turns."""
+    if not session or not turns:
+        return None
+    history = await history_store.resolve(session, turns)
+    clm_log.debug("Resolved history", session=session, messages=len(history))
+    return history
+
+
+async def run_agent_for_clm(
+    user_message: str,
+    turn: ClmTurn,
+    session: Optional[str] = None,
+    turns: Sequence[Turn] = (),
+) -> str:
     """Run the Pydantic AI agent and return text response."""
+    if turn.cached is not None:
+        return turn.cached
     try:
-        # Extract user context from system prompt if provided
-        if system_prompt:
-            extract_user_from_instructions(system_prompt)
-
-        print(f"[CLM] Starting agent run for: {user_message[:50]}", file=sys.stderr)
-        print(f"[CLM] Cached user context: {_cached_user_context}", file=sys.stderr)
-
-        # Build state with cached user if available
-        state = AppState()
-        if _cached_user_context.get("name") or _cached_user_context.get("user_id"):
-            state.user = UserProfile(
-                id=_cached_user_context.get("user_id"),
-                name=_cached_user_context.get("name"),
-                firstName=_cached_user_context.get("name"),
-                email=_cached_user_context.get("email")
-            )
-            print(f"[CLM] State user set: {state.user.name}", file=sys.stderr)
-
-        deps = StateDeps(state)
-        result = await agent.run(user_message, deps=deps)
-        print(f"[CLM] Agent result type: {type(result)}", file=sys.stderr)
+        clm_log.debug("Starting agent run", query=user_message[:50])
+        with stage_duration.time("history"):
+            history = await resolve_clm_history(session, turns)
+        started = time.perf_counter()
+        result = await cancellable_agent.run(user_message, deps=turn.deps, message_history=history)
+        record_run(result.new_messages(), "clm", started)
 
         # Pydantic AI returns result.output for the text response
         if hasattr(result, 'output') and result.output:
-            return str(result.output)
-        if hasattr(result, 'data') and result.data:
-            return str(result.data)
-        return str(result)
+            response_text = str(result.output)
+        elif hasattr(result, 'data') and result.data:
+            response_text = str(result.data)
+        else:
+            response_text = str(result)
+
+        if session and turns:
+            await history_store.save(session, turns, result.all_messages(), response_text)
+        await save_app_state(turn.deps)
+        if turn.cache_key:
+            cache_answer(turn.cache_key, response_text, result.all_messages())
+        return response_text
+    except CircuitOpen:
+        return degraded_answer(user_message, "clm")
+    except DeadlineExceeded:
+        clm_log.warning("Deadline passed", session=session)
+        return CLM_ERROR_MESSAGE
+    except Exception as e:
+        clm_log.exception("Agent error", error=str(e))
+        return CLM_ERROR_MESSAGE
+
+
+async def stream_agent_for_clm(
+    user_message: str,
+    turn: ClmTurn,
+    session: Optional[str] = None,
+    turns: Sequence[Turn] = (),
+) -> AsyncIterator[str]:
+    """
+    Run the Pydantic AI agent and yield text deltas as the model produces them.
+
+    Text from every model response is forwarded, including anything the model
+    says before a tool call, so the first delta reaches Hume after one model
+    round-trip instead of after the whole run.
+    """
+    if turn.cached is not None:
+        yield turn.cached
+        return
+    emitted = ""
+    try:
+        clm_log.debug("Starting streaming agent run", query=user_message[:50])
+        with stage_duration.time("history"):
+            history = await resolve_clm_history(session, turns)
+        started = time.perf_counter()
+        async for event in cancellable_agent.run_stream_events(user_message, deps=turn.deps, message_history=history):
+            delta = None
+            if isinstance(event, PartStartEvent) and isinstance(event.part, TextPart):
+                delta = event.part.content
+                # Separate text from consecutive model responses (before/after a tool call)
+                if delta and emitted and not emitted[-1].isspace() and not delta[0].isspace():
+                    delta = " " + delta
+            elif isinstance(event, PartDeltaEvent) and isinstance(event.delta, TextPartDelta):
+                delta = event.delta.content_delta
+            elif isinstance(event, FunctionToolCallEvent):
+                clm_log.debug("Tool call", tool=event.part.tool_name)
+            elif isinstance(event, AgentRunResultEvent):
+                record_run(event.result.new_messages(), "clm", started)
+                if session and turns:
+                    await history_store.save(session, turns, event.result.all_messages(), emitted)
+                await save_app_state(turn.deps)
+                if turn.cache_key:
+                    cache_answer(turn.cache_key, emitted, event.result.all_messages())
+
+            if delta:
+                emitted += delta
+                yield delta
+
+        clm_log.info("Response", response=emitted[:80])
+    except CircuitOpen:
+        # Opened while this run was under way; text already sent stands
+        if not emitted:
+            yield degraded_answer(user_message, "clm")
+    except DeadlineExceeded:
+        clm_log.warning("Deadline passed", session=session, emitted=len(emitted))
+        if not emitted:
+            yield CLM_ERROR_MESSAGE
     except Exception as e:
-        import traceback
-        print(f"[CLM] Agent error: {e}", file=sys.stderr)
-        print(f"[CLM] Traceback: {traceback.format_exc()}", file=sys.stderr)
-        return "Sorry, I couldn't process that request. Try asking about our HITL services!"
+        clm_log.exception("Agent error", error=str(e))
+        if not emitted:
+            yield CLM_ERROR_MESSAGE
+
+
+async def start_clm_run(
+    user_message: str,
+    turn: ClmTurn,
+    session: Optional[str] = None,
+    turns: Sequence[Turn] = (),
+    stream: bool = True,
+) -> AsyncIterator[str]:
+    """
+    Admit a CLM turn and return its output: text deltas when streaming,
+    otherwise the whole answer as one item. Cached answers skip admission.
+    """
+    slot = await admission.acquire("voice", session) if turn.cached is None else None
+    if stream:
+        answer = stream_agent_for_clm(user_message, turn, session, turns)
+    else:
+        async def whole() -> AsyncIterator[str]:
+            yield await run_agent_for_clm(user_message, turn, session, turns)
+        answer = whole()
+    return release_after(answer, slot) if slot else answer
+
+
+async def join_text(chunks: AsyncIterator[str]) -> str:
+    return "".join([text async for text in chunks])
 
 
 @main_app.post("/chat/completions")
-async def clm_endpoint(request: ChatCompletionRequest):
-    """OpenAI-compatible endpoint for Hume CLM."""
+async def clm_endpoint(
+    request: ChatCompletionRequest,
+    http_request: Request,
+    output: Literal["voice", "markdown"] = CLM_OUTPUT_MODE,
+    custom_session_id: Optional[str] = None,
+):
+    """
+    OpenAI-compatible endpoint for Hume CLM, with history kept per `custom_session_id`.
+    `output=voice` (the default) streams speakable sentences; `output=markdown` the agent text unchanged.
+    """
+    set_deadline(http_request)
     # Extract system prompt (contains user context from Hume)
     system_prompt = None
     for msg in request.messages:
         if msg.role == "system":
             system_prompt = msg.content
-            print(f"[CLM] Found system prompt: {system_prompt[:100]}...", file=sys.stderr)
-            break
-
-    # Get user message (last non-system message)
-    user_message = ""
-    for msg in reversed(request.messages):
-        if msg.role == "user":
-            user_message = msg.content
+            # Only the size: the prompt carries the user's name and email
+            clm_log.debug("Found system prompt", chars=len(system_prompt))
             break
-    print(f"[CLM] Query: {user_message[:80]}", file=sys.stderr)
 
-    # Run agent with system prompt for user context
-    response_text = await run_agent_for_clm(user_message, system_prompt)
-    print(f"[CLM] Response: {response_text[:80]}", file=sys.stderr)
+    # Conversation turns up to and including the user message (last non-system message)
+    turns = [(msg.role, msg.content) for msg in request.messages if msg.role != "system"]
+    while turns and turns[-1][0] != "user":
+        turns.pop()
+    user_message = turns[-1][1] if turns else ""
+    session = session_key(custom_session_id, system_prompt, turns)
+    clm_log.info("Query", session=session, query=user_message[:80])
+
+    turn = await prepare_clm_turn(user_message, system_prompt, session, turns)
+    start = partial(start_clm_run, user_message, turn, session, turns, stream=bool(request.stream))
+    if turn.cached is None:
+        digest = request_digest([(msg.role, msg.content) for msg in request.messages], request.stream)
+        flight = clm_flights.join((session, digest), start)
+        try:
+            await until_disconnected(http_request, flight.started())
+        except Overloaded as e:
+            return overloaded_response(e)
+        except ClientDisconnected:
+            flight.leave()
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        answer = flight.subscribe()
+    else:
+        answer = await start()
 
     if request.stream:
         msg_id = f"chatcmpl-{uuid.uuid4().hex[:8]}"
+        deltas = voice_chunks(answer) if output == "voice" else answer
         return StreamingResponse(
-            stream_sse_response(response_text, msg_id),
+            encode_sse_stream(deltas, msg_id),
             media_type="text/event-stream"
         )
     else:
+        try:
+            response_text = await until_disconnected(http_request, join_text(answer))
+        except ClientDisconnected:
+            return Response(status_code=CLIENT_CLOSED_REQUEST)
+        if output == "voice":
+            response_text = to_voice_text(response_text)
+        clm_log.info("Response", response=response_text[:80])
+
         return {
             "id": f"chatcmpl-{uuid.uuid4().hex[:8]}",
             "object": "chat.completion",
             "created": int(time.time()),
-            "model": "hitl-quest-agent",
+            "model": CLM_MODEL_NAME,
             "choices": [{
                 "index": 0,
                 "message": {"role": "assistant", "content": response_text},
@@ -0,0 +1,228 @@
+"""
+Circuit breaker for model requests
+Opens on a high share of failed or slow Gemini calls, so callers get a degraded answer at once instead of waiting out the failure
+"""
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator
+import asyncio
+import os
+import time
+
+from pydantic_ai.models import Model
+from pydantic_ai.models.wrapper import WrapperModel
+
+from .log import get_logger
+from .metrics import model_breaker_calls
+
+BREAKER_ENABLED = os.getenv("BREAKER_ENABLED", "true").lower() != "false"
+# Sliding window the failure rate is computed over, and how many calls it needs before the rate counts
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "30"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+# Opens on this many failures in a row too, however many successes the window still holds from before
+BREAKER_CONSECUTIVE_FAILURES = int(os.getenv("BREAKER_CONSECUTIVE_FAILURES", "5"))
+# A call slower than this to its first chunk counts as failed; one past the timeout is abandoned
+BREAKER_SLOW_MS = float(os.getenv("BREAKER_SLOW_MS", "8000"))
+BREAKER_TIMEOUT_MS = float(os.getenv("BREAKER_TIMEOUT_MS", "20000"))
+# How long the circuit stays open before letting probe calls through (half-open)
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "15"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+log = get_logger("Breaker")
+
+
+class CircuitOpen(Exception):
+    """The circuit is open (or its half-open probes are taken): the call was not made."""
+
+
+@dataclass
+class BreakerStats:
+    calls: int = 0
+    failures: int = 0
+    slow: int = 0
+    timeouts: int = 0
+    # Calls refused while open
+    rejected: int = 0
+    opened: int = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "slow": self.slow,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
+
+
+class CircuitBreaker:
+    """
+    Closed -> open -> half-open -> closed, over a sliding time window.
+
+    Closed: calls go through; each is recorded as failed (error, timeout or
+    slower than BREAKER_SLOW_MS) or not. Once the window holds at least
+    BREAKER_MIN_CALLS and the failed share reaches BREAKER_FAILURE_RATE the
+    circuit opens, as it does after BREAKER_CONSECUTIVE_FAILURES failures in a
+    row (a sudden outage right after a healthy spell). Open: calls are refused for BREAKER_OPEN_SECONDS. Half-open:
+    up to BREAKER_HALF_OPEN_PROBES calls go through; a success closes the
+    circuit, a failure opens it again.
+
+    Event-loop only, like the admission controller: no locks.
+    """
+
+    def __init__(self, name: str, enabled: bool = BREAKER_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self._state = CLOSED
+        self.opened_at = 0.0
+        self.probes = 0
+        self.consecutive = 0
+        # (monotonic time, failed) per finished call
+        self.window: deque[tuple[float, bool]] = deque()
+        self.stats = BreakerStats()
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+            self._state = HALF_OPEN
+            self.probes = 0
+            log.info("Half-open, probing", breaker=self.name)
+        return self._state
+
+    @property
+    def rejecting(self) -> bool:
+        """Whether a call now would certainly be refused (open, or half-open with every probe out)."""
+        state = self.state
+        return self.enabled and (state == OPEN or (state == HALF_OPEN and self.probes >= BREAKER_HALF_OPEN_PROBES))
+
+    def _trim(self, now: float) -> None:
+        while self.window and now - self.window[0][0] > BREAKER_WINDOW_SECONDS:
+            self.window.popleft()
+
+    def failure_rate(self) -> float:
+        self._trim(time.monotonic())
+        return sum(failed for _, failed in self.window) / len(self.window) if self.window else 0.0
+
+    def acquire(self) -> bool:
+        """Permission for one call, or CircuitOpen; returns whether the call is a half-open probe."""
+        if not self.enabled:
+            return False
+        state = self.state
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and self.probes < BREAKER_HALF_OPEN_PROBES:
+            self.probes += 1
+            return True
+        self.stats.rejected += 1
+        model_breaker_calls.inc("rejected")
+        raise CircuitOpen(f"{self.name} circuit is {state}")
+
+    def release(self, probe: bool) -> None:
+        """A call ended without an outcome (e.g. cancelled because its client left)."""
+        if probe:
+            self.probes -= 1
+
+    def record(self, probe: bool, failed: bool) -> None:
+        self.stats.calls += 1
+        self.stats.failures += failed
+        if not self.enabled:
+            return
+        if probe:
+            self.probes -= 1
+            if failed:
+                self._open("probe failed")
+            elif self._state == HALF_OPEN:
+                self._state = CLOSED
+                self.window.clear()
+                self.consecutive = 0
+                log.info("Closed, upstream recovered", breaker=self.name)
+            return
+
+        now = time.monotonic()
+        self.window.append((now, failed))
+        self._trim(now)
+        self.consecutive = self.consecutive + 1 if failed else 0
+        if not failed or self._state != CLOSED:
+            return
+        if self.consecutive >= BREAKER_CONSECUTIVE_FAILURES:
+            self._open(f"{self.consecutive} failures in a row")
+        elif len(self.window) >= BREAKER_MIN_CALLS:
+            rate = sum(failed for _, failed in self.window) / len(self.window)
+            if rate >= BREAKER_FAILURE_RATE:
+                self._open(f"failure rate {rate:.0%}")
+
+    def _open(self, reason: str) -> None:
+        self._state = OPEN
+        self.opened_at = time.monotonic()
+        self.stats.opened += 1
+        log.warning("Opened", breaker=self.name, reason=reason, open_seconds=BREAKER_OPEN_SECONDS)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats.snapshot(),
+            "state": self.state,
+            "is_open": self.state != CLOSED,
+            "enabled": self.enabled,
+            "window_calls": len(self.window),
+            "failure_rate": round(self.failure_rate(), 4),
+        }
+
+
+class BreakerModel(WrapperModel):
+    """
+    Guards the wrapped model with a circuit breaker.
+
+    A call is bounded by BREAKER_TIMEOUT_MS to its response (for a stream,
+    to its first chunk), and its outcome is recorded: failed if it raised,
+    timed out or took longer than BREAKER_SLOW_MS. While the circuit is open
+    calls raise CircuitOpen without reaching the model.
+    """
+
+    def __init__(self, wrapped: Model, breaker: CircuitBreaker):
+        super().__init__(wrapped)
+        self.breaker = breaker
+
+    def _outcome(self, probe: bool, started: float, error: Exception = None) -> None:
+        if isinstance(error, TimeoutError):
+            self.breaker.stats.timeouts += 1
+        slow = error is None and time.monotonic() - started > BREAKER_SLOW_MS / 1000
+        self.breaker.stats.slow += slow
+        model_breaker_calls.inc("failed" if error is not None else "slow" if slow else "ok")
+        self.breaker.record(probe, failed=error is not None or slow)
+
+    async def request(self, *args: Any, **kwargs: Any):
+        probe = self.breaker.acquire()
+        started = time.monotonic()
+        try:
+            async with asyncio.timeout(BREAKER_TIMEOUT_MS / 1000):
+                response = await self.wrapped.request(*args, **kwargs)
+        except Exception as e:
+            self._outcome(probe, started, e)
+            raise
+        except BaseException:
+            self.breaker.release(probe)
+            raise
+        self._outcome(probe, started)
+        return response
+
+    @asynccontextmanager
+    async def request_stream(self, *args: Any, **kwargs: Any) -> AsyncIterator:
+        probe = self.breaker.acquire()
+        started = time.monotonic()
+        async with AsyncExitStack() as stack:
+            try:
+                async with asyncio.timeout(BREAKER_TIMEOUT_MS / 1000):
+                    response = await stack.enter_async_context(self.wrapped.request_stream(*args, **kwargs))
+            except Exception as e:
+                self._outcome(probe, started, e)
+                raise
+            except BaseException:
+                self.breaker.release(probe)
+                raise
+            self._outcome(probe, started)
+            yield response
@@ -0,0 +1,187 @@
+"""
+Cancellation of abandoned agent runs
+Runs stop when their client disconnects or their deadline passes, and take their pending tool calls with them
+"""
+from contextlib import suppress
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Optional, TypeVar
+import asyncio
+import os
+
+import anyio
+from pydantic_ai import AgentRunResultEvent
+from pydantic_ai.agent import WrapperAgent
+from starlette.requests import Request
+
+from .log import get_logger
+from .metrics import agent_runs
+
+# Seconds a request may take when the caller does not say; callers can ask for less or (up to the max) more
+REQUEST_TIMEOUT = float(os.getenv("REQUEST_TIMEOUT", "120"))
+REQUEST_TIMEOUT_MAX = float(os.getenv("REQUEST_TIMEOUT_MAX", "300"))
+# Header (both endpoints) and query parameter (for Hume's CLM URL, where headers cannot be set)
+TIMEOUT_HEADER = "x-request-timeout"
+TIMEOUT_PARAM = "timeout"
+
+# Status for a request whose client went away before the response (nginx's "client closed request")
+CLIENT_CLOSED_REQUEST = 499
+
+log = get_logger("Cancel")
+
+T = TypeVar("T")
+
+# Event-loop time by which the current request must be done
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+# Identifies the agent run a task belongs to; tool tasks inherit it from the run
+_run_scope: ContextVar[Optional[object]] = ContextVar("agent_run_scope", default=None)
+
+
+class ClientDisconnected(Exception):
+    """The client closed the connection while its request was waiting or running."""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The request's deadline passed before its agent run finished."""
+
+
+# =====
+# Deadlines
+# =====
+def request_timeout(request: Request) -> float:
+    """The caller's timeout in seconds (header or query parameter), clamped; REQUEST_TIMEOUT otherwise."""
+    value = request.headers.get(TIMEOUT_HEADER) or request.query_params.get(TIMEOUT_PARAM)
+    try:
+        timeout = float(value) if value else REQUEST_TIMEOUT
+    except ValueError:
+        timeout = REQUEST_TIMEOUT
+    return min(max(timeout, 0.0), REQUEST_TIMEOUT_MAX)
+
+
+def set_deadline(request: Request) -> float:
+    """Start the request's clock; runs, admission waits and tasks started from here inherit the deadline."""
+    deadline = asyncio.get_running_loop().time() + request_timeout(request)
+    _deadline.set(deadline)
+    return deadline
+
+
+def time_remaining() -> Optional[float]:
+    """Seconds until the current request's deadline, or None outside a request."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - asyncio.get_running_loop().time()
+
+
+# =====
+# Disconnects
+# =====
+async def _disconnected(request: Request) -> None:
+    # Only called once the body has been read, so the next message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def until_disconnected(request: Request, awaitable: Awaitable[T]) -> T:
+    """
+    Await `awaitable`, cancelling it and raising ClientDisconnected if the
+    client goes away first. For work done before a response exists (queueing,
+    non-streamed runs); streamed responses are cancelled by Starlette.
+    """
+    work = asyncio.ensure_future(awaitable)
+    watcher = asyncio.create_task(_disconnected(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if work.done():
+            return work.result()
+        work.cancel()
+        with suppress(asyncio.CancelledError):
+            await work
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        if not work.done():
+            work.cancel()
+
+
+# =====
+# Agent Runs
+# =====
+def _cancel_tools(scope: object) -> int:
+    """Cancel tasks the run started (pydantic-ai runs parallel tool calls as tasks it does not cancel)."""
+    current = asyncio.current_task()
+    tasks = [
+        task for task in asyncio.all_tasks()
+        if task is not current and not task.done() and task.get_context().get(_run_scope) is scope
+    ]
+    for task in tasks:
+        task.cancel()
+    return len(tasks)
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    if not task.cancelled():
+        task.exception()
+
+
+class CancellableAgent(WrapperAgent):
+    """
+    The agent, with runs that can be stopped part way.
+
+    `run()` is bounded by the request's deadline. `run_stream_events()` runs
+    the agent in a task like pydantic-ai's, but cancels it when the event
+    stream is closed, which is what Starlette does to a streamed response
+    whose client disconnected. Upstream, the run would carry on (tool calls
+    and model requests included) until its next event hit the closed stream.
+    Either way the run's outstanding tool tasks are cancelled with it, and
+    its outcome (completed, cancelled, deadline or error) is counted.
+    """
+
+    async def run(self, *args: Any, **kwargs: Any):
+        scope = object()
+        token = _run_scope.set(scope)
+        deadline = _deadline.get()
+        outcome = "error"
+        try:
+            async with asyncio.timeout_at(deadline) as timeout:
+                result = await super().run(*args, **kwargs)
+            outcome = "completed"
+            return result
+        except TimeoutError:
+            if not timeout.expired():
+                raise
+            outcome = "deadline"
+            raise DeadlineExceeded("request deadline passed during the agent run") from None
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            _run_scope.reset(token)
+            agent_runs.inc(outcome)
+            if outcome in ("cancelled", "deadline"):
+                tools = _cancel_tools(scope)
+                log.info("Agent run stopped", outcome=outcome, tool_tasks=tools)
+
+    def run_stream_events(self, *args: Any, **kwargs: Any) -> AsyncIterator:
+        return self._stream_events(*args, **kwargs)
+
+    async def _stream_events(self, *args: Any, **kwargs: Any) -> AsyncIterator:
+        send_stream, receive_stream = anyio.create_memory_object_stream()
+
+        async def event_stream_handler(_, events) -> None:
+            async for event in events:
+                await send_stream.send(event)
+
+        async def run_agent():
+            async with send_stream:
+                return await self.run(*args, **{**kwargs, "infer_name": False}, event_stream_handler=event_stream_handler)
+
+        task = asyncio.create_task(run_agent())
+        try:
+            async with receive_stream:
+                async for event in receive_stream:
+                    yield event
+            result = await task
+        finally:
+            if not task.done():
+                # Closed early: stop the run now rather than at its next event
+                task.cancel()
+                task.add_done_callback(_retrieve)
+        yield AgentRunResultEvent(result)
@@ -0,0 +1,219 @@
+"""
+HITL.quest catalog: services, tech stack and HITL concepts
+Loaded from catalog.json and precomputed into tool payloads once per version, with hot reload
+"""
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Callable, Mapping
+import hashlib
+import json
+import os
+import threading
+import time
+
+from .log import get_logger
+from .matcher import Match, SimilarityIndex
+
+CATALOG_PATH = os.getenv("CATALOG_PATH", str(Path(__file__).with_name("catalog.json")))
+# How often the file is checked for edits; 0 disables polling (reload() still works)
+CATALOG_RELOAD_SECONDS = float(os.getenv("CATALOG_RELOAD_SECONDS", "5"))
+
+log = get_logger("Catalog")
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """
+    One version of the catalog with every static tool payload built up front.
+
+    Payloads are shared between calls and runs, so they must be treated as
+    read-only; a reload builds a new snapshot instead of mutating this one.
+    """
+    version: str
+    data: Mapping
+    # Tool name -> payload for the tools that take no arguments
+    payloads: Mapping[str, dict]
+    # Service name / tech key -> details payload
+    service_details: Mapping[str, dict]
+    tech_details: Mapping[str, dict]
+    service_index: SimilarityIndex
+    tech_index: SimilarityIndex
+    # The catalog file as served by GET /catalog
+    body: bytes
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+    def match_services(self, query: str, limit: int = 3) -> list[Match]:
+        """Services ranked by similarity to the query (keyed by service name)."""
+        return self.service_index.search(query, limit)
+
+    def match_tech(self, query: str, limit: int = 3) -> list[Match]:
+        """Technologies ranked by similarity to the query (keyed by tech stack key)."""
+        return self.tech_index.search(query, limit)
+
+
+def build_snapshot(raw: bytes) -> CatalogSnapshot:
+    """Validate a catalog file and precompute every tool payload it backs."""
+    data = json.loads(raw)
+    services = data["services"]
+    tech_stack = data["tech_stack"]
+    concepts = data["concepts"]
+
+    hitl = concepts["what_is_hitl"]
+    escalation = concepts["escalation"]
+    payloads = {
+        "get_services": {
+            "title": data["services_title"],
+            "services": [
+                {"name": s["name"], "description": s["description"], "tech_stack": s["tech_stack"]}
+                for s in services
+            ],
+            "note": data["services_note"],
+        },
+        "get_tech_stack": {
+            "title": data["tech_stack_title"],
+            "technologies": [
+                {"name": t["name"], "category": t["category"], "why_we_use": t["why_we_use"]}
+                for t in tech_stack.values()
+            ],
+        },
+        "explain_hitl": {
+            "title": hitl["title"],
+            "explanation": hitl["explanation"],
+            "key_benefits": hitl["key_benefits"],
+            "comparison": hitl["comparison"],
+        },
+        "explain_escalation": {
+            "title": escalation["title"],
+            "explanation": escalation["explanation"],
+            "how_it_works": escalation["key_points"],
+            "triggers": escalation["triggers"],
+            "what_human_sees": escalation["what_human_sees"],
+        },
+        "get_next_steps": data["next_steps"],
+    }
+
+    service_details = {
+        s["name"]: {
+            "service": s["name"],
+            "description": s["description"],
+            "benefits": s["benefits"],
+            "tech_stack": s["tech_stack"],
+            "use_cases": s["use_cases"],
+        }
+        for s in services
+    }
+    tech_details = {
+        key: {
+            "technology": t["name"],
+            "category": t["category"],
+            "description": t["description"],
+            "why_we_use": t["why_we_use"],
+            "url": t["url"],
+        }
+        for key, t in tech_stack.items()
+    }
+
+    # Names and keywords outweigh descriptions, so "voice" finds Voice Call
+    # Systems before services that merely mention voice
+    service_index = SimilarityIndex([
+        (s["name"], [
+            (s["name"], 3.0),
+            (" ".join(s.get("keywords", [])), 3.0),
+            (s["description"], 1.0),
+            (" ".join(s["use_cases"]), 1.0),
+            (" ".join(s["tech_stack"]), 0.5),
+        ])
+        for s in services
+    ])
+    tech_index = SimilarityIndex([
+        (key, [
+            (key.replace("_", " "), 3.0),
+            (t["name"], 3.0),
+            (" ".join(t.get("keywords", [])), 3.0),
+            (t["category"], 1.0),
+            (t["description"], 1.0),
+        ])
+        for key, t in tech_stack.items()
+    ])
+
+    return CatalogSnapshot(
+        version=hashlib.sha256(raw).hexdigest()[:12],
+        data=MappingProxyType(data),
+        payloads=MappingProxyType(payloads),
+        service_details=MappingProxyType(service_details),
+        tech_details=MappingProxyType(tech_details),
+        service_index=service_index,
+        tech_index=tech_index,
+        body=raw,
+    )
+
+
+class CatalogStore:
+    """
+    The current catalog snapshot, reloaded when the file changes.
+
+    Reading `current` costs an attribute lookup plus, at most every
+    `reload_seconds`, one stat() of the file. A changed file is parsed into a
+    new snapshot and swapped in atomically; a file that fails to parse is
+    logged and the previous version keeps serving. Listeners registered with
+    `on_change` are called with each new snapshot.
+    """
+
+    def __init__(self, path: str = CATALOG_PATH, reload_seconds: float = CATALOG_RELOAD_SECONDS):
+        self.path = Path(path)
+        self.reload_seconds = reload_seconds
+        self._lock = threading.Lock()
+        self._listeners: list[Callable[[CatalogSnapshot], None]] = []
+        self._mtime = self.path.stat().st_mtime_ns
+        self._snapshot = build_snapshot(self.path.read_bytes())
+        self._next_check = time.monotonic() + reload_seconds
+        self.reloads = 0
+
+    @property
+    def current(self) -> CatalogSnapshot:
+        if self.reload_seconds > 0 and time.monotonic() >= self._next_check:
+            self._check_for_edits()
+        return self._snapshot
+
+    @property
+    def version(self) -> str:
+        return self.current.version
+
+    def on_change(self, listener: Callable[[CatalogSnapshot], None]) -> None:
+        self._listeners.append(listener)
+
+    def _check_for_edits(self) -> None:
+        self._next_check = time.monotonic() + self.reload_seconds
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except OSError as e:
+            log.warning("Cannot stat catalog", path=str(self.path), error=str(e))
+            return
+        if mtime != self._mtime:
+            self.reload()
+
+    def reload(self) -> bool:
+        """Re-read the catalog file; returns True if a new version was loaded."""
+        with self._lock:
+            try:
+                self._mtime = self.path.stat().st_mtime_ns
+                snapshot = build_snapshot(self.path.read_bytes())
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                log.error("Reload failed", keeping=self._snapshot.version, error=str(e))
+                return False
+            if snapshot.version == self._snapshot.version:
+                return False
+            previous, self._snapshot = self._snapshot.version, snapshot
+            self.reloads += 1
+
+        log.info("Loaded catalog", previous=previous, version=snapshot.version)
+        for listener in self._listeners:
+            listener(snapshot)
+        return True
+
+
+catalog = CatalogStore()
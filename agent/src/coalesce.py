@@ -0,0 +1,159 @@
+"""
+Single-flight coalescing of duplicate in-flight requests
+Identical requests arriving while the first is still running share its agent run and stream
+"""
+from contextlib import aclosing
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Generic, Hashable, Optional, Sequence, TypeVar
+import asyncio
+import hashlib
+import json
+import os
+
+from .log import get_logger
+
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() != "false"
+
+log = get_logger("Coalesce")
+
+T = TypeVar("T")
+
+
+def request_digest(messages: Sequence[tuple[str, str]], *extra: Hashable) -> str:
+    """Digest of a request's (role, content) messages and any other inputs that change the answer."""
+    payload = json.dumps([list(messages), [str(item) for item in extra]], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+@dataclass
+class CoalesceStats:
+    flights: int = 0
+    # Requests that attached to a run already in flight instead of starting their own
+    coalesced: int = 0
+    # Runs stopped because every client waiting on them went away
+    abandoned: int = 0
+
+    def snapshot(self) -> dict:
+        total = self.flights + self.coalesced
+        return {
+            "flights": self.flights,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "coalesce_rate": round(self.coalesced / total, 3) if total else 0.0,
+        }
+
+
+class Flight(Generic[T]):
+    """
+    One run's output, recorded as it is produced and replayed to each subscriber.
+
+    The run belongs to a task of its own rather than to the first client, so
+    that client going away does not cut the others off; it is cancelled once
+    no subscriber is left.
+    """
+
+    def __init__(self, group: "SingleFlight", key: Hashable, start: Callable[[], Awaitable[AsyncIterator[T]]]):
+        self.group = group
+        self.key = key
+        self.items: list[T] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._started: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._changed = asyncio.Event()
+        self.task = asyncio.create_task(self._run(start))
+
+    async def _run(self, start: Callable[[], Awaitable[AsyncIterator[T]]]) -> None:
+        try:
+            try:
+                source = await start()
+            except Exception as e:
+                self._started.set_exception(e)
+                return
+            self._started.set_result(None)
+            async with aclosing(source):
+                async for item in source:
+                    self.items.append(item)
+                    self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            if not self._started.done():
+                self._started.cancel()
+            self.done = True
+            self._notify()
+            self.group._finished(self)
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def started(self) -> None:
+        """Wait for the run to start; raises what starting it raised (e.g. admission control refusing it)."""
+        await asyncio.shield(self._started)
+
+    async def subscribe(self) -> AsyncIterator[T]:
+        """Everything the run has produced so far, then each new item until it ends; once per `join()`."""
+        index = 0
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.items):
+                    yield self.items[index]
+                    index += 1
+                if self.done:
+                    if self.error:
+                        raise self.error
+                    return
+                await changed.wait()
+        finally:
+            self.leave()
+
+    def leave(self) -> None:
+        """A joined client is gone (done streaming, or disconnected before it started); the last one out stops the run."""
+        self.subscribers -= 1
+        if not self.subscribers and not self.done:
+            self.group._abandon(self)
+
+
+class SingleFlight:
+    """
+    In-flight runs by key. `join()` attaches to the run for a key, or starts
+    one with `start()` (an awaitable returning the output stream) if there is
+    none. Only runs still in flight are shared: once a run ends its key is
+    free again, and repeats are left to the answer cache.
+    """
+
+    def __init__(self, name: str, enabled: bool = COALESCE_ENABLED):
+        self.name = name
+        self.enabled = enabled
+        self.flights: dict[Hashable, Flight] = {}
+        self.stats = CoalesceStats()
+
+    def join(self, key: Hashable, start: Callable[[], Awaitable[AsyncIterator[T]]]) -> Flight[T]:
+        flight = self.flights.get(key) if self.enabled else None
+        if flight is not None:
+            self.stats.coalesced += 1
+            log.info("Joined in-flight run", group=self.name, subscribers=flight.subscribers + 1)
+        else:
+            flight = Flight(self, key, start)
+            if self.enabled:
+                self.flights[key] = flight
+            self.stats.flights += 1
+        # Counted from here, so a client still waiting for the run to start keeps it alive
+        flight.subscribers += 1
+        return flight
+
+    def _finished(self, flight: Flight) -> None:
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def _abandon(self, flight: Flight) -> None:
+        # Unlisted at once, so a request arriving now starts afresh rather than joining a cancelled run
+        self._finished(flight)
+        flight.task.cancel()
+        self.stats.abandoned += 1
+        log.info("Abandoned run, no clients left", group=self.name)
+
+    def snapshot(self) -> dict:
+        return {**self.stats.snapshot(), "in_flight": len(self.flights), "enabled": self.enabled}
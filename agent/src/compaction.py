@@ -0,0 +1,179 @@
+"""
+Token-budgeted message history compaction
+Runs as a pydantic-ai history processor before every model request (CLM and AG-UI)
+"""
+from dataclasses import dataclass, replace
+import json
+import os
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from .log import get_logger
+
+# Estimated prompt tokens allowed for the history before it is compacted
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "6000"))
+# Most recent user turns (with their tool calls and answers) kept verbatim
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+
+# Rough chars-per-token ratio; Gemini's tokenizer is not available locally
+CHARS_PER_TOKEN = 4
+SUMMARY_SNIPPET_CHARS = 160
+# The summary is a user message answered by a fixed reply, not a system part: GoogleModel puts history
+# system parts before the agent's instructions, which would break their byte-identical prefix
+SUMMARY_HEADING = "## Earlier in this conversation"
+SUMMARY_REPLY = "Noted, I'll keep that in mind."
+
+log = get_logger("History")
+
+
+def _part_chars(part) -> int:
+    content = getattr(part, "content", None)
+    if isinstance(content, str):
+        return len(content)
+    if content is not None:
+        return len(json.dumps(content, default=str))
+    if isinstance(part, ToolCallPart):
+        return len(part.tool_name) + len(part.args_as_json_str())
+    return 0
+
+
+def estimate_tokens(messages: list[ModelMessage]) -> int:
+    """Estimate the prompt tokens a message list will cost."""
+    chars = sum(_part_chars(part) for message in messages for part in message.parts)
+    return chars // CHARS_PER_TOKEN
+
+
+def _turn_starts(messages: list[ModelMessage]) -> list[int]:
+    """Indexes of requests that open a user turn (tool-return requests belong to the turn before)."""
+    return [
+        i for i, message in enumerate(messages)
+        if isinstance(message, ModelRequest) and any(isinstance(p, UserPromptPart) for p in message.parts)
+    ]
+
+
+def _collapse_tool_returns(messages: list[ModelMessage]) -> list[ModelMessage]:
+    """Replace tool-return payloads with a short reference to the tool."""
+    collapsed = []
+    for message in messages:
+        if isinstance(message, ModelRequest) and any(isinstance(p, ToolReturnPart) for p in message.parts):
+            parts = [
+                replace(p, content=f"[{p.tool_name} result from an earlier turn omitted; call {p.tool_name} again if needed]")
+                if isinstance(p, ToolReturnPart) else p
+                for p in message.parts
+            ]
+            message = replace(message, parts=parts)
+        collapsed.append(message)
+    return collapsed
+
+
+def _snippet(text: str) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= SUMMARY_SNIPPET_CHARS else text[:SUMMARY_SNIPPET_CHARS].rsplit(" ", 1)[0] + "..."
+
+
+def summarize_turns(messages: list[ModelMessage]) -> str:
+    """Extractive summary of older turns: what was asked, which tools ran, and how we answered."""
+    lines = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, UserPromptPart) and isinstance(part.content, str):
+                if part.content.startswith(SUMMARY_HEADING):
+                    # An earlier compaction's summary: carry its lines over
+                    lines.extend(part.content.splitlines()[1:])
+                else:
+                    lines.append(f"- User asked: {_snippet(part.content)}")
+            elif isinstance(part, ToolCallPart):
+                lines.append(f"- Looked up: {part.tool_name}")
+            elif isinstance(part, TextPart) and isinstance(message, ModelResponse) and part.content.strip() not in ("", SUMMARY_REPLY):
+                lines.append(f"- You answered: {_snippet(part.content)}")
+    return f"{SUMMARY_HEADING}\n" + "\n".join(lines)
+
+
+@dataclass
+class CompactionStats:
+    requests: int = 0
+    compacted: int = 0
+    tokens_before: int = 0
+    tokens_after: int = 0
+    last_saved: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def record(self, before: int, after: int) -> None:
+        self.requests += 1
+        self.tokens_before += before
+        self.tokens_after += after
+        self.last_saved = before - after
+        if after < before:
+            self.compacted += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "compacted": self.compacted,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_saved,
+            "avg_tokens_saved_per_request": round(self.tokens_saved / self.requests, 1) if self.requests else 0.0,
+        }
+
+
+compaction_stats = CompactionStats()
+
+
+def compact_messages(
+    messages: list[ModelMessage],
+    budget: int = HISTORY_TOKEN_BUDGET,
+    keep_turns: int = HISTORY_KEEP_TURNS,
+) -> list[ModelMessage]:
+    """
+    Fit a message history into the token budget.
+
+    System prompt parts (if the history has any; the agent's instructions
+    are not part of it) and the last `keep_turns` user turns are never
+    touched. Over budget, older tool-return payloads are collapsed to short
+    references first; if that is still not enough, the older turns are
+    replaced by an opening request holding those parts and an extractive
+    summary as a user message, answered by a fixed reply.
+    """
+    if estimate_tokens(messages) <= budget:
+        return messages
+
+    starts = _turn_starts(messages)
+    if len(starts) <= keep_turns:
+        return messages
+    cut = starts[-keep_turns] if keep_turns > 0 else len(messages)
+    head, older, recent = messages[:starts[0]], messages[starts[0]:cut], messages[cut:]
+
+    # Stage 1: keep the older turns but drop their bulky tool payloads
+    older = _collapse_tool_returns(older)
+    compacted = head + older + recent
+    if estimate_tokens(compacted) <= budget:
+        return compacted
+
+    # Stage 2: summarize the older turns into an opening exchange
+    system_parts = [p for message in head + older[:1] for p in message.parts if isinstance(p, SystemPromptPart)]
+    opening = ModelRequest(parts=system_parts + [UserPromptPart(summarize_turns(older))])
+    return [opening, ModelResponse(parts=[TextPart(SUMMARY_REPLY)])] + recent
+
+
+async def compact_history(messages: list[ModelMessage]) -> list[ModelMessage]:
+    """History processor: compact the history before each model request and record the savings."""
+    before = estimate_tokens(messages)
+    compacted = compact_messages(messages)
+    after = before if compacted is messages else estimate_tokens(compacted)
+    compaction_stats.record(before, after)
+    if after < before:
+        log.info("Compacted prompt history", tokens_before=before, tokens_after=after, saved=before - after)
+    return compacted
@@ -0,0 +1,77 @@
+"""
+Degraded answers for when the model is unavailable
+Short plain-text answers built from the catalog's static tool payloads, chosen by the prefetch intent matcher
+"""
+from .catalog import CatalogSnapshot, catalog
+from .log import get_logger
+from .metrics import degraded_answers
+from .prefetch import plan_tool_calls
+
+DEGRADED_PREFIX = "I'm having trouble reaching my full assistant right now, so here's the short version."
+DEGRADED_SUFFIX = "Please try again in a minute for a fuller answer."
+
+log = get_logger("Degraded")
+
+
+def _sentence_list(items: list[str]) -> str:
+    return ", ".join(items[:-1]) + f" and {items[-1]}" if len(items) > 1 else "".join(items)
+
+
+def _services(snapshot: CatalogSnapshot, args: dict) -> str:
+    names = [service["name"] for service in snapshot.payloads["get_services"]["services"]]
+    return f"We build human-in-the-loop AI systems: {_sentence_list(names)}."
+
+
+def _service_details(snapshot: CatalogSnapshot, args: dict) -> str:
+    details = snapshot.service_details[args["service_name"]]
+    return f"{details['service']}: {details['description']}"
+
+
+def _tech_stack(snapshot: CatalogSnapshot, args: dict) -> str:
+    if args.get("technology") in snapshot.tech_details:
+        details = snapshot.tech_details[args["technology"]]
+        return f"{details['technology']} ({details['category']}): {details['why_we_use']}"
+    names = [tech["name"] for tech in snapshot.payloads["get_tech_stack"]["technologies"]]
+    return f"Our stack includes {_sentence_list(names)}."
+
+
+def _hitl(snapshot: CatalogSnapshot, args: dict) -> str:
+    return snapshot.payloads["explain_hitl"]["explanation"]
+
+
+def _escalation(snapshot: CatalogSnapshot, args: dict) -> str:
+    return snapshot.payloads["explain_escalation"]["explanation"]
+
+
+def _next_steps(snapshot: CatalogSnapshot, args: dict) -> str:
+    payload = snapshot.payloads["get_next_steps"]
+    steps = [step["title"].lower() for step in payload["steps"]]
+    return f"Working with us goes {_sentence_list(steps)}. {payload['cta']}"
+
+
+# Tool the question is routed to -> its answer; the profile needs the user's context, which is model-side
+_ANSWERS = {
+    "get_services": _services,
+    "get_service_details": _service_details,
+    "get_tech_stack": _tech_stack,
+    "explain_hitl": _hitl,
+    "explain_escalation": _escalation,
+    "get_next_steps": _next_steps,
+}
+
+
+def degraded_answer(question: str, endpoint: str) -> str:
+    """
+    The best static answer to a question: the catalog entry the question is
+    about if the intent matcher finds one, else what HITL.quest does and how
+    to get started. Sub-millisecond, with no model or network call.
+    """
+    snapshot = catalog.current
+    calls = [call for call in plan_tool_calls(question, max_tools=1) if call.tool_name in _ANSWERS] if question else []
+    if calls:
+        body = _ANSWERS[calls[0].tool_name](snapshot, calls[0].args)
+    else:
+        body = f"{_hitl(snapshot, {})} {_services(snapshot, {})} {_next_steps(snapshot, {})}"
+    degraded_answers.inc(endpoint)
+    log.info("Serving degraded answer", endpoint=endpoint, topic=calls[0].tool_name if calls else "overview")
+    return f"{DEGRADED_PREFIX} {body} {DEGRADED_SUFFIX}"
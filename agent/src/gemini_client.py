@@ -0,0 +1,255 @@
+"""
+Shared HTTP connection pool for the Gemini API
+One tuned httpx client per worker, warmed up at startup and closed at shutdown by the app lifespan
+"""
+from typing import TYPE_CHECKING, AsyncIterator, Optional
+import asyncio
+import importlib.util
+import os
+import threading
+import time
+
+import httpx
+from pydantic_ai.models import Model, get_user_agent
+from pydantic_ai.models.wrapper import WrapperModel
+
+from .log import get_logger
+
+if TYPE_CHECKING:
+    # google-genai takes about a second to import, so it is only loaded when the model is built
+    from pydantic_ai.models.google import GoogleModel
+    from pydantic_ai.providers.google import GoogleProvider
+
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com/")
+GEMINI_MAX_CONNECTIONS = int(os.getenv("GEMINI_MAX_CONNECTIONS", "20"))
+GEMINI_MAX_KEEPALIVE = int(os.getenv("GEMINI_MAX_KEEPALIVE", "10"))
+GEMINI_KEEPALIVE_EXPIRY = float(os.getenv("GEMINI_KEEPALIVE_EXPIRY", "120"))
+# h2 comes with the httpx[http2] dependency; without it (e.g. a trimmed install) the pool falls back to HTTP/1.1
+GEMINI_HTTP2 = os.getenv("GEMINI_HTTP2", "true").lower() != "false"
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5"))
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", "600"))
+# Connections opened at startup (one is enough over HTTP/2, which multiplexes)
+GEMINI_WARMUP_CONNECTIONS = int(os.getenv("GEMINI_WARMUP_CONNECTIONS", "2"))
+GEMINI_WARMUP_TIMEOUT = float(os.getenv("GEMINI_WARMUP_TIMEOUT", "5"))
+
+log = get_logger("Gemini")
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Response body that reports back to the pool when it is closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class PooledTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport that counts requests in flight on the wrapped pool.
+
+    A request holds a connection from when it is sent until its response
+    body is closed (for Gemini's streamed responses, the end of the stream),
+    so the in-flight count and its peak are what `max_connections` has to
+    cover.
+    """
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport, max_connections: int):
+        self._transport = transport
+        self.max_connections = max_connections
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            response = await self._transport.handle_async_request(request)
+        except BaseException:
+            self.errors += 1
+            self._release()
+            raise
+
+        released = False
+
+        def release_once() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._release()
+
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, release_once),
+            extensions=response.extensions,
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+    def connections(self) -> Optional[tuple[int, int]]:
+        """(open, idle) connections in the underlying httpcore pool, if it exposes them."""
+        pool = getattr(self._transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        return len(connections), sum(1 for c in connections if c.is_idle())
+
+
+class GeminiHTTPPool:
+    """
+    The worker's single HTTP client for Gemini, with explicit pool limits.
+
+    `provider()` hands the client to pydantic-ai's GoogleProvider so every
+    model request reuses it. The app lifespan calls `warm_up()` before the
+    worker starts serving, which pays DNS/TLS setup for the first
+    connections, and `close()` on shutdown.
+    """
+
+    def __init__(
+        self,
+        base_url: str = GEMINI_BASE_URL,
+        max_connections: int = GEMINI_MAX_CONNECTIONS,
+        max_keepalive: int = GEMINI_MAX_KEEPALIVE,
+        keepalive_expiry: float = GEMINI_KEEPALIVE_EXPIRY,
+        http2: bool = GEMINI_HTTP2,
+    ):
+        self.base_url = base_url
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        if http2 and not self.http2:
+            log.warning("h2 is not installed, using HTTP/1.1 (pip install httpx[http2])")
+
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.transport = PooledTransport(httpx.AsyncHTTPTransport(limits=limits, http2=self.http2), max_connections)
+        self.client = httpx.AsyncClient(
+            transport=self.transport,
+            timeout=httpx.Timeout(GEMINI_READ_TIMEOUT, connect=GEMINI_CONNECT_TIMEOUT),
+            headers={"User-Agent": get_user_agent()},
+        )
+        self.warmed_up = False
+        self.warmup_ms: Optional[float] = None
+
+    def provider(self) -> "GoogleProvider":
+        """A Google provider (API key from GOOGLE_API_KEY) that sends its requests through this pool."""
+        from pydantic_ai.providers.google import GoogleProvider
+
+        return GoogleProvider(http_client=self.client)
+
+    def model(self, model_name: str) -> "DeferredGeminiModel":
+        """A Gemini model on this pool, built (and google-genai imported) on first use."""
+        return DeferredGeminiModel(model_name, self)
+
+    async def warm_up(self, connections: int = GEMINI_WARMUP_CONNECTIONS, timeout: float = GEMINI_WARMUP_TIMEOUT) -> None:
+        """
+        Open connections to the API concurrently, within `timeout` overall;
+        failures (and running out of time) are logged, never fatal.
+        """
+        if connections <= 0:
+            self.warmed_up = True
+            return
+        started = time.perf_counter()
+        attempts = 1 if self.http2 else connections
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(
+                    *(self.client.head(self.base_url, timeout=timeout) for _ in range(attempts)),
+                    return_exceptions=True,
+                ),
+                timeout,
+            )
+        except TimeoutError as e:
+            results = [e] * attempts
+        self.warmup_ms = round((time.perf_counter() - started) * 1000, 1)
+        failures = [r for r in results if isinstance(r, BaseException)]
+        for failure in failures[:1]:
+            log.warning("Warm-up request failed", error=repr(failure))
+        self.warmed_up = len(failures) < len(results)
+        log.info(
+            "Warmed up connections",
+            opened=len(results) - len(failures),
+            attempted=len(results),
+            ms=self.warmup_ms,
+            http2=self.http2,
+        )
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def stats(self) -> dict:
+        transport = self.transport
+        stats = {
+            "http2": self.http2,
+            "max_connections": transport.max_connections,
+            "requests": transport.requests,
+            "errors": transport.errors,
+            "in_flight": transport.in_flight,
+            "peak_in_flight": transport.peak_in_flight,
+            "utilization": round(transport.in_flight / transport.max_connections, 4),
+            "peak_utilization": round(transport.peak_in_flight / transport.max_connections, 4),
+            "warmed_up": self.warmed_up,
+            "warmup_ms": self.warmup_ms,
+        }
+        if (connections := transport.connections()) is not None:
+            stats["open_connections"], stats["idle_connections"] = connections
+        return stats
+
+
+class DeferredGeminiModel(WrapperModel):
+    """
+    A GoogleModel on the shared pool that is only built when first needed.
+
+    Lets the agent be constructed at import without loading google-genai;
+    startup warm-up calls `load()` in a thread so the first request never
+    pays for it.
+    """
+
+    def __init__(self, model_name: str, pool: GeminiHTTPPool):
+        Model.__init__(self)
+        self._model_name = model_name
+        self._pool = pool
+        self._model: Optional["GoogleModel"] = None
+        self._lock = threading.Lock()
+
+    @property
+    def wrapped(self) -> "GoogleModel":
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from pydantic_ai.models.google import GoogleModel
+
+                    self._model = GoogleModel(self._model_name, provider=self._pool.provider())
+        return self._model
+
+    @property
+    def model_name(self) -> str:
+        return self._model_name
+
+    @property
+    def loaded(self) -> bool:
+        return self._model is not None
+
+    def load(self) -> None:
+        self.wrapped
+
+
+gemini_pool = GeminiHTTPPool()
@@ -0,0 +1,229 @@
+"""
+Hedged model requests
+A request that outlasts the recent p95 gets a backup (same or fallback model); whichever answers first is used
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+import asyncio
+import math
+import os
+import time
+
+from pydantic_ai.models import Model
+from pydantic_ai.models.wrapper import WrapperModel
+
+from .log import get_logger
+from .metrics import model_hedges
+
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() != "false"
+# Backup model, e.g. "gemini-2.0-flash-lite"; empty hedges to the primary model itself
+HEDGE_MODEL = os.getenv("HEDGE_MODEL", "")
+# Hedge once an attempt has waited longer than this quantile of recent attempts' time to first chunk
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+HEDGE_WINDOW = int(os.getenv("HEDGE_WINDOW", "200"))
+# Until this many latencies have been seen, hedge after HEDGE_INITIAL_DELAY_MS
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_INITIAL_DELAY_MS = float(os.getenv("HEDGE_INITIAL_DELAY_MS", "3000"))
+HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", "250"))
+# At most this share of the last HEDGE_WINDOW requests may be hedged (bounds the extra load on a slow upstream)
+HEDGE_MAX_RATE = float(os.getenv("HEDGE_MAX_RATE", "0.1"))
+
+log = get_logger("Hedge")
+
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    # The backup answered first
+    won: int = 0
+    # Over the threshold, but the hedge budget was spent
+    skipped: int = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "won": self.won,
+            "skipped": self.skipped,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "win_rate": round(self.won / self.hedged, 4) if self.hedged else 0.0,
+        }
+
+
+class _Attempt:
+    """
+    One try at a request, in its own task.
+
+    For streams the task enters the model's `request_stream()` context,
+    publishes the response once its first chunk is in, and holds the context
+    open until released, so the context is exited by the task that entered it.
+    """
+
+    def __init__(self, model: Model, open: Callable[[], Awaitable[Any]], streamed: bool, backup: bool):
+        self.model = model
+        self.backup = backup
+        self.started = time.monotonic()
+        self.latency: Optional[float] = None
+        self.ready: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._release = asyncio.Event()
+        self.task = asyncio.create_task(self._hold(open) if streamed else self._call(open))
+
+    def _publish(self, result: Any) -> None:
+        self.latency = time.monotonic() - self.started
+        if not self.ready.done():
+            self.ready.set_result(result)
+
+    def _fail(self, error: BaseException) -> None:
+        if not self.ready.done():
+            self.ready.set_exception(error)
+
+    async def _call(self, open: Callable[[], Awaitable[Any]]) -> None:
+        try:
+            self._publish(await open())
+        except Exception as e:
+            self._fail(e)
+
+    async def _hold(self, open: Callable[[], Any]) -> None:
+        try:
+            async with open() as response:
+                self._publish(response)
+                await self._release.wait()
+        except Exception as e:
+            self._fail(e)
+
+    async def close(self, winner: bool) -> None:
+        """Release the winner's stream context; cancel a loser outright."""
+        if winner:
+            self._release.set()
+        else:
+            self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        if self.ready.done() and not self.ready.cancelled():
+            # Retrieved, so a loser's failure is not reported as never retrieved
+            self.ready.exception()
+
+
+class HedgedModel(WrapperModel):
+    """
+    Issues a backup request when the first one is slow, and uses whichever answers first.
+
+    The delay is adaptive: the HEDGE_QUANTILE of recent attempts' time to the
+    first chunk (a streamed response counts as answered when its first chunk
+    arrives), so only the slow tail is hedged. The losing attempt is cancelled.
+    Hedges are capped at HEDGE_MAX_RATE of recent requests, so a degraded
+    upstream is not sent twice the traffic.
+    """
+
+    def __init__(
+        self,
+        wrapped: Model,
+        backup: Optional[Model] = None,
+        enabled: bool = HEDGE_ENABLED,
+        quantile: float = HEDGE_QUANTILE,
+        window: int = HEDGE_WINDOW,
+        max_rate: float = HEDGE_MAX_RATE,
+    ):
+        super().__init__(wrapped)
+        self.backup = backup or wrapped
+        self.enabled = enabled
+        self.quantile = quantile
+        self.max_rate = max_rate
+        self.latencies: deque[float] = deque(maxlen=window)
+        # Whether each recent request was hedged, for the rate cap
+        self.recent: deque[bool] = deque(maxlen=window)
+        # Seconds an attempt may take before it is hedged
+        self.threshold = HEDGE_INITIAL_DELAY_MS / 1000
+        self.stats = HedgeStats()
+
+    # =====
+    # Threshold and Budget
+    # =====
+    def _record_latency(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        if len(self.latencies) >= HEDGE_MIN_SAMPLES:
+            ordered = sorted(self.latencies)
+            quantile = ordered[min(len(ordered) - 1, int(self.quantile * len(ordered)))]
+            self.threshold = max(quantile, HEDGE_MIN_DELAY_MS / 1000)
+
+    def _may_hedge(self) -> bool:
+        if self.max_rate <= 0:
+            return False
+        # Over at least 1/max_rate requests, so the first slow requests cannot all be hedged
+        window = max(len(self.recent), math.ceil(1 / self.max_rate))
+        return sum(self.recent) < self.max_rate * window
+
+    # =====
+    # Requests
+    # =====
+    async def _race(self, open: Callable[[Model], Any], streamed: bool) -> tuple[Any, list[_Attempt], _Attempt]:
+        attempts = [_Attempt(self.wrapped, lambda: open(self.wrapped), streamed, backup=False)]
+        self.stats.requests += 1
+        hedged = False
+        try:
+            done, _ = await asyncio.wait([attempts[0].ready], timeout=self.threshold)
+            if not done:
+                if self._may_hedge():
+                    # Counted now rather than when the request ends, so concurrent slow requests see it
+                    hedged = True
+                    self.recent.append(True)
+                    self.stats.hedged += 1
+                    model_hedges.inc("issued")
+                    log.debug("Hedging", after_ms=round(self.threshold * 1000), backup=self.backup.model_name)
+                    attempts.append(_Attempt(self.backup, lambda: open(self.backup), streamed, backup=True))
+                else:
+                    self.stats.skipped += 1
+                    model_hedges.inc("skipped")
+
+            # First attempt to succeed wins; fail only when all have failed
+            pending = {attempt.ready: attempt for attempt in attempts}
+            error: Optional[BaseException] = None
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    attempt = pending.pop(future)
+                    if future.exception() is None:
+                        self._record_latency(attempt.latency)
+                        if attempt.backup:
+                            self.stats.won += 1
+                            model_hedges.inc("won")
+                        return future.result(), attempts, attempt
+                    error = error or future.exception()
+            raise error
+        except BaseException:
+            await asyncio.gather(*(attempt.close(winner=False) for attempt in attempts))
+            raise
+        finally:
+            if not hedged:
+                self.recent.append(False)
+
+    async def request(self, *args: Any, **kwargs: Any):
+        if not self.enabled:
+            return await self.wrapped.request(*args, **kwargs)
+        response, attempts, winner = await self._race(lambda model: model.request(*args, **kwargs), streamed=False)
+        await asyncio.gather(*(attempt.close(attempt is winner) for attempt in attempts))
+        return response
+
+    @asynccontextmanager
+    async def request_stream(self, *args: Any, **kwargs: Any) -> AsyncIterator:
+        if not self.enabled:
+            async with self.wrapped.request_stream(*args, **kwargs) as response:
+                yield response
+            return
+        response, attempts, winner = await self._race(lambda model: model.request_stream(*args, **kwargs), streamed=True)
+        # The loser is cancelled now; the winner's stream stays open until the caller is done with it
+        await asyncio.gather(*(attempt.close(False) for attempt in attempts if attempt is not winner))
+        try:
+            yield response
+        finally:
+            await winner.close(winner=True)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats.snapshot(),
+            "enabled": self.enabled,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "backup_model": self.backup.model_name,
+        }
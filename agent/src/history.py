@@ -0,0 +1,142 @@
+"""
+Per-session message history for the CLM endpoint
+Keeps pydantic-ai ModelMessage lists between Hume voice turns, on whichever worker takes the next one
+"""
+from dataclasses import dataclass
+from typing import Optional, Sequence
+import hashlib
+import json
+import os
+import re
+
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    TextPart,
+    UserPromptPart,
+)
+
+from .session_store import SessionStore
+from .streaming import to_voice_text
+
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "1000"))
+HISTORY_TTL_SECONDS = float(os.getenv("HISTORY_TTL_SECONDS", "3600"))
+
+# (role, content) pairs as sent by the client, system messages excluded
+Turn = tuple[str, str]
+
+_NON_ALNUM = re.compile(r'[\W_]+')
+
+
+def fingerprint(role: str, content: str) -> str:
+    """
+    Digest of a turn that survives the client reformatting it.
+
+    Assistant replies are hashed as they would be spoken (see
+    streaming.to_voice_text), so the markdown the agent produced and the
+    voice text Hume echoes back, without list markers or link URLs, give
+    the same digest. Only lowercase alphanumerics are hashed, so punctuation
+    and spacing added for voice do not matter either.
+    """
+    if role == "assistant":
+        content = to_voice_text(content)
+    normalized = _NON_ALNUM.sub('', content.lower())
+    return hashlib.sha1(f"{role}:{normalized}".encode()).hexdigest()[:16]
+
+
+def session_key(session_id: Optional[str], system_prompt: Optional[str], turns: Sequence[Turn]) -> str:
+    """Key a session by the client's session id, or by a hash of the conversation prefix."""
+    if session_id:
+        return f"sid:{session_id}"
+    first = turns[0][1] if turns else ""
+    digest = hashlib.sha256(f"{system_prompt or ''}\x00{first}".encode()).hexdigest()[:24]
+    return f"prefix:{digest}"
+
+
+def transcript_to_messages(turns: Sequence[Turn]) -> list[ModelMessage]:
+    """
+    Convert client transcript turns into pydantic-ai messages, merging
+    consecutive same-role turns. No system prompt is added: the agent's
+    instructions are sent with every model request instead.
+    """
+    messages: list[ModelMessage] = []
+    for role, content in turns:
+        if role == "assistant":
+            if messages and isinstance(messages[-1], ModelResponse):
+                messages[-1].parts.append(TextPart(content))
+            else:
+                messages.append(ModelResponse(parts=[TextPart(content)]))
+        else:
+            if messages and isinstance(messages[-1], ModelRequest):
+                messages[-1].parts.append(UserPromptPart(content))
+            else:
+                messages.append(ModelRequest(parts=[UserPromptPart(content)]))
+    return messages
+
+
+@dataclass
+class SessionHistory:
+    messages: list[ModelMessage]
+    # Fingerprints of the client turns (plus our last reply) the messages cover
+    fingerprints: list[str]
+
+
+def encode_history(history: SessionHistory) -> bytes:
+    fingerprints = json.dumps(history.fingerprints).encode()
+    return b'{"fingerprints":' + fingerprints + b',"messages":' + ModelMessagesTypeAdapter.dump_json(history.messages) + b'}'
+
+
+def decode_history(payload: bytes) -> SessionHistory:
+    data = json.loads(payload)
+    return SessionHistory(ModelMessagesTypeAdapter.validate_python(data["messages"]), data["fingerprints"])
+
+
+class HistoryStore:
+    """
+    Bounded, expiring store of agent message history per session.
+
+    On each turn the client transcript is compared with the fingerprints of
+    what is already stored. When the stored turns are a prefix of the
+    transcript, only the new turns are converted and appended; otherwise the
+    history is rebuilt from the transcript, so a stale or colliding session
+    never leaks into another conversation. The same check makes a shared
+    store safe to read a moment behind: a history a turn short is still a
+    prefix, and the missing turn is taken from the transcript.
+    """
+
+    def __init__(self, max_sessions: int = HISTORY_MAX_SESSIONS, ttl_seconds: float = HISTORY_TTL_SECONDS):
+        self._sessions: SessionStore[SessionHistory] = SessionStore(
+            "history", max_sessions, ttl_seconds, encode=encode_history, decode=decode_history
+        )
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def get(self, key: str) -> Optional[SessionHistory]:
+        return await self._sessions.load(key)
+
+    def stats(self) -> dict:
+        return self._sessions.stats()
+
+    async def resolve(self, key: str, turns: Sequence[Turn]) -> list[ModelMessage]:
+        """
+        Build the message_history for a turn.
+
+        `turns` is the full transcript including the current user message,
+        which is not part of the returned history (it is the run's prompt).
+        """
+        prior = turns[:-1]
+        session = await self.get(key)
+        if session and len(session.fingerprints) <= len(prior) and all(
+            fingerprint(*turn) == fp for turn, fp in zip(prior, session.fingerprints)
+        ):
+            return list(session.messages) + transcript_to_messages(prior[len(session.fingerprints):])
+        return transcript_to_messages(prior)
+
+    async def save(self, key: str, turns: Sequence[Turn], messages: list[ModelMessage], reply: str) -> None:
+        """Store the run's messages, covering the transcript plus the reply we just sent."""
+        fingerprints = [fingerprint(*turn) for turn in turns]
+        fingerprints.append(fingerprint("assistant", reply))
+        await self._sessions.save(key, SessionHistory(messages=messages, fingerprints=fingerprints))
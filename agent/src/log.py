@@ -0,0 +1,205 @@
+"""
+Structured, non-blocking logging
+Records go through a bounded queue to a writer thread, which formats them and redacts email and name fields
+"""
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Any
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-category levels, e.g. "clm=DEBUG,prefetch=WARNING"
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+# Share of DEBUG/INFO records kept per category, e.g. "clm=0.1"; warnings and errors are always kept
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # "text" or "json"
+# Records beyond this many waiting for the writer are dropped rather than blocking the caller
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_REDACT = os.getenv("LOG_REDACT", "true").lower() != "false"
+
+# Field names whose values never reach the log (nested dict keys included)
+REDACTED_FIELDS = frozenset({"email", "name", "first_name", "firstName"})
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+
+
+def _per_category(spec: str) -> dict[str, str]:
+    pairs = (item.split("=", 1) for item in spec.split(",") if "=" in item)
+    return {key.strip().lower(): value.strip() for key, value in pairs}
+
+
+_LEVELS = _per_category(LOG_LEVELS)
+_SAMPLE_RATES = {category: float(rate) for category, rate in _per_category(LOG_SAMPLE).items()}
+
+
+# =====
+# Redaction (runs on the writer thread)
+# =====
+def _digest(value: str) -> str:
+    # Same value, same digest: lines about one user can still be correlated
+    return hashlib.sha256(value.encode()).hexdigest()[:8]
+
+
+def redact(value: Any, field: str = "") -> Any:
+    """Replace email/name fields with a short digest and mask email addresses inside text."""
+    if not LOG_REDACT:
+        return value
+    if field in REDACTED_FIELDS and value:
+        return f"<{field}:{_digest(str(value))}>"
+    if isinstance(value, str):
+        return _EMAIL.sub(lambda m: f"<email:{_digest(m.group())}>", value)
+    if isinstance(value, dict):
+        return {key: redact(item, key) for key, item in value.items()}
+    return value
+
+
+def _text_value(value: Any) -> str:
+    if isinstance(value, str) and value and not any(c.isspace() or c in "\"'=" for c in value):
+        return value
+    return json.dumps(value, default=str, ensure_ascii=False)
+
+
+class StructuredFormatter(logging.Formatter):
+    """`[Tag] message key=value ...` lines, or one JSON object per line."""
+
+    def __init__(self, json_lines: bool = False):
+        super().__init__()
+        self.json_lines = json_lines
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = redact(record.getMessage())
+        fields = {key: redact(value, key) for key, value in getattr(record, "fields", {}).items()}
+        error = self.formatException(record.exc_info) if record.exc_info else None
+
+        if self.json_lines:
+            payload = {
+                "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+                "level": record.levelname,
+                "category": getattr(record, "category", record.name),
+                "msg": message,
+                **fields,
+            }
+            if error:
+                payload["exc"] = error
+            return json.dumps(payload, default=str, ensure_ascii=False)
+
+        line = f"[{getattr(record, 'tag', record.name)}] {message}"
+        if fields:
+            line += " " + " ".join(f"{key}={_text_value(value)}" for key, value in fields.items())
+        if record.levelno >= logging.WARNING:
+            line = f"{record.levelname} {line}"
+        return f"{line}\n{error}" if error else line
+
+
+# =====
+# Queue and Writer
+# =====
+@dataclass
+class LogStats:
+    enqueued: int = 0
+    # Queue full: the writer fell behind and the record was discarded
+    dropped: int = 0
+    sampled_out: int = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "queue_depth": _queue.qsize(),
+            "queue_size": LOG_QUEUE_SIZE,
+        }
+
+
+log_stats = LogStats()
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting and redaction happen on the writer thread, not the caller's
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+            log_stats.enqueued += 1
+        except queue.Full:
+            log_stats.dropped += 1
+
+
+_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+_handler = _NonBlockingQueueHandler(_queue)
+_writer = logging.StreamHandler(sys.stderr)
+_writer.setFormatter(StructuredFormatter(json_lines=LOG_FORMAT == "json"))
+_listener = logging.handlers.QueueListener(_queue, _writer)
+_listener.start()
+# Flush what is queued on interpreter exit
+atexit.register(_listener.stop)
+
+
+class Logger:
+    """
+    A log category (`[CLM]`, `[Cache]`, ...) with keyword fields.
+
+    A record below the category's level costs one cached level check; a
+    kept record costs a LogRecord (without the caller lookup) and a queue
+    put. Formatting, redaction and the write to stderr all happen on the
+    writer thread, so a slow log pipe never blocks a coroutine.
+    """
+
+    __slots__ = ("tag", "category", "sample_rate", "_logger")
+
+    def __init__(self, tag: str):
+        self.tag = tag
+        self.category = tag.lower()
+        self.sample_rate = _SAMPLE_RATES.get(self.category, 1.0)
+        self._logger = logging.getLogger(f"hitl.{self.category}")
+        self._logger.setLevel(_LEVELS.get(self.category, LOG_LEVEL).upper())
+        self._logger.propagate = False
+        if _handler not in self._logger.handlers:
+            self._logger.addHandler(_handler)
+
+    def enabled(self, level: int) -> bool:
+        """For guarding fields that are expensive to compute."""
+        return self._logger.isEnabledFor(level)
+
+    def _log(self, level: int, msg: str, fields: dict, exc_info: bool = False) -> None:
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            log_stats.sampled_out += 1
+            return
+        # makeRecord + handle rather than log(): skips the caller lookup (a stack walk) per record
+        record = self._logger.makeRecord(
+            self._logger.name, level, "", 0, msg, (), sys.exc_info() if exc_info else None,
+            extra={"fields": fields, "tag": self.tag, "category": self.category},
+        )
+        self._logger.handle(record)
+
+    def debug(self, msg: str, **fields: Any) -> None:
+        self._log(logging.DEBUG, msg, fields)
+
+    def info(self, msg: str, **fields: Any) -> None:
+        self._log(logging.INFO, msg, fields)
+
+    def warning(self, msg: str, **fields: Any) -> None:
+        self._log(logging.WARNING, msg, fields)
+
+    def error(self, msg: str, **fields: Any) -> None:
+        self._log(logging.ERROR, msg, fields)
+
+    def exception(self, msg: str, **fields: Any) -> None:
+        """Error with the current exception's traceback (formatted on the writer thread)."""
+        self._log(logging.ERROR, msg, fields, exc_info=True)
+
+
+def get_logger(tag: str) -> Logger:
+    return Logger(tag)
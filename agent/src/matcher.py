@@ -0,0 +1,96 @@
+"""
+Similarity search over catalog entries
+TF-IDF weighted word and character n-gram vectors with cosine scoring through an inverted index
+"""
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Iterable, Sequence
+import math
+import re
+
+NGRAM_SIZE = 3
+# Below this cosine score a query is treated as not matching anything
+MIN_MATCH_SCORE = 0.12
+
+_NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def features(text: str) -> Counter:
+    """
+    Words plus character trigrams of each space-padded word.
+
+    The trigrams make spelling variants meet ("AG-UI"/"agui",
+    "next.js"/"nextjs", "moderate"/"moderation"), while whole-word features
+    keep exact terms ranked above partial overlaps.
+    """
+    counts: Counter = Counter()
+    for word in _NON_ALNUM.sub(" ", text.lower()).split():
+        counts["w:" + word] += 1
+        padded = f" {word} "
+        for i in range(len(padded) - NGRAM_SIZE + 1):
+            counts[padded[i:i + NGRAM_SIZE]] += 1
+    return counts
+
+
+@dataclass(frozen=True)
+class Match:
+    key: str
+    score: float
+
+
+class SimilarityIndex:
+    """
+    Cosine similarity between a query and a fixed set of documents.
+
+    Each document is given as weighted text fields (a name usually counts
+    more than its description). Document vectors are TF-IDF weighted and
+    L2-normalized once when the index is built; a lookup vectorizes the
+    query and accumulates every document's dot product in one pass over
+    the inverted index, so only features shared with the query are touched.
+    """
+
+    def __init__(self, documents: Sequence[tuple[str, Iterable[tuple[str, float]]]]):
+        self.keys = tuple(key for key, _ in documents)
+        term_weights = []
+        for _, fields in documents:
+            weights: Counter = Counter()
+            for text, field_weight in fields:
+                for feature, count in features(text).items():
+                    weights[feature] += count * field_weight
+            term_weights.append(weights)
+
+        n_docs = len(term_weights)
+        doc_freq = Counter(feature for weights in term_weights for feature in weights)
+        self._idf = {feature: math.log((1 + n_docs) / (1 + df)) + 1 for feature, df in doc_freq.items()}
+        # Weight for query features no document has: as rare as a term can be
+        self._unseen_idf = math.log(1 + n_docs) + 1
+
+        postings: dict[str, list[tuple[int, float]]] = defaultdict(list)
+        for doc, weights in enumerate(term_weights):
+            vector = {feature: (1 + math.log(w)) * self._idf[feature] for feature, w in weights.items() if w > 0}
+            norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+            for feature, value in vector.items():
+                postings[feature].append((doc, value / norm))
+        self._postings = dict(postings)
+
+    def search(self, query: str, limit: int = 3, min_score: float = MIN_MATCH_SCORE) -> list[Match]:
+        """Documents scoring at least `min_score`, best first."""
+        counts = features(query)
+        if not counts:
+            return []
+        vector = {
+            feature: (1 + math.log(count)) * self._idf.get(feature, self._unseen_idf)
+            for feature, count in counts.items()
+        }
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+
+        scores = [0.0] * len(self.keys)
+        for feature, value in vector.items():
+            for doc, weight in self._postings.get(feature, ()):
+                scores[doc] += value * weight
+
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        return [
+            Match(self.keys[doc], round(scores[doc] / norm, 3))
+            for doc in ranked[:limit] if scores[doc] / norm >= min_score
+        ]
@@ -0,0 +1,310 @@
+"""
+Latency histograms and counters, exposed as Prometheus text on GET /metrics
+Recording costs a lock and a few increments; existing stats snapshots are only read when /metrics is scraped
+"""
+from bisect import bisect_left
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Callable, Iterable, Iterator, NamedTuple, Sequence
+import functools
+import inspect
+import threading
+import time
+
+from pydantic_ai.messages import ModelMessage, ModelResponse
+from pydantic_ai.models import Model
+from pydantic_ai.models.wrapper import WrapperModel
+
+# Seconds; from cached answers (ms) to long multi-tool runs
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 6, 8)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Family(NamedTuple):
+    """One metric family as rendered: name, type, help text and (labels, value) samples."""
+    name: str
+    kind: str
+    help: str
+    samples: Sequence[tuple[dict, float]]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set (Prometheus semantics)."""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        for values, counts, total, count in series:
+            labels = dict(zip(self.label_names, values))
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels({**labels, 'le': bound})} {cumulative}"
+            yield f"{self.name}_sum{_labels(labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(labels)} {count}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_labels(dict(zip(self.label_names, labels)))} {_number(value)}"
+
+
+class Registry:
+    """Metrics recorded as they happen, plus collectors read only at scrape time."""
+
+    def __init__(self):
+        self.metrics: list = []
+        self.collectors: list[Callable[[], Iterable[Family]]] = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        self.metrics.append(metric := Histogram(*args, **kwargs))
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        self.metrics.append(metric := Counter(*args, **kwargs))
+        return metric
+
+    def collect(self, collector: Callable[[], Iterable[Family]]) -> None:
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = [line for metric in self.metrics for line in metric.render()]
+        for collector in self.collectors:
+            for family in collector():
+                lines.append(f"# HELP {family.name} {family.help}")
+                lines.append(f"# TYPE {family.name} {family.kind}")
+                lines.extend(f"{family.name}{_labels(labels)} {_number(value)}" for labels, value in family.samples)
+        return "\n".join(lines) + "\n"
+
+
+def stats_families(prefix: str, snapshot: dict, help: str) -> list[Family]:
+    """Numeric leaves of a /stats snapshot as gauges (`prefix_key`, nested keys joined by `_`)."""
+    families = []
+    for key, value in snapshot.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            families += stats_families(name, value, help)
+        elif isinstance(value, (bool, int, float)):
+            families.append(Family(name, "gauge", help, [({}, float(value))]))
+    return families
+
+
+def cache_families(caches: dict[str, dict]) -> list[Family]:
+    """TTLCache.stats() per cache as labelled gauges."""
+    return [
+        Family(f"hitl_cache_{field}", "gauge", f"Cache {field.replace('_', ' ')}",
+               [({"cache": name}, float(stats[field])) for name, stats in caches.items()])
+        for field in ("hits", "misses", "hit_ratio", "size", "evictions", "expirations")
+    ]
+
+
+registry = Registry()
+
+# =====
+# Metrics
+# =====
+request_duration = registry.histogram(
+    "hitl_http_request_duration_seconds", "Request latency, until the last byte of the response", ("endpoint",)
+)
+time_to_first_chunk = registry.histogram(
+    "hitl_http_time_to_first_chunk_seconds", "Latency until the first non-empty response body chunk", ("endpoint",)
+)
+stream_duration = registry.histogram(
+    "hitl_http_stream_duration_seconds", "First to last body chunk (SSE emission for streamed responses)", ("endpoint",)
+)
+requests_total = registry.counter("hitl_http_requests_total", "Requests by endpoint and status", ("endpoint", "status"))
+
+stage_duration = registry.histogram(
+    "hitl_stage_duration_seconds", "Time per request stage (prompt parsing, history, agent run)", ("stage",)
+)
+model_request_duration = registry.histogram(
+    "hitl_model_request_duration_seconds", "One model request, streamed responses until fully read", ("model",)
+)
+model_requests_per_run = registry.histogram(
+    "hitl_model_requests_per_run", "Model requests made by one agent run", ("endpoint",), buckets=COUNT_BUCKETS
+)
+model_hedges = registry.counter(
+    "hitl_model_hedges_total", "Backup model requests: issued, won (answered first) and skipped (rate cap)", ("event",)
+)
+model_breaker_calls = registry.counter(
+    "hitl_model_breaker_calls_total", "Model calls through the circuit breaker: ok, failed, slow or rejected (open)",
+    ("outcome",),
+)
+degraded_answers = registry.counter(
+    "hitl_degraded_answers_total", "Static answers served while the model circuit was open", ("endpoint",)
+)
+tool_duration = registry.histogram(
+    "hitl_tool_call_duration_seconds", "Agent tool calls (model-initiated and prefetched)", ("tool",)
+)
+tool_errors = registry.counter("hitl_tool_errors_total", "Agent tool calls that raised", ("tool",))
+agent_runs = registry.counter(
+    "hitl_agent_runs_total", "Agent runs by outcome: completed, cancelled (client gone), deadline or error", ("outcome",)
+)
+admission_wait = registry.histogram(
+    "hitl_admission_wait_seconds", "Time queued agent runs waited for a slot", ("priority",)
+)
+admission_shed = registry.counter(
+    "hitl_admission_shed_total", "Agent runs refused with 429/503 by admission control", ("priority", "reason")
+)
+
+
+# =====
+# Instrumentation
+# =====
+def model_requests(messages: Sequence[ModelMessage]) -> int:
+    """Responses that came from the model (prefetched tool calls carry no model name)."""
+    return sum(1 for message in messages if isinstance(message, ModelResponse) and message.model_name)
+
+
+def timed_tool(func: Callable) -> Callable:
+    """Record a tool's call count and duration; keeps the signature and docstring pydantic-ai reads."""
+    name = func.__name__
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                tool_errors.inc(name)
+                raise
+            finally:
+                tool_duration.observe(time.perf_counter() - started, name)
+    else:
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                tool_errors.inc(name)
+                raise
+            finally:
+                tool_duration.observe(time.perf_counter() - started, name)
+
+    return timed
+
+
+class TimedModel(WrapperModel):
+    """Records the duration of every request made through the wrapped model."""
+
+    def __init__(self, wrapped: Model):
+        super().__init__(wrapped)
+
+    async def request(self, *args: Any, **kwargs: Any):
+        with model_request_duration.time(self.model_name):
+            return await self.wrapped.request(*args, **kwargs)
+
+    @asynccontextmanager
+    async def request_stream(self, *args: Any, **kwargs: Any) -> AsyncIterator:
+        with model_request_duration.time(self.model_name):
+            async with self.wrapped.request_stream(*args, **kwargs) as response_stream:
+                yield response_stream
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request, including streamed bodies.
+
+    `endpoint` labels are the app's known paths (mounts collapse to their
+    prefix) so unmatched URLs cannot grow the series count.
+    """
+
+    def __init__(self, app, endpoints: Sequence[str] = ()):
+        self.app = app
+        self.endpoints = tuple(endpoints)
+
+    def endpoint(self, path: str) -> str:
+        for endpoint in self.endpoints:
+            if path == endpoint or (endpoint != "/" and path.startswith(endpoint + "/")):
+                return endpoint
+        return "other"
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self.endpoint(scope["path"])
+        started = time.perf_counter()
+        first_chunk = None
+        status = "500"
+
+        async def timed_send(message) -> None:
+            nonlocal first_chunk, status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+            elif message["type"] == "http.response.body" and first_chunk is None and message.get("body"):
+                first_chunk = time.perf_counter()
+                time_to_first_chunk.observe(first_chunk - started, endpoint)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            finished = time.perf_counter()
+            request_duration.observe(finished - started, endpoint)
+            if first_chunk is not None:
+                stream_duration.observe(finished - first_chunk, endpoint)
+            requests_total.inc(endpoint, status)
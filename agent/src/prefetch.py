@@ -0,0 +1,224 @@
+"""
+Speculative tool prefetch
+Routes the user's message to the likely tools and runs them before the first model request of a run
+"""
+from dataclasses import dataclass, replace
+from typing import Callable, Collection, Optional
+import asyncio
+import inspect
+import os
+import uuid
+
+from pydantic_ai import RunContext
+from pydantic_ai.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+from .cache import TTLCache
+from .catalog import catalog
+from .log import get_logger
+from .matcher import SimilarityIndex
+
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "true").lower() != "false"
+# Minimum similarity for an intent (tool) and for a specific service/technology
+PREFETCH_INTENT_SCORE = float(os.getenv("PREFETCH_INTENT_SCORE", "0.3"))
+PREFETCH_ENTRY_SCORE = float(os.getenv("PREFETCH_ENTRY_SCORE", "0.25"))
+PREFETCH_MAX_TOOLS = int(os.getenv("PREFETCH_MAX_TOOLS", "2"))
+
+log = get_logger("Prefetch")
+
+# Tool call ids of prefetched calls: a guess from the router, not a call the model made
+PREFETCH_CALL_ID_PREFIX = "prefetch-"
+
+# The system prompt's "User asks about... -> Use this tool" table, as example phrasings
+PREFETCH_INTENTS = {
+    "get_services": [
+        "what services do you offer", "what do you do", "what can you build for us",
+        "your offerings and solutions", "services overview",
+    ],
+    "get_tech_stack": [
+        "what is your tech stack", "what technology and tools do you use", "which frameworks do you build with",
+    ],
+    "explain_hitl": [
+        "what is human in the loop", "what does hitl mean", "explain hitl ai", "why not full automation",
+    ],
+    "explain_escalation": [
+        "how does escalation work", "handoff to a human", "when does the ai transfer to a human agent", "escalate",
+    ],
+    "get_my_profile": [
+        "show my profile", "my account details", "who am i", "what do you know about me",
+    ],
+    "get_next_steps": [
+        "how do i get started", "what are the next steps", "how do we work with you",
+        "hire you to start a project", "what is your process",
+    ],
+}
+
+_intent_index = SimilarityIndex([(tool, [(" ".join(phrases), 1.0)]) for tool, phrases in PREFETCH_INTENTS.items()])
+
+
+@dataclass(frozen=True)
+class PlannedCall:
+    tool_name: str
+    args: dict
+    score: float
+
+
+def plan_tool_calls(message: str, max_tools: int = PREFETCH_MAX_TOOLS) -> list[PlannedCall]:
+    """
+    Guess which tools the model will call for a message.
+
+    A named service or technology ("tell me about voice", "do you use
+    CopilotKit?") becomes a detail lookup with that entry as its argument;
+    otherwise the message is scored against the intent phrasings. At most
+    one call per tool, best first.
+    """
+    snapshot = catalog.current
+    planned: dict[str, PlannedCall] = {}
+
+    services = snapshot.match_services(message, limit=1)
+    if services and services[0].score >= PREFETCH_ENTRY_SCORE:
+        planned["get_service_details"] = PlannedCall("get_service_details", {"service_name": services[0].key}, services[0].score)
+    tech = snapshot.match_tech(message, limit=1)
+    if tech and tech[0].score >= PREFETCH_ENTRY_SCORE:
+        planned["get_tech_stack"] = PlannedCall("get_tech_stack", {"technology": tech[0].key}, tech[0].score)
+
+    for match in _intent_index.search(message, limit=max_tools, min_score=PREFETCH_INTENT_SCORE):
+        planned.setdefault(match.key, PlannedCall(match.key, {}, match.score))
+
+    return sorted(planned.values(), key=lambda call: call.score, reverse=True)[:max_tools]
+
+
+@dataclass
+class PrefetchStats:
+    requests: int = 0
+    prefetched: int = 0
+    tools_run: int = 0
+    # Prefetched runs whose model still asked for tools before answering
+    misses: int = 0
+
+    @property
+    def hits(self) -> int:
+        # Includes runs still in flight; they become misses if the model calls a tool
+        return self.prefetched - self.misses
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "prefetched": self.prefetched,
+            "tools_run": self.tools_run,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / self.prefetched, 4) if self.prefetched else 0.0,
+            # A hit answers in one model call instead of two
+            "round_trips_saved": self.hits,
+            "round_trips_saved_per_request": round(self.hits / self.requests, 4) if self.requests else 0.0,
+        }
+
+
+def is_prefetched(tool_call_id: Optional[str]) -> bool:
+    """True for a tool call the prefetcher made rather than the model."""
+    return bool(tool_call_id) and tool_call_id.startswith(PREFETCH_CALL_ID_PREFIX)
+
+
+class ToolPrefetcher:
+    """
+    History processor that answers the model's likely first tool calls up front.
+
+    On the first model request of a run, the user's message is routed with
+    `plan_tool_calls`, the chosen tools run concurrently, and the calls and
+    their results are appended to the history as if the model had made
+    them. The model can then answer in its first response. If it asks for
+    more tools anyway, the run carries on as usual and the prefetch is
+    counted as a miss.
+
+    `available` narrows the registered tools per run (e.g. to the current
+    page's tool set), so no call is made to a tool the model cannot see.
+    """
+
+    def __init__(
+        self,
+        available: Optional[Callable[[RunContext], Collection[str]]] = None,
+        enabled: bool = PREFETCH_ENABLED,
+    ):
+        self.enabled = enabled
+        self.available = available
+        self.tools: dict[str, Callable] = {}
+        self.stats = PrefetchStats()
+        # Runs with a prefetch whose outcome is not known yet
+        self._pending: TTLCache[str, tuple[str, ...]] = TTLCache(4096, 600, name="prefetch_pending")
+
+    def register(self, *tools: Callable) -> None:
+        """Make tools available for prefetch; they are called exactly as the agent would call them."""
+        for tool in tools:
+            self.tools[tool.__name__] = tool
+
+    async def _run(self, ctx: RunContext, call: PlannedCall, tool_call_id: str):
+        tool = self.tools[call.tool_name]
+        tool_ctx = replace(ctx, tool_name=call.tool_name, tool_call_id=tool_call_id)
+        if inspect.iscoroutinefunction(tool):
+            return await tool(tool_ctx, **call.args)
+        return await asyncio.to_thread(tool, tool_ctx, **call.args)
+
+    async def __call__(self, ctx: RunContext, messages: list[ModelMessage]) -> list[ModelMessage]:
+        if not self.enabled:
+            return messages
+        if ctx.run_step > 1:
+            self._record_outcome(ctx, messages)
+            return messages
+
+        request = messages[-1]
+        prompt = next(
+            (p.content for p in reversed(request.parts) if isinstance(p, UserPromptPart) and isinstance(p.content, str)),
+            None,
+        ) if isinstance(request, ModelRequest) else None
+        if not prompt:
+            return messages
+        self.stats.requests += 1
+
+        tools = self.tools.keys() & (self.available(ctx) if self.available else self.tools.keys())
+        calls = [call for call in plan_tool_calls(prompt) if call.tool_name in tools]
+        if not calls:
+            return messages
+
+        ids = [f"{PREFETCH_CALL_ID_PREFIX}{uuid.uuid4().hex[:12]}" for _ in calls]
+        results = await asyncio.gather(
+            *(self._run(ctx, call, tool_call_id) for call, tool_call_id in zip(calls, ids)),
+            return_exceptions=True,
+        )
+        calls_part, returns_part = [], []
+        for call, tool_call_id, result in zip(calls, ids, results):
+            if isinstance(result, BaseException):
+                log.warning("Tool failed", tool=call.tool_name, error=str(result))
+                continue
+            calls_part.append(ToolCallPart(call.tool_name, call.args, tool_call_id=tool_call_id))
+            returns_part.append(ToolReturnPart(call.tool_name, result, tool_call_id=tool_call_id))
+        if not calls_part:
+            return messages
+
+        self.stats.prefetched += 1
+        self.stats.tools_run += len(calls_part)
+        if ctx.run_id:
+            self._pending.set(ctx.run_id, tuple(p.tool_name for p in calls_part))
+        log.info("Prefetched", tools={c.tool_name: c.score for c in calls}, query=prompt[:50])
+        return messages + [
+            ModelResponse(parts=calls_part),
+            ModelRequest(parts=returns_part, instructions=request.instructions),
+        ]
+
+    def _record_outcome(self, ctx: RunContext, messages: list[ModelMessage]) -> None:
+        """A later model request in a prefetched run means the model wanted more tools."""
+        prefetched = self._pending.pop(ctx.run_id) if ctx.run_id else None
+        if prefetched is None:
+            return
+        self.stats.misses += 1
+        called = [
+            p.tool_name for message in messages[-2:] if isinstance(message, ModelResponse)
+            for p in message.parts if isinstance(p, ToolCallPart)
+        ]
+        log.info("Miss", prefetched=list(prefetched), called=called)
@@ -0,0 +1,215 @@
+"""
+System prompt and per-page prompt sections and tool sets
+Each page gets only the prompt sections and tools it needs, keyed off PAGE_CONTEXTS
+
+Prompt layout, most shared first so provider-side prefix caching can reuse it:
+    SYSTEM_PROMPT            identical for every request
+    page sections + context  identical for every user on a page
+    user context             per user, rendered once per distinct user state
+"""
+from dataclasses import dataclass
+from textwrap import dedent
+from typing import Optional, Sequence
+import os
+
+from .cache import TTLCache
+
+USER_PROMPT_CACHE_SIZE = int(os.getenv("USER_PROMPT_CACHE_SIZE", "4096"))
+USER_PROMPT_CACHE_TTL_SECONDS = float(os.getenv("USER_PROMPT_CACHE_TTL_SECONDS", "3600"))
+
+# Always sent: who the agent is and how it talks
+SYSTEM_PROMPT = dedent("""
+        You are the AI assistant for HITL.quest - a Human-in-the-Loop AI agency.
+        You help potential clients understand our services and the value of combining AI automation with human oversight.
+
+        ## Your Personality
+        - Professional but approachable
+        - Knowledgeable about AI and HITL design
+        - Enthusiastic about human-AI collaboration
+        - Clear and jargon-free explanations
+
+        ## Conversation Guidelines
+        - Address logged-in users by name
+        - Use bullet points for clarity
+        - Keep responses concise (this is also used for voice)
+        - Ask clarifying questions about their needs
+        - Encourage them to reach out via /contact
+
+        Remember: We build AI that knows when to ask for help. Be helpful and showcase our expertise!
+    """)
+
+# Page context descriptions
+PAGE_CONTEXTS = {
+    "customer-service": "User is exploring AI Customer Service solutions. Focus on chat/email automation, escalation, and 10x ticket handling.",
+    "voice": "User is exploring Voice Call Systems. Focus on Hume AI, emotional intelligence, and seamless call transfer.",
+    "document-processing": "User is exploring Document Processing. Focus on extraction, validation, human review for uncertain items.",
+    "content-moderation": "User is exploring Content Moderation. Focus on AI filtering, human judgment for edge cases, scaling.",
+    "contact": "User is on the Contact page. Help them articulate their needs and encourage form submission.",
+    "profile": "User is on their profile dashboard. Help them review their details and explore services that fit their interests.",
+    "homepage": "User is on the homepage. Give overview of HITL and help them explore services."
+}
+
+PROMPT_SECTIONS = {
+    "mission": dedent("""
+        ## Your Mission
+        Help visitors understand:
+        1. What Human-in-the-Loop means
+        2. Our services (customer service AI, voice, documents, moderation)
+        3. Our tech stack (CopilotKit, Hume, Pydantic AI, etc.)
+        4. Why HITL is better than full automation OR full manual
+    """),
+    "value_props": dedent("""
+        ## Key Value Propositions
+        - 95%+ customer satisfaction (vs 60-70% for full automation)
+        - 80% of volume handled by AI
+        - 10x faster than manual processing
+        - AI learns from human decisions
+        - Enterprise security and compliance
+    """),
+    "meta": dedent("""
+        ## Meta: You ARE a HITL Demo
+        Point out that this very conversation is an example of our work!
+        The CopilotKit chat and Hume voice integration on this site demonstrate our capabilities.
+    """),
+}
+
+# The "User asks about... -> Use this tool" table; rows are dropped for tools a page doesn't offer
+TOOL_TABLE = [
+    ("Our services", "get_services"),
+    ("A specific service", "get_service_details"),
+    ("Tech stack / tools", "get_tech_stack"),
+    ("What HITL means", "explain_hitl"),
+    ("How escalation works", "explain_escalation"),
+    ("Their profile", "get_my_profile"),
+    ("Getting started", "get_next_steps"),
+]
+AGENT_TOOLS = frozenset(tool for _, tool in TOOL_TABLE)
+
+_SERVICE_PAGE_TOOLS = AGENT_TOOLS - {"get_my_profile"}
+_SERVICE_PAGE_SECTIONS = ("value_props", "tools", "meta")
+
+# page -> (tools offered, prompt sections in order); logged-in users' details
+# are already in the user context instructions, so only the profile page
+# and homepage carry the profile tool
+PAGE_PROFILES: dict[str, tuple[frozenset[str], tuple[str, ...]]] = {
+    "homepage": (AGENT_TOOLS, ("mission", "value_props", "tools", "meta")),
+    "customer-service": (_SERVICE_PAGE_TOOLS, _SERVICE_PAGE_SECTIONS),
+    "voice": (_SERVICE_PAGE_TOOLS, _SERVICE_PAGE_SECTIONS),
+    "document-processing": (_SERVICE_PAGE_TOOLS, _SERVICE_PAGE_SECTIONS),
+    "content-moderation": (_SERVICE_PAGE_TOOLS, _SERVICE_PAGE_SECTIONS),
+    "contact": (
+        frozenset({"get_services", "get_service_details", "explain_hitl", "get_next_steps"}),
+        ("value_props", "tools"),
+    ),
+    "profile": (
+        frozenset({"get_my_profile", "get_services", "get_service_details", "get_next_steps"}),
+        ("tools",),
+    ),
+}
+
+
+def _tool_table(tools: frozenset[str]) -> str:
+    rows = "\n".join(f"| {topic} | {tool} |" for topic, tool in TOOL_TABLE if tool in tools)
+    return (
+        "## Available Tools - USE THEM\n"
+        "| User asks about... | Use this tool |\n"
+        "|-------------------|---------------|\n"
+        f"{rows}\n"
+    )
+
+
+def render_page_prompt(page: str) -> str:
+    """The static prefix for a page: the system prompt, the page's sections, then its context."""
+    tools, sections = PAGE_PROFILES[page]
+    rendered = [SYSTEM_PROMPT.lstrip("\n")]
+    rendered += [_tool_table(tools) if name == "tools" else PROMPT_SECTIONS[name].lstrip("\n") for name in sections]
+    rendered.append(f"## CURRENT PAGE CONTEXT\n{PAGE_CONTEXTS[page]}\n")
+    return "\n".join(rendered)
+
+
+# Rendered once per page; pages outside PAGE_PROFILES get the homepage prompt
+PAGE_PROMPTS = {page: render_page_prompt(page) for page in PAGE_PROFILES}
+
+
+def resolve_page(page: Optional[str]) -> str:
+    return page if page in PAGE_PROFILES else "homepage"
+
+
+def page_prompt(page: Optional[str]) -> str:
+    return PAGE_PROMPTS[resolve_page(page)]
+
+
+def page_tools(page: Optional[str]) -> frozenset[str]:
+    return PAGE_PROFILES[resolve_page(page)][0]
+
+
+# =====
+# User Context (the dynamic suffix)
+# =====
+GUEST_CONTEXT = dedent("""
+    ## GUEST USER
+    This user is not logged in. They can browse general information.
+    Encourage them to sign in for a personalized experience.
+""")
+
+# Rendered user context per distinct (user fields, interests) tuple
+user_prompt_cache: TTLCache[tuple, str] = TTLCache(
+    USER_PROMPT_CACHE_SIZE, USER_PROMPT_CACHE_TTL_SECONDS, name="user_prompt"
+)
+
+
+def user_context_prompt(
+    name: Optional[str],
+    first_name: Optional[str],
+    email: Optional[str],
+    interested_services: Sequence[str] = (),
+    company_type: Optional[str] = None,
+    use_case: Optional[str] = None,
+) -> str:
+    """The logged-in user's context section (memoized)."""
+    key = (name, first_name, email, tuple(interested_services), company_type, use_case)
+    rendered = user_prompt_cache.get(key)
+    if rendered is None:
+        rendered = dedent(f"""
+            ## CURRENT USER CONTEXT
+            You are speaking with a logged-in user:
+            - Name: {name or 'Unknown'}
+            - First Name: {first_name or 'Unknown'}
+            - Email: {email or 'Not provided'}
+            - Interested Services: {', '.join(interested_services) if interested_services else 'Not specified'}
+            - Company Type: {company_type or 'Not specified'}
+            - Use Case: {use_case or 'Not specified'}
+
+            IMPORTANT INSTRUCTIONS:
+            - ALWAYS address the user by their first name ({first_name}) in your responses
+            - When they ask about their profile, tell them: "{name}"
+            - Reference their interests when relevant
+        """)
+        user_prompt_cache.set(key, rendered)
+    return rendered
+
+
+@dataclass
+class PromptLayoutStats:
+    requests: int = 0
+    static_chars: int = 0
+    dynamic_chars: int = 0
+
+    def record(self, static: int, dynamic: int) -> None:
+        self.requests += 1
+        self.static_chars += static
+        self.dynamic_chars += dynamic
+
+    def snapshot(self) -> dict:
+        total = self.static_chars + self.dynamic_chars
+        return {
+            "requests": self.requests,
+            "avg_static_prefix_chars": round(self.static_chars / self.requests, 1) if self.requests else 0.0,
+            "avg_dynamic_suffix_chars": round(self.dynamic_chars / self.requests, 1) if self.requests else 0.0,
+            # Share of instruction text that is identical across users on a page
+            "static_share": round(self.static_chars / total, 4) if total else 0.0,
+            "user_prompt_cache": user_prompt_cache.stats(),
+        }
+
+
+prompt_layout_stats = PromptLayoutStats()
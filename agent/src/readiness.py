@@ -0,0 +1,65 @@
+"""
+Startup warm-up and readiness
+Tracks the steps an instance runs before it should take traffic; GET /ready reports them
+"""
+from typing import Any, Awaitable, Callable, Optional, Union
+import inspect
+import time
+
+from .log import get_logger
+
+log = get_logger("Startup")
+
+# Import of this module is close enough to process start for time-to-ready
+_STARTED = time.monotonic()
+
+
+class Readiness:
+    """
+    Warm-up steps and whether all of the required ones have finished.
+
+    `run()` times a step and records whether it succeeded. The instance is
+    ready once every step named at construction has succeeded. A step that
+    is best effort (e.g. opening connections to Gemini) handles its own
+    failures, so it holds readiness back only until it has been attempted,
+    and an instance without network access still comes up.
+    """
+
+    def __init__(self, *required: str):
+        self.required = required
+        self.steps: dict[str, dict] = {}
+        self.ready_after_ms: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return all(self.steps.get(name, {}).get("ok") for name in self.required)
+
+    @property
+    def pending(self) -> list[str]:
+        return [name for name in self.required if not self.steps.get(name, {}).get("ok")]
+
+    async def run(self, name: str, step: Callable[[], Union[Awaitable[Any], Any]]) -> bool:
+        """Run one warm-up step; failures are logged and leave the step not ok."""
+        started = time.perf_counter()
+        try:
+            result = step()
+            if inspect.isawaitable(result):
+                await result
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, repr(e)
+            log.error("Warm-up step failed", step=name, error=error)
+        self.steps[name] = {"ok": ok, "ms": round((time.perf_counter() - started) * 1000, 1), "error": error}
+
+        if ok and self.ready_after_ms is None and self.ready:
+            self.ready_after_ms = round((time.monotonic() - _STARTED) * 1000, 1)
+            log.info("Ready", after_ms=self.ready_after_ms)
+        return ok
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "pending": self.pending,
+            "ready_after_ms": self.ready_after_ms,
+            "steps": self.steps,
+        }
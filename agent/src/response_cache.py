@@ -0,0 +1,108 @@
+"""
+Answer cache for repeated questions
+Serves FAQ-style first turns without a model call, on both the CLM and AG-UI paths
+"""
+from typing import NamedTuple, Optional
+import hashlib
+import json
+import os
+import re
+
+from pydantic_ai.messages import ModelMessage, ModelResponse, ToolCallPart
+
+from .cache import TTLCache
+from .log import get_logger
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2048"))
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "21600"))
+
+# Tools whose output only depends on the catalog; answers built from anything
+# else (the user's profile, frontend actions) are never cached
+CACHEABLE_TOOLS = frozenset({
+    "get_services",
+    "get_service_details",
+    "get_tech_stack",
+    "explain_hitl",
+    "explain_escalation",
+    "get_next_steps",
+})
+
+_CONTRACTIONS = {"what's": "what is", "whats": "what is", "how's": "how is", "who's": "who is", "it's": "it is"}
+_CONTRACTION_RE = re.compile(r"\b(" + "|".join(re.escape(c) for c in _CONTRACTIONS) + r")\b")
+_NON_WORD = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+log = get_logger("Cache")
+
+
+def normalize_query(text: str) -> str:
+    """Normalize a question so trivial variations ("What's HITL?" / "what is hitl") share a key."""
+    text = text.lower().replace("’", "'")
+    text = _CONTRACTION_RE.sub(lambda m: _CONTRACTIONS[m.group(1)], text)
+    text = _NON_WORD.sub(" ", text)
+    return _SPACES.sub(" ", text).strip()
+
+
+def catalog_version(*payloads) -> str:
+    """Digest of the data behind the cached answers; a new version invalidates every entry."""
+    blob = json.dumps(payloads, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()[:12]
+
+
+class CachedAnswer(NamedTuple):
+    text: str
+    # Services the run looked up, recorded as the user's interests again when the answer is replayed
+    services: tuple[str, ...] = ()
+
+
+def used_only_cacheable_tools(messages: list[ModelMessage]) -> bool:
+    """True if every tool the run called only reads static catalog data."""
+    return all(
+        part.tool_name in CACHEABLE_TOOLS
+        for message in messages if isinstance(message, ModelResponse)
+        for part in message.parts if isinstance(part, ToolCallPart)
+    )
+
+
+class ResponseCache:
+    """
+    Bounded LRU/TTL cache of agent answers to first-turn questions.
+
+    Keys combine the catalog version, the normalized question, the current
+    page and the user (a user id/name for logged-in users, "guest" otherwise),
+    so personalized answers are never served to a different user. Answers are
+    only stored for context-free turns that used nothing but catalog tools.
+    """
+
+    def __init__(self, version: str, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL_SECONDS):
+        self.version = version
+        self._answers: TTLCache[tuple, CachedAnswer] = TTLCache(maxsize, ttl, name="response")
+        self.stored = 0
+        self.skipped = 0
+
+    def key(self, query: str, page: Optional[str], user_key: Optional[str]) -> tuple:
+        return (self.version, normalize_query(query), page or "homepage", user_key or "guest")
+
+    def get(self, key: tuple) -> Optional[CachedAnswer]:
+        if not key[1]:
+            return None
+        return self._answers.get(key)
+
+    def put(self, key: tuple, text: str, messages: list[ModelMessage], services: tuple[str, ...] = ()) -> bool:
+        """Store an answer if the run that produced it (`messages`) is safe to replay; returns whether it was stored."""
+        if not key[1] or not text or key[0] != self.version or not used_only_cacheable_tools(messages):
+            self.skipped += 1
+            return False
+        self._answers.set(key, CachedAnswer(text, services))
+        self.stored += 1
+        return True
+
+    def invalidate(self, version: Optional[str] = None) -> None:
+        """Drop every cached answer, optionally moving to a new catalog version."""
+        if version is not None:
+            self.version = version
+        self._answers.clear()
+        log.info("Response cache invalidated", catalog=self.version)
+
+    def stats(self) -> dict:
+        return {**self._answers.stats(), "version": self.version, "stored": self.stored, "skipped": self.skipped}
@@ -0,0 +1,405 @@
+"""
+Shared session state
+Per-session values (user context, AppState, message history) every worker can read, behind a local near-cache
+"""
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Generic, Hashable, Iterator, Optional, TypeVar
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from .cache import TTLCache
+from .log import get_logger
+
+# "memory" (this process only), "sqlite" (a file shared by the workers on one host) or "postgres" (DATABASE_URL)
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_STORE_PATH = os.getenv("SESSION_STORE_PATH", "sessions.db")
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Connections, and the threads backend calls run on (never on the event loop)
+SESSION_STORE_POOL_SIZE = int(os.getenv("SESSION_STORE_POOL_SIZE", "8"))
+# A backend call not done within this long is given up on (the near-cache answers); also SQLite's lock wait
+SESSION_STORE_TIMEOUT_MS = float(os.getenv("SESSION_STORE_TIMEOUT_MS", "1000"))
+SESSION_STORE_CONNECT_TIMEOUT_SECONDS = int(os.getenv("SESSION_STORE_CONNECT_TIMEOUT_SECONDS", "3"))
+# A near-cache entry confirmed current within this long is used without asking the shared store again
+SESSION_STORE_FRESH_MS = float(os.getenv("SESSION_STORE_FRESH_MS", "500"))
+# Expired rows are deleted by whichever worker writes first after this many seconds
+SESSION_STORE_PURGE_SECONDS = float(os.getenv("SESSION_STORE_PURGE_SECONDS", "300"))
+# After the shared store fails, a background task reopens it this often (the near-cache serves meanwhile)
+SESSION_STORE_RETRY_SECONDS = float(os.getenv("SESSION_STORE_RETRY_SECONDS", "30"))
+
+log = get_logger("Sessions")
+
+V = TypeVar("V")
+
+TABLE = "agent_sessions"
+
+
+# =====
+# Shared Backends
+# =====
+class SqlBackend:
+    """
+    Versioned rows of (namespace, key) -> value bytes, with an expiry time.
+
+    Every write stores a fresh random version, so a reader holding a value
+    can ask for it only if the row's version differs from the one it has:
+    one small query, and the value crosses the wire only when it changed.
+    Subclasses supply connections and the driver's placeholder.
+    """
+
+    name = "sql"
+    placeholder = "?"
+    ddl: tuple[str, ...] = ()
+
+    def __init__(self):
+        self.last_purge = 0.0
+        p = self.placeholder
+        self._fetch = (
+            f"SELECT version, CASE WHEN version = {p} THEN NULL ELSE value END FROM {TABLE} "
+            f"WHERE namespace = {p} AND key = {p} AND expires_at > {p}"
+        )
+        self._store = (
+            f"INSERT INTO {TABLE} (namespace, key, version, expires_at, value) VALUES ({p}, {p}, {p}, {p}, {p}) "
+            f"ON CONFLICT (namespace, key) DO UPDATE SET "
+            f"version = excluded.version, expires_at = excluded.expires_at, value = excluded.value"
+        )
+        self._delete = f"DELETE FROM {TABLE} WHERE namespace = {p} AND key = {p}"
+        self._purge = f"DELETE FROM {TABLE} WHERE expires_at <= {p}"
+
+    @contextmanager
+    def _cursor(self) -> Iterator[Any]:
+        raise NotImplementedError
+
+    def create(self) -> None:
+        with self._cursor() as cursor:
+            for statement in self.ddl:
+                cursor.execute(statement)
+
+    def ping(self) -> None:
+        with self._cursor() as cursor:
+            cursor.execute("SELECT 1")
+
+    def fetch(self, namespace: str, key: str, known_version: Optional[int]) -> tuple[Optional[int], Optional[bytes]]:
+        """(version, value) of a live row, value None if it is still `known_version`; (None, None) if there is none."""
+        with self._cursor() as cursor:
+            cursor.execute(self._fetch, (known_version or 0, namespace, key, time.time()))
+            row = cursor.fetchone()
+        if row is None:
+            return None, None
+        return row[0], None if row[1] is None else bytes(row[1])
+
+    def store(self, namespace: str, key: str, value: bytes, ttl: float) -> int:
+        version = random.getrandbits(62) + 1
+        with self._cursor() as cursor:
+            cursor.execute(self._store, (namespace, key, version, time.time() + ttl, value))
+            if time.monotonic() - self.last_purge > SESSION_STORE_PURGE_SECONDS:
+                self.last_purge = time.monotonic()
+                cursor.execute(self._purge, (time.time(),))
+        return version
+
+    def delete(self, namespace: str, key: str) -> None:
+        with self._cursor() as cursor:
+            cursor.execute(self._delete, (namespace, key))
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteBackend(SqlBackend):
+    """A SQLite file in WAL mode, for several workers on one host; one connection per thread."""
+
+    name = "sqlite"
+    ddl = (
+        f"CREATE TABLE IF NOT EXISTS {TABLE} (namespace TEXT NOT NULL, key TEXT NOT NULL, version INTEGER NOT NULL, "
+        f"expires_at REAL NOT NULL, value BLOB NOT NULL, PRIMARY KEY (namespace, key))",
+        f"CREATE INDEX IF NOT EXISTS {TABLE}_expires_at ON {TABLE} (expires_at)",
+    )
+
+    def __init__(self, path: str = SESSION_STORE_PATH):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit: every statement is its own short transaction
+            connection = sqlite3.connect(
+                self.path, timeout=SESSION_STORE_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _cursor(self) -> Iterator[sqlite3.Cursor]:
+        cursor = self._connection().cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+class PostgresBackend(SqlBackend):
+    """Postgres at DATABASE_URL (psycopg2), shared by every worker and node."""
+
+    name = "postgres"
+    placeholder = "%s"
+    ddl = (
+        f"CREATE TABLE IF NOT EXISTS {TABLE} (namespace TEXT NOT NULL, key TEXT NOT NULL, version BIGINT NOT NULL, "
+        f"expires_at DOUBLE PRECISION NOT NULL, value BYTEA NOT NULL, PRIMARY KEY (namespace, key))",
+        f"CREATE INDEX IF NOT EXISTS {TABLE}_expires_at ON {TABLE} (expires_at)",
+    )
+
+    def __init__(self, url: Optional[str] = DATABASE_URL, pool_size: int = SESSION_STORE_POOL_SIZE):
+        super().__init__()
+        if not url:
+            raise RuntimeError("SESSION_STORE=postgres needs DATABASE_URL")
+        # Imported here: only deployments using Postgres pay for (or need) the driver
+        from psycopg2.pool import ThreadedConnectionPool
+
+        self.pool = ThreadedConnectionPool(1, pool_size, url, connect_timeout=SESSION_STORE_CONNECT_TIMEOUT_SECONDS)
+
+    @contextmanager
+    def _cursor(self) -> Iterator[Any]:
+        connection = self.pool.getconn()
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                yield cursor
+        finally:
+            # A connection the server dropped is discarded rather than handed out again
+            self.pool.putconn(connection, close=bool(connection.closed))
+
+    def close(self) -> None:
+        self.pool.closeall()
+
+
+_backend: Optional[SqlBackend] = None
+# False after a backend call failed, until the background task has reached the backend again
+_backend_healthy = False
+_backend_lock = threading.Lock()
+_executor = ThreadPoolExecutor(SESSION_STORE_POOL_SIZE, thread_name_prefix="session-store")
+
+
+async def run_blocking(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a blocking backend call on the store's threads, giving up after SESSION_STORE_TIMEOUT_MS."""
+    call = asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+    return await asyncio.wait_for(call, SESSION_STORE_TIMEOUT_MS / 1000)
+
+
+def open_session_backend() -> Optional[SqlBackend]:
+    """
+    Open the configured shared backend and ensure its table, or check an
+    open one is reachable again (None for memory); blocks, and raises if it
+    cannot.
+    """
+    global _backend, _backend_healthy
+    if SESSION_STORE == "memory":
+        return None
+    with _backend_lock:
+        if _backend is None:
+            if SESSION_STORE == "sqlite":
+                backend = SqliteBackend()
+            elif SESSION_STORE == "postgres":
+                backend = PostgresBackend()
+            else:
+                raise ValueError(f"Unknown SESSION_STORE: {SESSION_STORE!r}")
+            backend.create()
+            _backend = backend
+            log.info("Session store opened", backend=backend.name)
+        elif not _backend_healthy:
+            _backend.ping()
+            log.info("Session store reachable again", backend=_backend.name)
+        _backend_healthy = True
+    return _backend
+
+
+async def keep_session_backend(retry_seconds: float = SESSION_STORE_RETRY_SECONDS) -> None:
+    """
+    Background task: open the shared backend, and reopen it whenever a call
+    has failed, every `retry_seconds` until it answers. Requests never
+    connect themselves; until then they use the near-cache alone.
+    """
+    if SESSION_STORE == "memory":
+        return
+    while True:
+        if not _backend_healthy:
+            try:
+                await asyncio.get_running_loop().run_in_executor(_executor, open_session_backend)
+            except Exception as e:
+                log.error("Session store unavailable", backend=SESSION_STORE, error=str(e))
+        await asyncio.sleep(retry_seconds)
+
+
+def session_backend_failed(error: BaseException) -> None:
+    """Stop using the backend until the background task reaches it again."""
+    global _backend_healthy
+    if _backend_healthy:
+        _backend_healthy = False
+        log.error("Session store failed, using the near-cache", backend=SESSION_STORE, error=repr(error))
+
+
+def close_session_backend() -> None:
+    global _backend, _backend_healthy
+    with _backend_lock:
+        if _backend is not None:
+            _backend.close()
+            _backend, _backend_healthy = None, False
+
+
+def session_backend() -> Optional[SqlBackend]:
+    """The shared backend, or None (memory mode, or not reachable: callers use the near-cache alone); never connects."""
+    return _backend if _backend_healthy else None
+
+
+# =====
+# Near-Cached Store
+# =====
+def _encode_json(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+@dataclass
+class _Entry(Generic[V]):
+    value: V
+    # Version of the shared row the value came from (None in memory mode)
+    version: Optional[int]
+    # When the value was last confirmed current, and last written by this worker (monotonic)
+    checked: float
+    written: float = 0.0
+
+
+class SessionStore(Generic[V]):
+    """
+    Per-session values, kept in a bounded local near-cache in front of the
+    shared backend (if one is configured).
+
+    `load()` brings a session's value up to date as a turn starts: within
+    SESSION_STORE_FRESH_MS of the entry last being confirmed it is served
+    locally; otherwise one query checks the row's version and fetches the
+    value only if another worker has written it since. `get()` then reads
+    the near-cache alone, so code inside the run never waits on the backend.
+    `save()` writes through, except a rewrite of an unchanged value inside a
+    quarter of the TTL. Backend calls run on their own threads, bounded by
+    SESSION_STORE_TIMEOUT_MS; if one fails, the store carries on with the
+    near-cache alone, as memory mode does, until the backend is reachable.
+    """
+
+    def __init__(
+        self,
+        namespace: str,
+        maxsize: int,
+        ttl: float,
+        encode: Callable[[V], bytes] = _encode_json,
+        decode: Callable[[bytes], V] = json.loads,
+        backend: Callable[[], Optional[SqlBackend]] = session_backend,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self._backend = backend
+        self.near: TTLCache[Hashable, _Entry[V]] = TTLCache(maxsize, ttl, name=namespace)
+        self.checks = 0
+        self.fetches = 0
+        self.writes = 0
+        self.skipped_writes = 0
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return len(self.near)
+
+    def _key(self, key: Hashable) -> str:
+        return key if isinstance(key, str) else json.dumps(key)
+
+    def _failed(self, action: str, error: BaseException) -> None:
+        self.errors += 1
+        log.warning(f"Session store {action} failed", namespace=self.namespace, error=repr(error))
+        session_backend_failed(error)
+
+    def get(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        """The near-cache's value (as of the last load or save on this worker)."""
+        entry = self.near.get(key)
+        return entry.value if entry else default
+
+    async def load(self, key: Hashable, default: Optional[V] = None) -> Optional[V]:
+        """The session's current value, checked against the shared backend unless confirmed moments ago."""
+        entry = self.near.get(key)
+        backend = self._backend()
+        if backend is None or (entry and time.monotonic() - entry.checked < SESSION_STORE_FRESH_MS / 1000):
+            return entry.value if entry else default
+
+        self.checks += 1
+        try:
+            version, payload = await run_blocking(
+                backend.fetch, self.namespace, self._key(key), entry.version if entry else None
+            )
+        except Exception as e:
+            self._failed("read", e)
+            return entry.value if entry else default
+        now = time.monotonic()
+        if version is None:
+            if entry:
+                self.near.pop(key)
+            return default
+        if payload is None:
+            entry.checked = now
+            return entry.value
+        self.fetches += 1
+        value = self.decode(payload)
+        self.near.set(key, _Entry(value, version, now))
+        return value
+
+    async def save(self, key: Hashable, value: V) -> None:
+        backend = self._backend()
+        now = time.monotonic()
+        if backend is None:
+            self.near.set(key, _Entry(value, None, now))
+            return
+
+        entry = self.near.get(key)
+        if entry and entry.version is not None and now - entry.written < self.ttl / 4 and entry.value == value:
+            self.skipped_writes += 1
+            self.near.set(key, entry)
+            return
+        # Local first, so the rest of this turn sees it however long the write takes
+        self.near.set(key, _Entry(value, None, now, written=now))
+        self.writes += 1
+        try:
+            version = await run_blocking(backend.store, self.namespace, self._key(key), self.encode(value), self.ttl)
+        except Exception as e:
+            self._failed("write", e)
+            return
+        self.near.set(key, _Entry(value, version, now, written=now))
+
+    async def delete(self, key: Hashable) -> None:
+        self.near.pop(key)
+        if (backend := self._backend()) is not None:
+            try:
+                await run_blocking(backend.delete, self.namespace, self._key(key))
+            except Exception as e:
+                self._failed("delete", e)
+
+    def clear(self) -> None:
+        """Drop the near-cache (the shared rows stay, and expire)."""
+        self.near.clear()
+
+    def stats(self) -> dict:
+        backend = self._backend()
+        return {
+            **self.near.stats(),
+            "backend": backend.name if backend else "memory" if SESSION_STORE == "memory" else "unavailable",
+            "backend_checks": self.checks,
+            "backend_fetches": self.fetches,
+            "backend_writes": self.writes,
+            "skipped_writes": self.skipped_writes,
+            "backend_errors": self.errors,
+        }
@@ -0,0 +1,175 @@
+"""
+AG-UI state sync
+Server-side state changes reach the browser as RFC 6902 JSON Patch deltas against the state the client sent
+"""
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Optional
+import json
+import os
+
+from pydantic import BaseModel
+
+from .log import get_logger
+
+if TYPE_CHECKING:
+    from ag_ui.core import BaseEvent
+
+# "delta" sends JSON Patch deltas (full snapshots only to resync); "snapshot" always sends the whole state
+STATE_SYNC_MODE = os.getenv("AGUI_STATE_SYNC", "delta")
+
+log = get_logger("StateSync")
+
+
+# =====
+# JSON Patch
+# =====
+def _pointer(path: str, key: Any) -> str:
+    return f"{path}/{str(key).replace('~', '~0').replace('/', '~1')}"
+
+
+def _same(old: Any, new: Any) -> bool:
+    # JSON tells 1, 1.0 and true apart; Python's == does not
+    return type(old) is type(new) and old == new
+
+
+def json_patch(old: Any, new: Any, path: str = "") -> list[dict]:
+    """
+    RFC 6902 operations turning `old` into `new` (both JSON values).
+
+    Objects are diffed member by member, changed members set with "add"
+    (which replaces an existing member, and so also applies when the client
+    left out a null one). Arrays that only grew get their new items appended
+    at "-", arrays cut short lose their tail; any other change to an array
+    or a scalar replaces it whole.
+    """
+    if _same(old, new):
+        return []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = [{"op": "remove", "path": _pointer(path, key)} for key in old if key not in new]
+        for key, value in new.items():
+            if key in old and isinstance(old[key], (dict, list)) and type(old[key]) is type(value):
+                ops.extend(json_patch(old[key], value, _pointer(path, key)))
+            elif key not in old or not _same(old[key], value):
+                ops.append({"op": "add", "path": _pointer(path, key), "value": value})
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        if all(_same(a, b) for a, b in zip(old[:common], new[:common])):
+            if len(new) > common:
+                return [{"op": "add", "path": f"{path}/-", "value": value} for value in new[common:]]
+            return [{"op": "remove", "path": f"{path}/{index}"} for index in reversed(range(common, len(old)))]
+    return [{"op": "replace", "path": path, "value": new}]
+
+
+def _without_nulls(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {key: _without_nulls(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [_without_nulls(item) for item in value]
+    return value
+
+
+# =====
+# Sync
+# =====
+@dataclass
+class StateSyncStats:
+    runs: int = 0
+    deltas: int = 0
+    snapshots: int = 0
+    # Snapshots sent because the client's copy was unknown (or a delta would have been larger)
+    resyncs: int = 0
+    # JSON bytes of state events sent
+    bytes: int = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "runs": self.runs,
+            "deltas": self.deltas,
+            "snapshots": self.snapshots,
+            "resyncs": self.resyncs,
+            "bytes": self.bytes,
+            "bytes_per_run": round(self.bytes / self.runs, 1) if self.runs else 0.0,
+        }
+
+
+state_sync_stats = StateSyncStats()
+
+
+class StateSync:
+    """
+    One run's view of the client's state.
+
+    The baseline is the state the client sent with the run: the copy it
+    holds and acknowledged. Each change is sent as a delta against it, and
+    the baseline moves on with every event sent, as the client applies them
+    in order. If the client's copy does not match the validated state (it
+    left out a list, or sent values the model coerced), patches could point
+    at paths it lacks, so the first change resyncs it with a full snapshot.
+    A client that sent no state at all (e.g. the state was restored from the
+    session store) is sent a snapshot even if the run changes nothing.
+    """
+
+    def __init__(self, client_state: Optional[dict], state: BaseModel, mode: Optional[str] = None):
+        self.mode = mode or STATE_SYNC_MODE
+        current = state.model_dump(mode="json")
+        known = isinstance(client_state, dict) and _without_nulls(
+            {key: client_state.get(key) for key in current}
+        ) == _without_nulls(current)
+        self.baseline: Optional[dict] = current if known else None
+        # The state as of the client's last update (its own, or the last event sent); changes are detected against it
+        self.sent = current if isinstance(client_state, dict) else None
+
+    def events(self, state: BaseModel) -> list["BaseEvent"]:
+        """A delta or snapshot event if the state changed since the last one, else nothing."""
+        from ag_ui.core import StateDeltaEvent, StateSnapshotEvent
+
+        current = state.model_dump(mode="json")
+        if _same(current, self.sent):
+            return []
+        self.sent = current
+
+        event = None
+        if self.mode == "delta" and self.baseline is not None:
+            delta = StateDeltaEvent(delta=json_patch(self.baseline, current))
+            snapshot_size = len(json.dumps(current))
+            if len(json.dumps(delta.delta)) < snapshot_size:
+                event = delta
+                state_sync_stats.deltas += 1
+        if event is None:
+            event = StateSnapshotEvent(snapshot=current)
+            state_sync_stats.snapshots += 1
+            if self.mode == "delta":
+                state_sync_stats.resyncs += 1
+                log.debug("Resync with snapshot", client_state_known=self.baseline is not None)
+        self.baseline = current
+        state_sync_stats.bytes += len(event.model_dump_json(by_alias=True, exclude_none=True))
+        return [event]
+
+
+async def sync_state(
+    events: AsyncIterator["BaseEvent"],
+    client_state: Optional[dict],
+    state: Callable[[], BaseModel],
+    mode: Optional[str] = None,
+) -> AsyncIterator["BaseEvent"]:
+    """
+    Pass an AG-UI run's events through, adding state events where the run
+    changed `state()`: after each tool result (tools are what change it) and
+    before the run finishes.
+    """
+    from ag_ui.core import RunFinishedEvent, ToolCallResultEvent
+
+    sync = None
+    state_sync_stats.runs += 1
+    async for event in events:
+        if sync is None:
+            # The adapter sets the run's state from the request as its stream starts
+            sync = StateSync(client_state, state(), mode)
+        if isinstance(event, RunFinishedEvent):
+            for update in sync.events(state()):
+                yield update
+        yield event
+        if isinstance(event, ToolCallResultEvent):
+            for update in sync.events(state()):
+                yield update
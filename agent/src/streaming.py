@@ -0,0 +1,270 @@
+"""
+SSE streaming helpers for the CLM endpoint
+OpenAI-compatible chat.completion.chunk encoding for Hume EVI
+"""
+from json.encoder import encode_basestring_ascii
+from typing import AsyncIterator, Optional
+import asyncio
+import os
+import re
+import time
+
+CLM_MODEL_NAME = "hitl-quest-agent"
+
+# Coalescing budget: buffered deltas are flushed once either limit is reached.
+# A byte budget of 0 sends every delta as its own chunk.
+SSE_COALESCE_BYTES = int(os.getenv("SSE_COALESCE_BYTES", "48"))
+SSE_COALESCE_MS = float(os.getenv("SSE_COALESCE_MS", "25"))
+
+# Output mode for /chat/completions: "voice" strips markdown and emits whole
+# sentences for TTS, "markdown" passes the agent text through untouched.
+CLM_OUTPUT_MODE = os.getenv("CLM_OUTPUT_MODE", "voice")
+
+SSE_DONE = b"data: [DONE]\n\n"
+
+_END_OF_STREAM = object()
+
+
+class SSEChunkEncoder:
+    """
+    Pre-rendered chat.completion.chunk encoder for a single response.
+
+    The id/object/created/model prefix and the choices suffix are rendered to
+    bytes once, so encoding a delta only escapes the delta text itself.
+    """
+
+    def __init__(self, msg_id: str, model: str = CLM_MODEL_NAME, created: Optional[int] = None):
+        created = int(time.time()) if created is None else created
+        head = (
+            f'data: {{"id": {encode_basestring_ascii(msg_id)}, "object": "chat.completion.chunk", '
+            f'"created": {created}, "model": {encode_basestring_ascii(model)}, '
+        )
+        self._prefix = (head + '"choices": [{"index": 0, "delta": {"content": ').encode()
+        self._suffix = b'}, "finish_reason": null}]}\n\n'
+        self._final = (head + '"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}\n\n').encode()
+
+    def encode(self, text: str) -> bytes:
+        """Encode one content delta as an SSE event."""
+        return self._prefix + encode_basestring_ascii(text).encode() + self._suffix
+
+    def finish(self) -> bytes:
+        """Encode the stop chunk and the [DONE] sentinel."""
+        return self._final + SSE_DONE
+
+
+async def encode_sse_stream(
+    deltas: AsyncIterator[str],
+    msg_id: str,
+    max_bytes: int = SSE_COALESCE_BYTES,
+    max_delay_ms: float = SSE_COALESCE_MS,
+) -> AsyncIterator[bytes]:
+    """
+    Encode text deltas as SSE chunks, coalescing them by a byte or time budget.
+
+    The first delta is always flushed immediately so time-to-first-chunk is not
+    traded for fewer chunks. After that, deltas are joined until `max_bytes` of
+    text is buffered or `max_delay_ms` has passed since the oldest buffered
+    delta. The time budget is enforced while waiting on the source, so a slow
+    model never leaves text sitting in the buffer; there are no fixed sleeps.
+    """
+    encoder = SSEChunkEncoder(msg_id)
+
+    if max_bytes <= 0:
+        async for delta in deltas:
+            if delta:
+                yield encoder.encode(delta)
+        yield encoder.finish()
+        return
+
+    # A single pump task drains the source so the time budget can be enforced
+    # without creating a task per delta.
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for delta in deltas:
+                if delta:
+                    queue.put_nowait(delta)
+        except Exception as e:
+            queue.put_nowait(e)
+        finally:
+            queue.put_nowait(_END_OF_STREAM)
+
+    pump_task = asyncio.create_task(pump())
+    max_delay = max_delay_ms / 1000
+    buffer: list[str] = []
+    buffered = 0
+    deadline = 0.0
+    first = True
+
+    try:
+        while True:
+            if buffer and queue.empty():
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(deadline - time.monotonic(), 0))
+                except asyncio.TimeoutError:
+                    # Time budget exhausted while the model is still thinking
+                    yield encoder.encode("".join(buffer))
+                    buffer.clear()
+                    buffered = 0
+                    continue
+            else:
+                item = await queue.get()
+
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if first:
+                first = False
+                yield encoder.encode(item)
+                continue
+
+            if not buffer:
+                deadline = time.monotonic() + max_delay
+            buffer.append(item)
+            buffered += len(item.encode())
+            if buffered >= max_bytes:
+                yield encoder.encode("".join(buffer))
+                buffer.clear()
+                buffered = 0
+
+        if buffer:
+            yield encoder.encode("".join(buffer))
+        yield encoder.finish()
+    finally:
+        pump_task.cancel()
+
+
+# =====
+# Voice Output (markdown stripping + sentence-aligned chunking)
+# =====
+# Buffered text longer than this is split at the last clause boundary (, ; :)
+# rather than waiting for the end of a long sentence.
+VOICE_CLAUSE_MIN_CHARS = int(os.getenv("VOICE_CLAUSE_MIN_CHARS", "120"))
+
+_SENTENCE_END = re.compile(r'[.!?]+["\')\]]*(?=\s)|\n')
+_CLAUSE_END = re.compile(r'[,;:](?=\s)|\s[-\u2013\u2014]\s')
+_ABBREVIATIONS = frozenset({"e.g", "i.e", "etc", "vs", "mr", "mrs", "ms", "dr", "st", "inc", "ltd"})
+
+_LINE_MARKER = re.compile(r'^\s*(?:[-*+]\s+|\d+[.)]\s+|#{1,6}\s*|>\s*)+')
+_TABLE_RULE = re.compile(r'^\s*\|?\s*:?-{2,}:?\s*(?:\|\s*:?-{2,}:?\s*)*\|?\s*$')
+_IMAGE = re.compile(r'!\[([^\]]*)\]\([^)]*\)')
+_LINK = re.compile(r'\[([^\]]+)\]\([^)]*\)')
+_EMPHASIS = re.compile(r'\*+|~~|`+|(?<!\w)_+|_+(?!\w)')
+_PIPES = re.compile(r'\s*\|\s*')
+_SPACES = re.compile(r'[ \t]+')
+
+
+def strip_markdown(segment: str) -> str:
+    """Remove markdown syntax from one line-or-shorter segment of text."""
+    if _TABLE_RULE.match(segment):
+        return ""
+    text = _IMAGE.sub(r'\1', segment)
+    text = _LINK.sub(r'\1', text)
+    text = _EMPHASIS.sub('', text)
+    if '|' in text:
+        text = ", ".join(cell for cell in _PIPES.split(text) if cell)
+    return _SPACES.sub(' ', text).strip()
+
+
+class VoiceTextTransformer:
+    """
+    Incrementally turns streamed markdown into speakable, sentence-aligned chunks.
+
+    Text is buffered until a sentence boundary (or a clause boundary once the
+    buffer is long), then the completed segment is stripped of markdown and
+    emitted. Line-level markers (bullets, numbered items, headings, quotes) are
+    removed as each line starts, and list items or table rows without closing
+    punctuation get a full stop so TTS pauses between them.
+    """
+
+    def __init__(self, clause_min_chars: int = VOICE_CLAUSE_MIN_CHARS):
+        self._buffer = ""
+        self._at_line_start = True
+        self._clause_min_chars = clause_min_chars
+
+    def feed(self, delta: str) -> list[str]:
+        """Add a delta and return any chunks that are now complete."""
+        self._buffer += delta
+        chunks = []
+        while True:
+            if self._at_line_start and not self._strip_line_marker():
+                break
+            end = self._find_boundary()
+            if end is None:
+                break
+            chunk = self._take(end)
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+    def flush(self) -> list[str]:
+        """Emit whatever is left at the end of the stream."""
+        if self._at_line_start:
+            self._buffer = _LINE_MARKER.sub('', self._buffer)
+        chunk = self._clean(self._buffer, line_end=False)
+        self._buffer = ""
+        self._at_line_start = True
+        return [chunk] if chunk else []
+
+    def _strip_line_marker(self) -> bool:
+        """Drop a leading list/heading marker; False while it's too early to tell."""
+        stripped = self._buffer.lstrip(' \t')
+        if not stripped:
+            return False
+        if stripped[0] == '\n':
+            self._buffer = stripped[1:]
+            return bool(self._buffer) and self._strip_line_marker()
+        # Wait for the first word so "1." or "-" can be told apart from content
+        if not re.search(r'[^\s\d#>*+.)-]', stripped):
+            return False
+        self._buffer = _LINE_MARKER.sub('', stripped)
+        self._at_line_start = False
+        return True
+
+    def _find_boundary(self) -> Optional[int]:
+        for match in _SENTENCE_END.finditer(self._buffer):
+            if match.group() == '\n':
+                return match.end()
+            words = self._buffer[:match.start()].rsplit(None, 1)
+            if words and words[-1].lower().rstrip('.') in _ABBREVIATIONS:
+                continue
+            return match.end()
+        if len(self._buffer) >= self._clause_min_chars:
+            clauses = list(_CLAUSE_END.finditer(self._buffer))
+            if clauses:
+                return clauses[-1].end()
+        return None
+
+    def _take(self, end: int) -> str:
+        segment, self._buffer = self._buffer[:end], self._buffer[end:]
+        line_end = segment.endswith('\n')
+        if line_end:
+            self._at_line_start = True
+        return self._clean(segment, line_end)
+
+    @staticmethod
+    def _clean(segment: str, line_end: bool) -> str:
+        text = strip_markdown(segment)
+        if not text:
+            return ""
+        if line_end and text[-1] not in '.!?,;:':
+            text += '.'
+        return text + ' '
+
+
+async def voice_chunks(deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Transform streamed agent text into markdown-free, sentence-aligned chunks."""
+    transformer = VoiceTextTransformer()
+    async for delta in deltas:
+        for chunk in transformer.feed(delta):
+            yield chunk
+    for chunk in transformer.flush():
+        yield chunk
+
+
+def to_voice_text(text: str) -> str:
+    """Apply the voice transformation to a complete response."""
+    transformer = VoiceTextTransformer()
+    return "".join(transformer.feed(text) + transformer.flush()).strip()
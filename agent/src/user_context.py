@@ -0,0 +1,158 @@
+"""
+User context for agent sessions
+Parses user info out of CopilotKit instructions / Hume system prompts and keeps it per session (see session_store.py)
+"""
+from typing import Optional
+import hashlib
+import os
+import re
+
+from .cache import TTLCache
+from .log import get_logger
+from .session_store import SessionStore
+
+USER_CONTEXT_MAX_SESSIONS = int(os.getenv("USER_CONTEXT_MAX_SESSIONS", "10000"))
+USER_CONTEXT_TTL_SECONDS = float(os.getenv("USER_CONTEXT_TTL_SECONDS", "3600"))
+PROMPT_PARSE_CACHE_SIZE = int(os.getenv("PROMPT_PARSE_CACHE_SIZE", "4096"))
+
+log = get_logger("Agent")
+
+# Parsed user info per session (CLM session key or AG-UI thread), shared between workers
+user_context_cache: SessionStore[dict] = SessionStore("user_context", USER_CONTEXT_MAX_SESSIONS, USER_CONTEXT_TTL_SECONDS)
+
+# Parse results per prompt digest; a session's prompt is identical on every turn
+prompt_parse_cache: TTLCache[bytes, dict] = TTLCache(
+    PROMPT_PARSE_CACHE_SIZE, USER_CONTEXT_TTL_SECONDS, name="prompt_parse"
+)
+
+
+# =====
+# System Prompt Parsing
+# =====
+# Supported formats, highest priority first (the first occurrence of the
+# highest-priority format wins, as with the original chain of re.search calls):
+#   name:  "User Name: X" (CopilotKit), "- Name: X" (HeroVoice), "Name: X", "first name (X)"
+#   email: "User Email: X" (CopilotKit), "- Email: X" (HeroVoice), "Email: X"
+#   id:    "User ID: <hex/dashes>"
+_ID_VALUE = re.compile(r'\s*([a-f0-9-]+)', re.IGNORECASE)
+_LINE_VALUE = re.compile(r'\s*([^\n]+)')
+_TOKEN_VALUE = re.compile(r'\s*([^\s\n]+)')
+_PAREN_NAME = re.compile(r'first name \(([^)]+)\)', re.IGNORECASE)
+
+# Fallback for text whose lowercase form changes length (rare Unicode), where
+# offsets in the lowered copy would not line up with the original
+_ID_PATTERN = re.compile(r'User ID:\s*([a-f0-9-]+)', re.IGNORECASE)
+_NAME_PATTERNS = [
+    re.compile(r'User Name:\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'-\s*Name:\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'Name:\s*([^\n]+)', re.IGNORECASE),
+    _PAREN_NAME,
+]
+_EMAIL_PATTERNS = [
+    re.compile(r'User Email:\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'-\s*Email:\s*([^\n]+)', re.IGNORECASE),
+    re.compile(r'Email:\s*([^\s\n]+)', re.IGNORECASE),
+]
+
+_UNMATCHED = 99
+
+
+def _dash_before(lowered: str, index: int) -> bool:
+    """True if only whitespace separates `index` from a preceding '-'."""
+    index -= 1
+    while index >= 0 and lowered[index].isspace():
+        index -= 1
+    return index >= 0 and lowered[index] == '-'
+
+
+def _parse_with_patterns(text: str) -> dict:
+    result = {"user_id": None, "name": None, "email": None}
+    if match := _ID_PATTERN.search(text):
+        result["user_id"] = match.group(1)
+    for pattern in _NAME_PATTERNS:
+        if match := pattern.search(text):
+            result["name"] = match.group(1).strip()
+            break
+    for pattern in _EMAIL_PATTERNS:
+        if match := pattern.search(text):
+            result["email"] = match.group(1).strip()
+            break
+    return result
+
+
+def parse_user_fields(text: str) -> dict:
+    """
+    Extract user id, name and email in a single scan over the text.
+
+    The text is lowercased once and walked colon by colon; each "...id:",
+    "...name:" or "...email:" key is classified by what precedes it, and only
+    the value after a key that beats the current best is matched.
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text):
+        return _parse_with_patterns(text)
+
+    user_id = None
+    name, name_rank = None, _UNMATCHED
+    email, email_rank = None, _UNMATCHED
+
+    pos = lowered.find(':')
+    while pos != -1:
+        head = lowered[max(0, pos - 10):pos]
+        if head.endswith("user id"):
+            if user_id is None and (match := _ID_VALUE.match(text, pos + 1)):
+                user_id = match.group(1)
+        elif head.endswith("name"):
+            rank = 0 if head.endswith("user name") else 1 if _dash_before(lowered, pos - 4) else 2
+            if rank < name_rank and (match := _LINE_VALUE.match(text, pos + 1)):
+                name, name_rank = match.group(1).strip(), rank
+        elif head.endswith("email"):
+            rank = 0 if head.endswith("user email") else 1 if _dash_before(lowered, pos - 5) else 2
+            if rank < email_rank:
+                match = (_TOKEN_VALUE if rank == 2 else _LINE_VALUE).match(text, pos + 1)
+                if match:
+                    email, email_rank = match.group(1).strip(), rank
+
+        if user_id is not None and name_rank == 0 and email_rank == 0:
+            break
+        pos = lowered.find(':', pos + 1)
+
+    if name is None and "first name (" in lowered:
+        if match := _PAREN_NAME.search(text):
+            name = match.group(1).strip()
+
+    return {"user_id": user_id, "name": name, "email": email}
+
+
+def extract_user_from_instructions(instructions: str) -> dict:
+    """Extract user info from CopilotKit instructions text or Hume system prompt (memoized per prompt)."""
+    if not instructions:
+        return {"user_id": None, "name": None, "email": None}
+
+    digest = hashlib.sha256(instructions.encode()).digest()[:16]
+    result = prompt_parse_cache.get(digest)
+    if result is None:
+        result = parse_user_fields(instructions)
+        prompt_parse_cache.set(digest, result)
+    return dict(result)
+
+
+# =====
+# Session Cache
+# =====
+async def remember_user_context(session_id: Optional[str], user_info: dict) -> dict:
+    """Store user info for a session if it identifies a user; otherwise return what's stored (call as a turn starts)."""
+    if not session_id:
+        return user_info
+    if user_info.get("user_id") or user_info.get("name"):
+        await user_context_cache.save(session_id, user_info)
+        log.debug("Cached user context", session=session_id)
+        return user_info
+    return await user_context_cache.load(session_id) or user_info
+
+
+def get_user_context(session_id: Optional[str]) -> dict:
+    """Get a session's user info as remembered when its turn started (no shared store round-trip)."""
+    if not session_id:
+        return {}
+    return user_context_cache.get(session_id) or {}
@@ -0,0 +1,44 @@
+"""
+Tests for the CLM message history store
+Run from the agent/ directory: python -m unittest tests.test_history
+"""
+import unittest
+
+from pydantic_ai.messages import ModelRequest, ModelResponse, TextPart, ToolCallPart, ToolReturnPart, UserPromptPart
+
+from src.history import HistoryStore, fingerprint
+from src.streaming import to_voice_text
+
+REPLY = (
+    "Here are our main services:\n\n"
+    "1. **Voice Call Systems** for inbound support\n"
+    "2. **Document Processing**, see [the overview](https://hitl.quest/services)\n\n"
+    "Which one fits your team?"
+)
+
+
+class HistoryStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def test_voice_echo_of_markdown_reply_keeps_stored_history(self):
+        store = HistoryStore(max_sessions=10, ttl_seconds=60)
+        question = ("user", "What services do you offer?")
+        messages = [
+            ModelRequest(parts=[UserPromptPart(question[1])]),
+            ModelResponse(parts=[ToolCallPart("get_services", {}, tool_call_id="c1")], model_name="test"),
+            ModelRequest(parts=[ToolReturnPart("get_services", {"services": []}, tool_call_id="c1")]),
+            ModelResponse(parts=[TextPart(REPLY)], model_name="test"),
+        ]
+        await store.save("sid:s1", [question], messages, REPLY)
+
+        # Hume sends back what it spoke: no list markers, no link URL
+        turns = [question, ("assistant", to_voice_text(REPLY)), ("user", "Tell me about voice")]
+        history = await store.resolve("sid:s1", turns)
+
+        self.assertEqual(history, messages)
+
+    def test_reply_and_its_voice_text_match(self):
+        self.assertEqual(fingerprint("assistant", REPLY), fingerprint("assistant", to_voice_text(REPLY)))
+        self.assertNotEqual(fingerprint("assistant", REPLY), fingerprint("user", REPLY))
+
+
+if __name__ == "__main__":
+    unittest.main()